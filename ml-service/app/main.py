@@ -2,14 +2,23 @@
 ML Service - Microservice for Machine Learning operations
 Handles CLIP embeddings, image analysis, and AI text generation
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List
 import os
 
-from .services.clip_service import get_text_embedding, get_image_embedding
+from .services.clip_service import batch_image_embeddings
+from .services.inference import (
+    text_batcher, image_batcher, start_batchers, stop_batchers,
+    embed_text, embed_texts_many, embed_image_urls, cache_stats
+)
 from .services.ai_service import generate_trend_summary
+from .services.transport import EMBEDDINGS_MEDIA_TYPE, negotiate, encode_embeddings
+from .services.lifecycle import preload, is_ready, lifecycle_stats
+from .services.image_hash import dedup_stats
 
 app = FastAPI(
     title="Rizko.ai ML Service",
@@ -33,8 +42,12 @@ class TextEmbeddingRequest(BaseModel):
 class ImageEmbeddingRequest(BaseModel):
     image_url: str
 
+class BatchTextEmbeddingRequest(BaseModel):
+    texts: List[str]
+
 class BatchImageEmbeddingRequest(BaseModel):
     image_urls: List[str]
+    batch_size: Optional[int] = None
 
 class TrendSummaryRequest(BaseModel):
     description: str
@@ -54,6 +67,19 @@ class SummaryResponse(BaseModel):
     summary: str
 
 
+# Lifecycle
+@app.on_event("startup")
+async def startup():
+    # Load + warm up before this worker accepts traffic
+    await preload()
+    start_batchers()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_batchers()
+
+
 # Health Check
 @app.get("/")
 def health_check():
@@ -68,12 +94,61 @@ def health_check():
     }
 
 
+@app.get("/health/live")
+def health_live():
+    """Liveness: the process is up (restart only if this fails)"""
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+def health_ready():
+    """Readiness: model loaded and warmed up (route traffic only when 200)"""
+    stats = lifecycle_stats()
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": "not_ready", **stats})
+    return {"status": "ready", **stats}
+
+
+@app.get("/metrics")
+def metrics():
+    """Micro-batching + embedding cache stats"""
+    return {
+        "batchers": {
+            "text": text_batcher.stats(),
+            "image": image_batcher.stats(),
+        },
+        "cache": cache_stats(),
+        "dedup": dedup_stats(),
+        "worker": lifecycle_stats(),
+    }
+
+
 # CLIP Embeddings
+def _embeddings_response(embeddings: List[Optional[List[float]]], accept: Optional[str]):
+    """JSON BatchEmbeddingResponse, or the binary format if the client asked for it"""
+    success_count = sum(1 for e in embeddings if e is not None)
+    failed_count = len(embeddings) - success_count
+
+    binary_dtype = negotiate(accept)
+    if binary_dtype:
+        return Response(
+            content=encode_embeddings(embeddings, binary_dtype),
+            media_type=EMBEDDINGS_MEDIA_TYPE,
+            headers={"X-Success-Count": str(success_count), "X-Failed-Count": str(failed_count)}
+        )
+
+    return BatchEmbeddingResponse(
+        embeddings=embeddings,
+        success_count=success_count,
+        failed_count=failed_count
+    )
+
+
 @app.post("/embeddings/text", response_model=EmbeddingResponse)
-def create_text_embedding(request: TextEmbeddingRequest):
-    """Generate CLIP embedding for text"""
+async def create_text_embedding(request: TextEmbeddingRequest):
+    """Generate CLIP embedding for text (micro-batched with concurrent requests)"""
     try:
-        embedding = get_text_embedding(request.text)
+        embedding = await embed_text(request.text)
         if embedding is None:
             raise HTTPException(status_code=500, detail="Failed to generate text embedding")
 
@@ -86,10 +161,10 @@ def create_text_embedding(request: TextEmbeddingRequest):
 
 
 @app.post("/embeddings/image", response_model=EmbeddingResponse)
-def create_image_embedding(request: ImageEmbeddingRequest):
-    """Generate CLIP embedding for image"""
+async def create_image_embedding(request: ImageEmbeddingRequest):
+    """Generate CLIP embedding for image (micro-batched with concurrent requests)"""
     try:
-        embedding = get_image_embedding(request.image_url)
+        embedding = (await embed_image_urls([request.image_url]))[0]
         if embedding is None:
             raise HTTPException(status_code=500, detail="Failed to generate image embedding")
 
@@ -101,31 +176,49 @@ def create_image_embedding(request: ImageEmbeddingRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/embeddings/batch-texts", response_model=BatchEmbeddingResponse)
+async def create_batch_text_embeddings(
+    request: BatchTextEmbeddingRequest,
+    accept: Optional[str] = Header(None)
+):
+    """
+    Generate CLIP embeddings for multiple texts.
+    Texts go through the shared text micro-batcher (and embedding cache).
+    """
+    try:
+        embeddings = await embed_texts_many(request.texts)
+    except Exception as e:
+        print(f"⚠️ Batch text embedding error: {e}")
+        embeddings = [None] * len(request.texts)
+
+    return _embeddings_response(embeddings, accept)
+
+
 @app.post("/embeddings/batch-images", response_model=BatchEmbeddingResponse)
-def create_batch_image_embeddings(request: BatchImageEmbeddingRequest):
-    """Generate CLIP embeddings for multiple images"""
-    embeddings = []
-    success_count = 0
-    failed_count = 0
-
-    for url in request.image_urls:
-        try:
-            embedding = get_image_embedding(url)
-            if embedding:
-                embeddings.append(embedding)
-                success_count += 1
-            else:
-                embeddings.append(None)
-                failed_count += 1
-        except:
-            embeddings.append(None)
-            failed_count += 1
+async def create_batch_image_embeddings(
+    request: BatchImageEmbeddingRequest,
+    accept: Optional[str] = Header(None)
+):
+    """
+    Generate CLIP embeddings for multiple images.
+    Images share forward passes with other in-flight requests; an explicit
+    batch_size bypasses the shared batcher and uses fixed-size chunks.
+
+    Clients sending `Accept: application/vnd.rizko.embeddings` get the
+    compact binary format instead of JSON.
+    """
+    try:
+        if request.batch_size:
+            embeddings = await run_in_threadpool(
+                batch_image_embeddings, request.image_urls, request.batch_size
+            )
+        else:
+            embeddings = await embed_image_urls(request.image_urls)
+    except Exception as e:
+        print(f"⚠️ Batch embedding error: {e}")
+        embeddings = [None] * len(request.image_urls)
 
-    return BatchEmbeddingResponse(
-        embeddings=embeddings,
-        success_count=success_count,
-        failed_count=failed_count
-    )
+    return _embeddings_response(embeddings, accept)
 
 
 # AI Text Generation
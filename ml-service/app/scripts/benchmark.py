@@ -0,0 +1,255 @@
+"""
+ML Service benchmark.
+
+load:    fire concurrent single-item requests at a running service and report
+         client-side throughput/latency plus the service's batching stats (/metrics).
+parity:  compare ONNX (int8) embeddings with the PyTorch ones (cosine similarity).
+backend: in-process images/sec and RSS for one backend.
+decode:  full decode vs reduced-size decode (+ CLIP preprocessing): images/sec,
+         CPU time and peak RSS per path, each measured in a fresh process.
+
+Usage:
+    python -m app.scripts.benchmark load --url http://localhost:8001 --kind text --requests 500 --concurrency 32
+    python -m app.scripts.benchmark load --kind image --image-url https://... --requests 200
+    python -m app.scripts.benchmark parity --images ./covers/
+    CLIP_BACKEND=onnx python -m app.scripts.benchmark backend --batch-size 32 --batches 10
+    python -m app.scripts.benchmark decode --images ./covers/ --rounds 5
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(p * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def _sample_pixels(images_dir: str, count: int):
+    """Preprocessed pixels from a folder of images, or random pixels if none given"""
+    import torch
+    from app.services import clip_service
+
+    clip_service.load_clip()
+    pixels = []
+    if images_dir:
+        for name in sorted(os.listdir(images_dir))[:count]:
+            with open(os.path.join(images_dir, name), "rb") as f:
+                tensor = clip_service.preprocess_image(f.read())
+            if tensor is not None:
+                pixels.append(tensor)
+    if not pixels:
+        torch.manual_seed(0)
+        pixels = [torch.randn(3, 224, 224) for _ in range(count)]
+    return torch.stack(pixels)
+
+
+def run_parity(args) -> None:
+    import numpy as np
+    import torch
+
+    os.environ["CLIP_BACKEND"] = "torch"
+    from app.services import clip_service
+    from app.services.onnx_backend import load_onnx_backend
+
+    pixels = _sample_pixels(args.images, args.count)
+    texts = ["a cat dancing", "cooking pasta at home", "gym workout routine", "makeup tutorial"]
+
+    model = clip_service.get_torch_model()
+    with torch.no_grad():
+        ref_images = model.get_image_features(pixel_values=pixels).numpy()
+        tokens = clip_service._clip_processor(text=texts, return_tensors="pt", padding=True)
+        ref_texts = model.get_text_features(**tokens).numpy()
+
+    onnx = load_onnx_backend(clip_service.CLIP_MODEL_NAME, clip_service.get_torch_model, quantize=not args.fp32)
+    if onnx is None:
+        raise SystemExit("❌ ONNX backend unavailable")
+    onnx_images = onnx.image_features(pixels.numpy())
+    onnx_texts = onnx.text_features(tokens["input_ids"].numpy(), tokens["attention_mask"].numpy())
+
+    def cosine(a, b):
+        a = a / np.linalg.norm(a, axis=1, keepdims=True)
+        b = b / np.linalg.norm(b, axis=1, keepdims=True)
+        return (a * b).sum(axis=1)
+
+    print("=" * 50)
+    for name, ref, out in (("image", ref_images, onnx_images), ("text", ref_texts, onnx_texts)):
+        cos = cosine(ref, out)
+        print(f"   {name:5s} cosine  min {cos.min():.4f}  mean {cos.mean():.4f}  (n={len(cos)})")
+        if cos.min() < args.threshold:
+            print(f"⚠️ {name} parity below threshold {args.threshold}")
+
+
+def run_backend(args) -> None:
+    from app.services import clip_service
+    from app.services.lifecycle import rss_mb
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    clip_service.load_clip()
+    load_seconds = time.perf_counter() - started
+    backend = clip_service.active_backend()
+
+    pixels = _sample_pixels(args.images, args.batch_size)
+    clip_service.embed_pixels(pixels)  # warm-up
+
+    started = time.perf_counter()
+    for _ in range(args.batches):
+        clip_service.embed_pixels(pixels)
+    elapsed = time.perf_counter() - started
+
+    print("=" * 50)
+    print(f"   Backend:     {backend}")
+    print(f"   Load time:   {load_seconds:.1f}s")
+    print(f"   Throughput:  {args.batch_size * args.batches / elapsed:.1f} images/s (batch {args.batch_size})")
+    print(f"   RSS:         {rss_mb():.0f}MB (model +{rss_mb() - rss_before:.0f}MB)")
+
+
+def _decode_worker(path_mode_rounds) -> dict:
+    """Runs in a fresh process so ru_maxrss is this path's peak only"""
+    import resource
+    from io import BytesIO
+    from PIL import Image
+    from transformers import CLIPProcessor
+    from app.services.clip_service import CLIP_MODEL_NAME
+    from app.services.image_decode import decode_rgb
+
+    images_dir, mode, rounds = path_mode_rounds
+    processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    datas = []
+    for name in sorted(os.listdir(images_dir)):
+        with open(os.path.join(images_dir, name), "rb") as f:
+            datas.append(f.read())
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    wall, cpu = time.perf_counter(), time.process_time()
+    decoded = 0
+    for _ in range(rounds):
+        for data in datas:
+            try:
+                if mode == "full":
+                    image = Image.open(BytesIO(data)).convert("RGB")
+                else:
+                    image = decode_rgb(data)
+                processor(images=image, return_tensors="pt")
+                decoded += 1
+            except Exception:
+                pass
+    return {
+        "images": decoded,
+        "wall": time.perf_counter() - wall,
+        "cpu": time.process_time() - cpu,
+        "peak_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb) / 1024,
+    }
+
+
+def run_decode(args) -> None:
+    if not args.images:
+        raise SystemExit("--images is required (folder of sample covers)")
+
+    results = {}
+    for mode in ("full", "reduced"):
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results[mode] = pool.submit(_decode_worker, (args.images, mode, args.rounds)).result()
+
+    print("=" * 50)
+    for mode, r in results.items():
+        per_image = r["cpu"] * 1000 / max(r["images"], 1)
+        print(f"   {mode:8} {r['images'] / r['wall']:7.1f} images/s   "
+              f"CPU {per_image:6.2f}ms/image   peak +{r['peak_mb']:.0f}MB")
+    full, reduced = results["full"], results["reduced"]
+    if full["cpu"]:
+        print(f"   CPU time saved: {(1 - reduced['cpu'] / full['cpu']) * 100:.0f}%")
+
+
+def run_load(args) -> None:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=args.concurrency, pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    if args.kind == "text":
+        endpoint = f"{args.url}/embeddings/text"
+        payloads = [{"text": f"trend video about topic {i}"} for i in range(args.requests)]
+    else:
+        if not args.image_url:
+            raise SystemExit("--image-url is required for --kind image")
+        endpoint = f"{args.url}/embeddings/image"
+        payloads = [{"image_url": args.image_url} for _ in range(args.requests)]
+
+    def call(payload):
+        started = time.perf_counter()
+        try:
+            ok = session.post(endpoint, json=payload, timeout=args.timeout).status_code == 200
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - started
+
+    print(f"🚀 {args.requests} {args.kind} requests, concurrency {args.concurrency} -> {endpoint}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(call, payloads))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(lat * 1000 for ok, lat in results if ok)
+    failed = sum(1 for ok, _ in results if not ok)
+
+    print("=" * 50)
+    print(f"   Succeeded:   {len(latencies)}  Failed: {failed}")
+    print(f"   Wall time:   {elapsed:.2f}s")
+    print(f"   Throughput:  {len(latencies) / elapsed:.1f} req/s")
+    print(f"   Latency p50: {_percentile(latencies, 0.50):.1f}ms")
+    print(f"   Latency p99: {_percentile(latencies, 0.99):.1f}ms")
+
+    try:
+        stats = session.get(f"{args.url}/metrics", timeout=args.timeout).json()["batchers"][args.kind]
+        print(f"   Service avg batch size: {stats['avg_batch_size']}")
+        print(f"   Service latency p50/p99: {stats['latency_ms']['p50']}ms / {stats['latency_ms']['p99']}ms")
+    except Exception as e:
+        print(f"⚠️ Could not read /metrics: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ML Service benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="Concurrent load test against a running service")
+    load.add_argument("--url", default="http://localhost:8001")
+    load.add_argument("--kind", choices=["text", "image"], default="text")
+    load.add_argument("--image-url", default=None)
+    load.add_argument("--requests", type=int, default=500)
+    load.add_argument("--concurrency", type=int, default=32)
+    load.add_argument("--timeout", type=float, default=60.0)
+    load.set_defaults(func=run_load)
+
+    parity = sub.add_parser("parity", help="ONNX vs PyTorch embedding cosine similarity")
+    parity.add_argument("--images", default=None, help="Folder of sample images (random pixels if omitted)")
+    parity.add_argument("--count", type=int, default=16)
+    parity.add_argument("--fp32", action="store_true", help="Compare the unquantized ONNX graphs")
+    parity.add_argument("--threshold", type=float, default=0.98)
+    parity.set_defaults(func=run_parity)
+
+    backend = sub.add_parser("backend", help="Images/sec and RSS for the configured CLIP_BACKEND")
+    backend.add_argument("--images", default=None)
+    backend.add_argument("--batch-size", type=int, default=32)
+    backend.add_argument("--batches", type=int, default=10)
+    backend.set_defaults(func=run_backend)
+
+    decode = sub.add_parser("decode", help="Full vs reduced-size image decode + preprocessing")
+    decode.add_argument("--images", default=None, help="Folder of sample covers")
+    decode.add_argument("--rounds", type=int, default=5)
+    decode.set_defaults(func=run_decode)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
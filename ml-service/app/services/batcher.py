@@ -0,0 +1,185 @@
+"""
+Dynamic Micro-Batching
+Collects concurrent inference requests into one forward pass.
+
+Each request is queued with a future; a background task drains the queue
+until it has max_batch_size items or max_wait_ms has passed since the first
+item arrived, runs the batch function once (in a dedicated thread so the
+event loop stays free) and resolves every future with its own result.
+"""
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+
+class InferenceBatcher:
+    """Micro-batcher around a `fn(list_of_inputs) -> list_of_outputs` callable"""
+
+    STATS_WINDOW = 4096  # latency samples kept for percentiles
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0
+    ):
+        self.name = name
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # One thread per batcher: forward passes of the same kind never overlap
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"batcher-{name}")
+
+        # Stats
+        self._started_at = time.time()
+        self._requests = 0
+        self._batches = 0
+        self._failed = 0
+        self._compute_seconds = 0.0
+        self._samples: Deque[Tuple[float, float]] = deque(maxlen=self.STATS_WINDOW)  # (done_at, latency)
+
+    # -------------------------------------------------------------------------
+    # Lifecycle
+    # -------------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Start the batching loop on the running event loop (idempotent)"""
+        if self._task is not None and not self._task.done():
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        print(f"✅ Batcher '{self.name}' started (max_batch={self.max_batch_size}, max_wait={self.max_wait * 1000:.1f}ms)")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # -------------------------------------------------------------------------
+    # Submission
+    # -------------------------------------------------------------------------
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one input and wait for its output"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def submit_many(self, items: List[Any], return_exceptions: bool = False) -> List[Any]:
+        """
+        Queue several inputs (they may share batches with other requests).
+        return_exceptions: a failed batch yields its exception in place of
+        the output for the items it held instead of failing the whole call.
+        """
+        if not items:
+            return []
+        return list(await asyncio.gather(*(self.submit(item) for item in items), return_exceptions=return_exceptions))
+
+    # -------------------------------------------------------------------------
+    # Batching loop
+    # -------------------------------------------------------------------------
+
+    async def _collect(self) -> list:
+        first = await self._queue.get()
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already waiting without sleeping
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            inputs = [item for item, _, _ in batch]
+
+            try:
+                compute_started = time.perf_counter()
+                outputs = await loop.run_in_executor(self._executor, self.fn, inputs)
+                self._compute_seconds += time.perf_counter() - compute_started
+                if len(outputs) != len(inputs):
+                    raise RuntimeError(f"batch fn returned {len(outputs)} outputs for {len(inputs)} inputs")
+            except Exception as e:
+                print(f"⚠️ Batcher '{self.name}' batch of {len(batch)} failed: {e}")
+                self._failed += len(batch)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            done_at = time.perf_counter()
+            self._batches += 1
+            self._requests += len(batch)
+            for (_, future, queued_at), output in zip(batch, outputs):
+                self._samples.append((done_at, done_at - queued_at))
+                if not future.done():
+                    future.set_result(output)
+
+    # -------------------------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------------------------
+
+    def compute_ms_per_item(self) -> float:
+        """Average forward-pass time per item (excludes queueing)"""
+        if not self._requests:
+            return 0.0
+        return self._compute_seconds * 1000 / self._requests
+
+    def stats(self) -> Dict[str, Any]:
+        """Throughput, batch sizes and latency percentiles over the recent window"""
+        latencies = sorted(lat for _, lat in self._samples)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            idx = min(len(latencies) - 1, int(round(p * (len(latencies) - 1))))
+            return round(latencies[idx] * 1000, 2)
+
+        throughput = None
+        if len(self._samples) >= 2:
+            span = self._samples[-1][0] - self._samples[0][0]
+            if span > 0:
+                throughput = round(len(self._samples) / span, 2)
+
+        return {
+            "requests": self._requests,
+            "batches": self._batches,
+            "failed": self._failed,
+            "avg_batch_size": round(self._requests / self._batches, 2) if self._batches else 0,
+            "compute_ms_per_item": round(self.compute_ms_per_item(), 3),
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "throughput_per_sec": throughput,
+            "latency_ms": {
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+            },
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
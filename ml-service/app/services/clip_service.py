@@ -1,27 +1,113 @@
 """
 CLIP Model Service
 Handles text and image embeddings using OpenAI CLIP model
+
+Image batches go through a pipeline instead of one-by-one:
+1. Concurrent, bounded downloads (shared keep-alive session)
+2. Near-duplicate covers (perceptual hash) are embedded once
+3. Reduced-size decode (JPEG draft) + CLIP preprocessing in a worker pool
+4. Stacked pixel tensors -> get_image_features in EMBED_BATCH_SIZE chunks
+
+The forward pass runs on PyTorch (default) or a quantized ONNX Runtime
+graph, selected with CLIP_BACKEND=torch|onnx at startup.
 """
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List
+
 import requests
 import torch
 from PIL import Image
+from requests.adapters import HTTPAdapter
 from transformers import CLIPProcessor, CLIPModel
-from typing import Optional, List
+
+from .image_decode import CLIP_INPUT_SIZE, decode_rgb
+from .image_hash import dhash
+from .onnx_backend import ensure_onnx_export, load_onnx_backend
+
+CLIP_MODEL_NAME = os.getenv("CLIP_MODEL_NAME", "openai/clip-vit-base-patch32")
+CLIP_BACKEND = os.getenv("CLIP_BACKEND", "torch").lower()  # torch | onnx
+
+# Pipeline tuning
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))          # images per forward pass
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "16"))  # parallel image downloads
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "4"))       # decode/preprocess threads
+DOWNLOAD_TIMEOUT = 10
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
 
 # Global variables for lazy loading
 _clip_model = None
 _clip_processor = None
+_onnx_backend = None
+
+# Shared HTTP session (connection reuse across downloads) and worker pools
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(pool_connections=DOWNLOAD_CONCURRENCY, pool_maxsize=DOWNLOAD_CONCURRENCY))
+_http.mount("http://", HTTPAdapter(pool_connections=DOWNLOAD_CONCURRENCY, pool_maxsize=DOWNLOAD_CONCURRENCY))
+_http.headers.update({"User-Agent": "Mozilla/5.0"})
+
+_download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY, thread_name_prefix="clip-download")
+_preprocess_pool = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix="clip-preprocess")
+
+
+def get_torch_model():
+    """Load the PyTorch CLIP model (also used to export the ONNX graphs)"""
+    global _clip_model
+
+    if _clip_model is None:
+        try:
+            # safetensors are memory-mapped: no pickle, no extra copy while loading
+            _clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME, use_safetensors=True)
+        except (OSError, EnvironmentError):
+            _clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+        _clip_model.eval()
+    return _clip_model
+
+
+def preload_shared_weights():
+    """
+    Load weights in the gunicorn master (preload_app) so forked workers share
+    the tensor pages copy-on-write instead of each loading its own copy.
+
+    Nothing that doesn't survive fork is created here (CUDA context, ORT
+    sessions, torch thread pools): workers finish with load_clip() + warm_up().
+    """
+    global _clip_model, _clip_processor
+
+    if torch.cuda.is_available():
+        return  # GPU workers initialise CUDA themselves after fork
+
+    started = time.perf_counter()
+    if CLIP_BACKEND == "onnx":
+        # Export once here instead of racing in every worker; ORT graphs are small
+        if ensure_onnx_export(CLIP_MODEL_NAME, get_torch_model):
+            _clip_model = None
+            print(f"✅ ONNX graphs ready for workers ({time.perf_counter() - started:.1f}s)")
+            return
+
+    get_torch_model()
+    _clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    print(f"✅ CLIP weights preloaded for workers ({time.perf_counter() - started:.1f}s)")
 
 
 def load_clip():
     """Load CLIP model and processor (lazy loading)"""
-    global _clip_model, _clip_processor
+    global _clip_model, _clip_processor, _onnx_backend
 
-    if _clip_model is None:
-        print("🧠 Loading CLIP model...")
+    if _clip_processor is None:
+        print(f"🧠 Loading CLIP model (backend: {CLIP_BACKEND})...")
         try:
-            _clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-            _clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+            processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+
+            if CLIP_BACKEND == "onnx":
+                _onnx_backend = load_onnx_backend(CLIP_MODEL_NAME, get_torch_model)
+                if _onnx_backend is not None:
+                    _clip_model = None  # export done, free the fp32 weights
+                    _clip_processor = processor
+                    return
+
+            get_torch_model()
 
             # Move to GPU if available
             if torch.cuda.is_available():
@@ -29,104 +115,207 @@ def load_clip():
                 print("✅ CLIP loaded on GPU")
             else:
                 print("✅ CLIP loaded on CPU")
+            _clip_processor = processor
         except Exception as e:
             print(f"⚠️ CLIP loading error: {e}")
             raise
 
 
-def get_text_embedding(text: str) -> Optional[List[float]]:
+def warm_up(batch_size: int = 2) -> float:
     """
-    Convert text to embedding vector (512 dimensions)
+    Run one image and one text batch so the first real request doesn't pay
+    for lazy graph/allocator initialisation. Returns the warm-up time in ms.
+    """
+    load_clip()
+    started = time.perf_counter()
+    blank = Image.new("RGB", (256, 256))
+    pixels = _clip_processor(images=[blank] * batch_size, return_tensors="pt")["pixel_values"]
+    embed_pixels(pixels)
+    embed_texts(["warm up"] * batch_size)
+    return (time.perf_counter() - started) * 1000
 
-    Args:
-        text: Input text string
 
-    Returns:
-        List of floats representing the embedding, or None if failed
-    """
+def active_backend() -> str:
+    """Backend actually serving requests (onnx may fall back to torch)"""
     load_clip()
+    if _onnx_backend is not None:
+        return "onnx-int8" if _onnx_backend.quantized else "onnx"
+    return "torch"
 
-    if not _clip_model or not text:
-        return None
 
+def model_tag() -> str:
+    """Model + backend id (quantized vectors differ slightly from fp32 ones)"""
+    backend = active_backend()
+    return CLIP_MODEL_NAME if backend == "torch" else f"{CLIP_MODEL_NAME}+{backend}"
+
+
+def _to_device(inputs: dict) -> dict:
+    """Move processor outputs to GPU if model is on GPU"""
+    if torch.cuda.is_available():
+        return {k: v.cuda() for k, v in inputs.items()}
+    return inputs
+
+
+# =============================================================================
+# PIPELINE STAGES
+# =============================================================================
+
+def download_image(image_url: str) -> Optional[bytes]:
+    """Download raw image bytes (None on any failure)"""
     try:
-        inputs = _clip_processor(text=[text], return_tensors="pt", padding=True)
+        response = _http.get(image_url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        if response.status_code != 200:
+            print(f"⚠️ Failed to download image: {response.status_code}")
+            return None
 
-        # Move inputs to GPU if model is on GPU
-        if torch.cuda.is_available():
-            inputs = {k: v.cuda() for k, v in inputs.items()}
+        data = response.raw.read(MAX_IMAGE_BYTES + 1, decode_content=True)
+        if len(data) > MAX_IMAGE_BYTES:
+            print(f"⚠️ Image too large, skipped: {image_url[:80]}")
+            return None
+        return data
+    except Exception as e:
+        print(f"⚠️ Image download error for {image_url[:80]}: {e}")
+        return None
 
-        with torch.no_grad():
-            outputs = _clip_model.get_text_features(**inputs)
 
-        embedding = outputs.squeeze().cpu().numpy().tolist()
-        return embedding
+def preprocess_image(image_data: bytes) -> Optional[torch.Tensor]:
+    """Decode image bytes and run CLIP preprocessing -> pixel tensor (3, H, W)"""
+    try:
+        image = decode_rgb(image_data, CLIP_INPUT_SIZE)
+        inputs = _clip_processor(images=image, return_tensors="pt")
+        return inputs["pixel_values"][0]
     except Exception as e:
-        print(f"⚠️ Text embedding error: {e}")
+        print(f"⚠️ Image preprocessing error: {e}")
         return None
 
 
-def get_image_embedding(image_url: str) -> Optional[List[float]]:
+def _download_and_preprocess(image_url: str) -> Optional[torch.Tensor]:
+    data = download_image(image_url) if image_url else None
+    if data is None:
+        return None
+    return _preprocess_pool.submit(preprocess_image, data).result()
+
+
+def preprocess_urls(image_urls: List[str]) -> List[Optional[torch.Tensor]]:
+    """Download + preprocess all URLs concurrently, preserving input order"""
+    load_clip()
+    return list(_download_pool.map(_download_and_preprocess, image_urls))
+
+
+def download_images(image_urls: List[str]) -> List[Optional[bytes]]:
+    """Download all URLs concurrently, preserving input order"""
+    return list(_download_pool.map(lambda url: download_image(url) if url else None, image_urls))
+
+
+def preprocess_images(images: List[bytes]) -> List[Optional[torch.Tensor]]:
+    """Decode + preprocess already-downloaded images in the worker pool"""
+    load_clip()
+    return list(_preprocess_pool.map(preprocess_image, images))
+
+
+def hash_images(images: List[bytes]) -> List[Optional[int]]:
+    """Perceptual hashes of already-downloaded images (tiny decode, worker pool)"""
+    return list(_preprocess_pool.map(dhash, images))
+
+
+def embed_pixels(pixel_values: torch.Tensor, batch_size: Optional[int] = None) -> List[List[float]]:
+    """Run get_image_features over stacked pixel tensors (N, 3, H, W) in chunks"""
+    load_clip()
+    batch_size = batch_size or EMBED_BATCH_SIZE
+
+    embeddings: List[List[float]] = []
+    with torch.no_grad():
+        for start in range(0, pixel_values.shape[0], batch_size):
+            chunk = pixel_values[start:start + batch_size]
+            if _onnx_backend is not None:
+                embeddings.extend(_onnx_backend.image_features(chunk.numpy()).tolist())
+                continue
+            outputs = _clip_model.get_image_features(**_to_device({"pixel_values": chunk}))
+            embeddings.extend(outputs.cpu().numpy().tolist())
+    return embeddings
+
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Run get_text_features over a list of texts in one forward pass"""
+    load_clip()
+    if _onnx_backend is not None:
+        inputs = _clip_processor(text=texts, return_tensors="np", padding=True, truncation=True)
+        return _onnx_backend.text_features(inputs["input_ids"], inputs["attention_mask"]).tolist()
+
+    inputs = _clip_processor(text=texts, return_tensors="pt", padding=True, truncation=True)
+    with torch.no_grad():
+        outputs = _clip_model.get_text_features(**_to_device(dict(inputs)))
+    return outputs.cpu().numpy().tolist()
+
+
+# =============================================================================
+# PUBLIC API
+# =============================================================================
+
+def get_text_embedding(text: str) -> Optional[List[float]]:
     """
-    Download image and convert to embedding vector (512 dimensions)
+    Convert text to embedding vector (512 dimensions)
 
     Args:
-        image_url: URL of the image
+        text: Input text string
 
     Returns:
         List of floats representing the embedding, or None if failed
     """
     load_clip()
 
-    if not _clip_model or not image_url:
+    if _clip_processor is None or not text:
         return None
 
     try:
-        # Download image
-        response = requests.get(
-            image_url,
-            headers={"User-Agent": "Mozilla/5.0"},
-            stream=True,
-            timeout=10
-        )
-
-        if response.status_code != 200:
-            print(f"⚠️ Failed to download image: {response.status_code}")
-            return None
-
-        # Open image
-        image = Image.open(response.raw).convert("RGB")
+        return embed_texts([text])[0]
+    except Exception as e:
+        print(f"⚠️ Text embedding error: {e}")
+        return None
 
-        # Process image
-        inputs = _clip_processor(images=image, return_tensors="pt")
 
-        # Move inputs to GPU if model is on GPU
-        if torch.cuda.is_available():
-            inputs = {k: v.cuda() for k, v in inputs.items()}
+def get_image_embedding(image_url: str) -> Optional[List[float]]:
+    """
+    Download image and convert to embedding vector (512 dimensions)
 
-        with torch.no_grad():
-            outputs = _clip_model.get_image_features(**inputs)
+    Args:
+        image_url: URL of the image
 
-        embedding = outputs.squeeze().cpu().numpy().tolist()
-        return embedding
-    except Exception as e:
-        print(f"⚠️ Image embedding error for {image_url}: {e}")
+    Returns:
+        List of floats representing the embedding, or None if failed
+    """
+    if not image_url:
         return None
+    return batch_image_embeddings([image_url])[0]
 
 
-def batch_image_embeddings(image_urls: List[str]) -> List[Optional[List[float]]]:
+def batch_image_embeddings(image_urls: List[str], batch_size: Optional[int] = None) -> List[Optional[List[float]]]:
     """
-    Generate embeddings for multiple images
+    Generate embeddings for multiple images.
+    Downloads/preprocessing run concurrently; valid images are stacked and
+    embedded in batch_size chunks (50 covers = 1 forward pass, not 50).
 
     Args:
         image_urls: List of image URLs
+        batch_size: Images per forward pass (default EMBED_BATCH_SIZE)
 
     Returns:
-        List of embeddings (None for failed images)
+        List of embeddings (None for failed images), same order as input
     """
-    embeddings = []
-    for url in image_urls:
-        embedding = get_image_embedding(url)
-        embeddings.append(embedding)
+    embeddings: List[Optional[List[float]]] = [None] * len(image_urls)
+    if not image_urls:
+        return embeddings
+
+    pixels = preprocess_urls(image_urls)
+    valid = [i for i, p in enumerate(pixels) if p is not None]
+    if not valid:
+        return embeddings
+
+    try:
+        stacked = torch.stack([pixels[i] for i in valid])
+        for i, embedding in zip(valid, embed_pixels(stacked, batch_size)):
+            embeddings[i] = embedding
+    except Exception as e:
+        print(f"⚠️ Batch image embedding error: {e}")
 
     return embeddings
@@ -0,0 +1,369 @@
+"""
+Embedding Cache
+Two-tier, content-addressed cache for CLIP embeddings.
+
+Tier 1: in-memory LRU (OrderedDict) of float32 vectors.
+Tier 2: on-disk ring buffer of float16 vectors (np.memmap) with a sqlite
+        index (key -> slot). Survives restarts; oldest slots are reused.
+
+Keys:
+- text:  sha1(model + normalized text)
+- image: sha1(model + image bytes). A normalized URL (volatile signature /
+         expiry params dropped) maps to the content key, so a repeat URL
+         skips both the download and the forward pass.
+
+Every key is namespaced by the model name, and the disk index is wiped when
+the model changes, so stale vectors are never served.
+
+The disk tier is shared by every worker process using the same
+EMBED_CACHE_DIR (gunicorn workers): the ring position (meta.next_slot) is
+read and advanced inside a sqlite BEGIN IMMEDIATE transaction, so two
+workers never write the same slot for different keys.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "/tmp/rizko-embed-cache")
+EMBED_CACHE_MEMORY_ITEMS = int(os.getenv("EMBED_CACHE_MEMORY_ITEMS", "20000"))
+EMBED_CACHE_DISK_ITEMS = int(os.getenv("EMBED_CACHE_DISK_ITEMS", "200000"))
+EMBED_CACHE_LOCK_TIMEOUT = float(os.getenv("EMBED_CACHE_LOCK_TIMEOUT", "10"))  # seconds to wait for the sqlite write lock
+
+# Query params that change between fetches of the same CDN object
+_VOLATILE_PARAMS = {
+    "x-expires", "x-signature", "x-orig-expires", "x-orig-sign", "expires", "signature",
+    "oe", "oh", "ccb", "efg", "stp", "dl", "l", "shp", "shcp", "policy", "token",
+}
+
+
+def normalize_url(url: str) -> str:
+    """Drop fragment + volatile signature/expiry params, sort the rest"""
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in _VOLATILE_PARAMS and not k.lower().startswith("_nc_")
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """Memory LRU in front of a memmapped float16 store"""
+
+    def __init__(
+        self,
+        model_name: str,
+        cache_dir: str = EMBED_CACHE_DIR,
+        memory_items: int = EMBED_CACHE_MEMORY_ITEMS,
+        disk_items: int = EMBED_CACHE_DISK_ITEMS
+    ):
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._vectors: Optional[np.memmap] = None
+        self._dim: Optional[int] = None
+
+        self._hits: Dict[str, int] = {"text": 0, "image_url": 0, "image_content": 0}
+        self._disk_hits = 0
+        self._misses: Dict[str, int] = {"text": 0, "image": 0}
+
+        try:
+            self._open_disk()
+        except Exception as e:
+            print(f"⚠️ Embedding disk cache unavailable, memory only: {e}")
+            self._db = None
+
+    # -------------------------------------------------------------------------
+    # Keys
+    # -------------------------------------------------------------------------
+
+    def _key(self, kind: str, payload: bytes) -> str:
+        h = hashlib.sha1(self.model_name.encode())
+        h.update(kind.encode())
+        h.update(payload)
+        return h.hexdigest()
+
+    def text_key(self, text: str) -> str:
+        return self._key("text", normalize_text(text).encode())
+
+    def content_key(self, image_data: bytes) -> str:
+        return self._key("image", image_data)
+
+    def url_key(self, url: str) -> str:
+        return self._key("url", normalize_url(url).encode())
+
+    # -------------------------------------------------------------------------
+    # Disk tier
+    # -------------------------------------------------------------------------
+
+    def _open_disk(self) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Autocommit: writes that must be atomic run in explicit BEGIN IMMEDIATE transactions.
+        # timeout = how long to wait for another worker's write lock.
+        self._db = sqlite3.connect(
+            os.path.join(self.cache_dir, "index.sqlite"),
+            timeout=EMBED_CACHE_LOCK_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT);
+            CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, model TEXT, slot INTEGER);
+            CREATE INDEX IF NOT EXISTS ix_entries_slot ON entries (slot);
+            CREATE TABLE IF NOT EXISTS url_map (url_key TEXT PRIMARY KEY, content_key TEXT);
+        """)
+
+        with self._transaction():
+            meta = self._meta()
+            if meta.get("model") != self.model_name or int(meta.get("capacity", self.disk_items)) != self.disk_items:
+                # Model (or layout) changed: every stored vector is stale
+                if meta:
+                    print(f"🔄 Embedding cache invalidated (model {meta.get('model')} -> {self.model_name})")
+                self._db.execute("DELETE FROM entries")
+                self._db.execute("DELETE FROM url_map")
+                self._db.execute("DELETE FROM meta")
+                # The vector files were laid out for the old capacity: start them over
+                for name in os.listdir(self.cache_dir):
+                    if name.startswith("vectors-") and name.endswith(".f16"):
+                        os.remove(os.path.join(self.cache_dir, name))
+                self._db.executemany("INSERT INTO meta (k, v) VALUES (?, ?)", [
+                    ("model", self.model_name), ("capacity", str(self.disk_items)), ("next_slot", "0")
+                ])
+                meta = {}
+
+        if meta.get("dim"):
+            self._map_vectors(int(meta["dim"]))
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Write transaction shared by every process using the cache dir
+        (gunicorn workers): BEGIN IMMEDIATE takes sqlite's write lock up
+        front, so slot allocation and invalidation are serialized.
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _meta(self) -> Dict[str, str]:
+        return dict(self._db.execute("SELECT k, v FROM meta").fetchall())
+
+    def _map_vectors(self, dim: int) -> None:
+        path = os.path.join(self.cache_dir, f"vectors-{dim}.f16")
+        size = self.disk_items * dim * np.dtype(np.float16).itemsize
+        # Any file of another size belongs to a different layout -> recreate it
+        mode = "r+" if os.path.exists(path) and os.path.getsize(path) == size else "w+"
+        self._vectors = np.memmap(path, dtype=np.float16, mode=mode, shape=(self.disk_items, dim))
+        self._dim = dim
+
+    def _slot_of(self, key: str) -> Optional[int]:
+        row = self._db.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _disk_get(self, key: str) -> Optional[np.ndarray]:
+        if self._db is None:
+            return None
+        if self._vectors is None:
+            # Another worker may have stored the first vector since we opened
+            dim = self._meta().get("dim")
+            if not dim:
+                return None
+            self._map_vectors(int(dim))
+        slot = self._slot_of(key)
+        if slot is None:
+            return None
+        vector = np.asarray(self._vectors[slot], dtype=np.float32)
+        # A worker may have reused the slot while we were copying it
+        return vector if self._slot_of(key) == slot else None
+
+    def _disk_put(self, key: str, vector: np.ndarray) -> None:
+        if self._db is None:
+            return
+        with self._transaction():
+            meta = self._meta()
+            if self._vectors is None:
+                self._map_vectors(int(meta.get("dim") or vector.shape[0]))
+                if not meta.get("dim"):
+                    self._db.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('dim', ?)", (str(self._dim),))
+            if vector.shape[0] != self._dim:
+                return
+
+            # next_slot lives in sqlite, not in this process: workers never hand out the same slot
+            slot = int(meta.get("next_slot", 0)) % self.disk_items
+            # Ring buffer: whatever lived in this slot is evicted
+            self._db.execute("DELETE FROM entries WHERE slot = ?", (slot,))
+            self._db.execute("UPDATE meta SET v = ? WHERE k = 'next_slot'", (str(slot + 1),))
+
+        # The eviction is committed before the vector is overwritten, so a reader
+        # copying the old vector sees its entry gone when it re-checks (_disk_get)
+        self._vectors[slot] = vector.astype(np.float16)
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries (key, model, slot) VALUES (?, ?, ?)",
+            (key, self.model_name, slot)
+        )
+
+    # -------------------------------------------------------------------------
+    # Lookup / store
+    # -------------------------------------------------------------------------
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _get(self, key: str) -> Optional[np.ndarray]:
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            return vector
+        vector = self._disk_get(key)
+        if vector is not None:
+            self._disk_hits += 1
+            self._remember(key, vector)
+        return vector
+
+    def get_text(self, text: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._get(self.text_key(text))
+            self._count(vector, "text", "text")
+        return vector.tolist() if vector is not None else None
+
+    def put_text(self, text: str, embedding: List[float]) -> None:
+        self.put(self.text_key(text), embedding)
+
+    def get_by_url(self, url: str) -> Optional[List[float]]:
+        """URL hit: no download, no forward pass"""
+        with self._lock:
+            vector = None
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT content_key FROM url_map WHERE url_key = ?", (self.url_key(url),)
+                ).fetchone()
+                if row is not None:
+                    vector = self._get(row[0])
+            if vector is not None:
+                self._hits["image_url"] += 1
+        return vector.tolist() if vector is not None else None
+
+    def get_by_content(self, content_key: str) -> Optional[List[float]]:
+        """Content hit: downloaded, but the forward pass is skipped"""
+        with self._lock:
+            vector = self._get(content_key)
+            self._count(vector, "image_content", "image")
+        return vector.tolist() if vector is not None else None
+
+    def link_url(self, url: str, content_key: str) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO url_map (url_key, content_key) VALUES (?, ?)",
+                    (self.url_key(url), content_key)
+                )
+
+    def put(self, key: str, embedding: List[float]) -> None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            try:
+                self._disk_put(key, vector)
+            except Exception as e:
+                print(f"⚠️ Embedding disk cache write error: {e}")
+
+    def flush(self) -> None:
+        """Flush vectors to disk (the index commits as it goes)"""
+        with self._lock:
+            if self._db is None:
+                return
+            try:
+                if self._vectors is not None:
+                    self._vectors.flush()
+            except Exception as e:
+                print(f"⚠️ Embedding disk cache flush error: {e}")
+
+    def _count(self, vector: Optional[np.ndarray], hit_kind: str, miss_kind: str) -> None:
+        if vector is not None:
+            self._hits[hit_kind] += 1
+        else:
+            self._misses[miss_kind] += 1
+
+    # -------------------------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------------------------
+
+    def stats(self, compute_ms_per_item: Optional[Dict[str, float]] = None) -> Dict:
+        """
+        Hit rates + estimated forward-pass time saved.
+
+        Args:
+            compute_ms_per_item: Average forward-pass cost per item {"text": ms, "image": ms}
+        """
+        cost = compute_ms_per_item or {}
+        text_hits = self._hits["text"]
+        image_hits = self._hits["image_url"] + self._hits["image_content"]
+        text_total = text_hits + self._misses["text"]
+        # URL hits never reach the content lookup, so they count towards the total
+        image_total = image_hits + self._misses["image"]
+
+        return {
+            "enabled": True,
+            "model": self.model_name,
+            "memory_items": len(self._memory),
+            "disk_enabled": self._db is not None,
+            "disk_hits": self._disk_hits,
+            "text": {
+                "hits": text_hits,
+                "misses": self._misses["text"],
+                "hit_rate": round(text_hits / text_total, 4) if text_total else 0,
+            },
+            "image": {
+                "url_hits": self._hits["image_url"],
+                "content_hits": self._hits["image_content"],
+                "misses": self._misses["image"],
+                "hit_rate": round(image_hits / image_total, 4) if image_total else 0,
+            },
+            "saved_compute_ms": round(
+                text_hits * cost.get("text", 0) + image_hits * cost.get("image", 0), 1
+            ),
+        }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_init = threading.Lock()
+
+
+def get_embedding_cache(model_name: str) -> Optional[EmbeddingCache]:
+    """Process-wide cache (None when EMBED_CACHE_ENABLED is off)"""
+    global _cache
+    if not EMBED_CACHE_ENABLED:
+        return None
+    with _cache_init:
+        if _cache is None or _cache.model_name != model_name:
+            _cache = EmbeddingCache(model_name)
+            print(f"✅ Embedding cache ready ({EMBED_CACHE_DIR}, model {model_name})")
+    return _cache
+
+
+def current_embedding_cache() -> Optional[EmbeddingCache]:
+    """The cache created so far, without opening one"""
+    return _cache if EMBED_CACHE_ENABLED else None
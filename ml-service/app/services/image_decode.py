@@ -0,0 +1,37 @@
+"""
+Image Decoding
+Decode covers straight to (about) the resolution CLIP needs.
+
+Covers are 720x1280+ but CLIP sees 224x224. A full decode builds the whole
+bitmap only for the processor to throw most of it away:
+- JPEG: draft() makes libjpeg decode at 1/2, 1/4 or 1/8 scale (DCT scaling),
+  the smallest scale that still covers the requested size -> less CPU and
+  a bitmap up to 64x smaller.
+- Other formats (WebP, PNG): decoded at full size, then reduce() (box
+  filter on integer factors) before the processor's bicubic resize.
+"""
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image
+
+CLIP_INPUT_SIZE = 224
+# reduce() is a box filter: keep 2x the target for the final bicubic resample
+REDUCING_GAP = 2
+
+
+def decode_rgb(image_data: bytes, min_side: Optional[int] = CLIP_INPUT_SIZE) -> Image.Image:
+    """
+    Decode image bytes to RGB with the short side >= min_side (if the
+    source is that big). min_side=None decodes at full resolution.
+    """
+    image = Image.open(BytesIO(image_data))
+    if min_side:
+        if image.format == "JPEG":
+            # DCT scaling already averages blocks -> no extra gap needed
+            image.draft("RGB", (min_side, min_side))
+        else:
+            factor = min(image.size) // (min_side * REDUCING_GAP)
+            if factor > 1:
+                image = image.reduce(factor)
+    return image.convert("RGB")
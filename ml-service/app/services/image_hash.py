@@ -0,0 +1,90 @@
+"""
+Perceptual Hash Near-Duplicate Detection
+Cheap pre-stage before CLIP: re-uploads and template covers in one batch
+are embedded once.
+
+dHash (difference hash): the image is decoded at a tiny size (JPEG draft
+mode decodes straight to ~1/8 scale), converted to 9x8 grayscale, and each
+bit says whether a pixel is brighter than its right neighbour -> 64 bits.
+Re-encodes, resizes and light recompression change only a few bits.
+
+Grouping uses a multi-index Hamming index: the hash is split into
+DEDUP_BANDS bands; by pigeonhole two hashes within DEDUP_MAX_DISTANCE
+(< DEDUP_BANDS) bits share at least one identical band, so candidates come
+from dict lookups instead of comparing every pair.
+"""
+import os
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "4"))  # bits out of 64
+DEDUP_BANDS = 8
+_BAND_BITS = 64 // DEDUP_BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+_stats = {"hashed": 0, "hash_failed": 0, "duplicates": 0}
+
+
+def dhash(image_data: bytes) -> Optional[int]:
+    """64-bit difference hash of an image (None if it can't be decoded)"""
+    try:
+        image = Image.open(BytesIO(image_data))
+        image.draft("L", (64, 64))  # JPEG: DCT-scaled decode, no full-size bitmap
+        pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    except Exception:
+        _stats["hash_failed"] += 1
+        return None
+
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    _stats["hashed"] += 1
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(value: int) -> List[Tuple[int, int]]:
+    return [(band, (value >> (band * _BAND_BITS)) & _BAND_MASK) for band in range(DEDUP_BANDS)]
+
+
+def group_near_duplicates(hashes: List[Optional[int]], max_distance: int = DEDUP_MAX_DISTANCE) -> List[int]:
+    """
+    Map every item to the index of its group representative (first item
+    of the group). Items without a hash represent themselves.
+    """
+    max_distance = min(max_distance, DEDUP_BANDS - 1)  # pigeonhole bound of the band index
+    index: Dict[Tuple[int, int], List[int]] = {}
+    representative = list(range(len(hashes)))
+
+    for i, value in enumerate(hashes):
+        if value is None:
+            continue
+        keys = _bands(value)
+        match = None
+        for key in keys:
+            for j in index.get(key, ()):
+                if hamming(value, hashes[j]) <= max_distance:
+                    match = j
+                    break
+            if match is not None:
+                break
+
+        if match is None:
+            for key in keys:
+                index.setdefault(key, []).append(i)
+        else:
+            representative[i] = match
+            _stats["duplicates"] += 1
+    return representative
+
+
+def dedup_stats() -> dict:
+    return {"enabled": DEDUP_ENABLED, "max_distance": DEDUP_MAX_DISTANCE, **_stats}
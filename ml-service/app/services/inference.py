@@ -0,0 +1,206 @@
+"""
+Async Inference Front-End
+Shared micro-batchers used by the API handlers.
+
+Concurrent requests (single text/image calls from many users, batch-images
+calls from the backend) are merged into one CLIP forward pass per batch
+instead of one pass per request. Both paths consult the embedding cache
+first, so repeat texts/covers skip the model entirely. Cache lookups and
+writes touch sqlite / the memmap, so they run in the threadpool; the disk
+tier is flushed by a background task every EMBED_CACHE_FLUSH_SECONDS.
+"""
+import asyncio
+import os
+from typing import List, Optional
+
+import torch
+from starlette.concurrency import run_in_threadpool
+
+from .batcher import InferenceBatcher
+from .clip_service import (
+    EMBED_BATCH_SIZE, embed_pixels, embed_texts, model_tag,
+    download_images, hash_images, preprocess_images
+)
+from .embedding_cache import EmbeddingCache, current_embedding_cache, get_embedding_cache
+from .image_hash import DEDUP_ENABLED, group_near_duplicates
+
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))           # how long a batch may wait to fill
+TEXT_BATCH_SIZE = int(os.getenv("TEXT_BATCH_SIZE", "128"))              # texts per forward pass
+EMBED_CACHE_FLUSH_SECONDS = float(os.getenv("EMBED_CACHE_FLUSH_SECONDS", "5"))  # disk tier flush period
+
+
+def _embed_pixel_batch(pixels: List[torch.Tensor]) -> List[List[float]]:
+    return embed_pixels(torch.stack(pixels), batch_size=len(pixels))
+
+
+text_batcher = InferenceBatcher(
+    "text", embed_texts,
+    max_batch_size=TEXT_BATCH_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS
+)
+image_batcher = InferenceBatcher(
+    "image", _embed_pixel_batch,
+    max_batch_size=EMBED_BATCH_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS
+)
+
+
+_flush_task: Optional[asyncio.Task] = None
+
+
+async def _flush_cache_periodically() -> None:
+    while True:
+        await asyncio.sleep(EMBED_CACHE_FLUSH_SECONDS)
+        cache = current_embedding_cache()
+        if cache:
+            await run_in_threadpool(cache.flush)
+
+
+def start_batchers() -> None:
+    global _flush_task
+    text_batcher.start()
+    image_batcher.start()
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.get_running_loop().create_task(_flush_cache_periodically())
+
+
+async def stop_batchers() -> None:
+    global _flush_task
+    await text_batcher.stop()
+    await image_batcher.stop()
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    cache = current_embedding_cache()
+    if cache:
+        await run_in_threadpool(cache.flush)
+
+
+async def _get_cache() -> Optional[EmbeddingCache]:
+    # model_tag() may load the model on first use -> keep it off the event loop
+    return get_embedding_cache(await run_in_threadpool(model_tag))
+
+
+def cache_stats() -> dict:
+    cache = current_embedding_cache()
+    if cache is None:
+        return {"enabled": False}
+    return cache.stats({
+        "text": text_batcher.compute_ms_per_item(),
+        "image": image_batcher.compute_ms_per_item(),
+    })
+
+
+async def embed_text(text: str) -> Optional[List[float]]:
+    """Text -> embedding (cache, then the shared text batcher)"""
+    if not text:
+        return None
+
+    cache = await _get_cache()
+    if cache:
+        cached = await run_in_threadpool(cache.get_text, text)
+        if cached is not None:
+            return cached
+
+    embedding = await text_batcher.submit(text)
+    if cache and embedding is not None:
+        await run_in_threadpool(cache.put_text, text, embedding)
+    return embedding
+
+
+async def embed_texts_many(texts: List[str]) -> List[Optional[List[float]]]:
+    """Several texts -> embeddings; they share batches with concurrent requests"""
+    if not texts:
+        return []
+    return list(await asyncio.gather(*(embed_text(text) for text in texts)))
+
+
+async def embed_image_urls(image_urls: List[str]) -> List[Optional[List[float]]]:
+    """
+    URLs -> embeddings through the shared image batcher.
+
+    1. URL cache hit  -> done (no download)
+    2. Download, content hash hit -> done (no forward pass)
+    3. Near duplicates (perceptual hash) -> one representative per group
+    4. Preprocess + batcher for the representatives, copied to their
+       duplicates, stored under both keys
+    Failed images stay None.
+    """
+    embeddings: List[Optional[List[float]]] = [None] * len(image_urls)
+    if not image_urls:
+        return embeddings
+
+    cache = await _get_cache()
+    pending = list(range(len(image_urls)))
+    if cache:
+        embeddings = await run_in_threadpool(_lookup_urls, cache, image_urls)
+        pending = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if not pending:
+            return embeddings
+
+    datas = await run_in_threadpool(download_images, [image_urls[i] for i in pending])
+
+    # (index, content_key, bytes) still to embed
+    if cache:
+        to_embed = await run_in_threadpool(_lookup_contents, cache, image_urls, pending, datas, embeddings)
+    else:
+        to_embed = [(i, None, data) for i, data in zip(pending, datas) if data is not None]
+
+    if to_embed:
+        representative = list(range(len(to_embed)))
+        if DEDUP_ENABLED and len(to_embed) > 1:
+            hashes = await run_in_threadpool(hash_images, [data for _, _, data in to_embed])
+            representative = group_near_duplicates(hashes)
+        unique = [n for n, rep in enumerate(representative) if rep == n]
+
+        pixels = await run_in_threadpool(preprocess_images, [to_embed[n][2] for n in unique])
+        valid = [n for n, p in zip(unique, pixels) if p is not None]
+        # A failed batch (possibly caused by another request's items) only fails the images it held;
+        # cache hits and the other batches' results are kept
+        results = await image_batcher.submit_many([p for p in pixels if p is not None], return_exceptions=True)
+        by_representative = {
+            n: result for n, result in zip(valid, results) if not isinstance(result, BaseException)
+        }
+
+        stored = []  # (url, content_key, embedding)
+        for n, (i, content_key, _) in enumerate(to_embed):
+            embedding = by_representative.get(representative[n])
+            embeddings[i] = embedding
+            if cache and embedding is not None:
+                stored.append((image_urls[i], content_key, embedding))
+        if stored:
+            await run_in_threadpool(_store_images, cache, stored)
+
+    return embeddings
+
+
+# --- cache access (sqlite / memmap: blocking, run in the threadpool) ---
+
+def _lookup_urls(cache: EmbeddingCache, image_urls: List[str]) -> List[Optional[List[float]]]:
+    return [cache.get_by_url(url) if url else None for url in image_urls]
+
+
+def _lookup_contents(cache: EmbeddingCache, image_urls, pending, datas, embeddings) -> list:
+    """Fills content hits into `embeddings`; returns the (index, content_key, bytes) left to embed"""
+    to_embed = []
+    for i, data in zip(pending, datas):
+        if data is None:
+            continue
+        content_key = cache.content_key(data)
+        cached = cache.get_by_content(content_key)
+        if cached is not None:
+            embeddings[i] = cached
+            cache.link_url(image_urls[i], content_key)
+            continue
+        to_embed.append((i, content_key, data))
+    return to_embed
+
+
+def _store_images(cache: EmbeddingCache, stored) -> None:
+    for url, content_key, embedding in stored:
+        cache.put(content_key, embedding)
+        cache.link_url(url, content_key)
@@ -0,0 +1,81 @@
+"""
+Service Lifecycle
+Eager model load + warm-up before the worker accepts traffic, and the
+liveness/readiness state behind /health/live and /health/ready.
+"""
+import os
+import resource
+import time
+from typing import Any, Dict
+
+from starlette.concurrency import run_in_threadpool
+
+from .clip_service import active_backend, load_clip, warm_up
+
+# Module import ~= process start (under gunicorn preload_app: master start)
+PROCESS_STARTED_AT = time.time()
+
+WARMUP_BATCH_SIZE = int(os.getenv("WARMUP_BATCH_SIZE", "2"))
+
+_state: Dict[str, Any] = {
+    "ready": False,
+    "error": None,
+    "backend": None,
+    "load_seconds": None,
+    "warmup_ms": None,
+    "time_to_ready_seconds": None,
+}
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process (MB)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _load_and_warm_up() -> None:
+    started = time.perf_counter()
+    load_clip()
+    _state["load_seconds"] = round(time.perf_counter() - started, 2)
+    _state["warmup_ms"] = round(warm_up(WARMUP_BATCH_SIZE), 1)
+    _state["backend"] = active_backend()
+
+
+async def preload() -> None:
+    """
+    Load the model and run a warm-up batch (called from the startup event,
+    so uvicorn doesn't accept connections until it finishes).
+    A failure leaves the worker live but not ready instead of crash-looping.
+    """
+    try:
+        await run_in_threadpool(_load_and_warm_up)
+    except Exception as e:
+        _state["error"] = str(e)
+        print(f"❌ ML service warm-up failed: {e}")
+        return
+
+    _state["time_to_ready_seconds"] = round(time.time() - PROCESS_STARTED_AT, 2)
+    _state["ready"] = True
+    print(
+        f"✅ ML worker {os.getpid()} ready in {_state['time_to_ready_seconds']}s "
+        f"(load {_state['load_seconds']}s, warm-up {_state['warmup_ms']}ms, RSS {rss_mb():.0f}MB)"
+    )
+
+
+def is_ready() -> bool:
+    return _state["ready"]
+
+
+def lifecycle_stats() -> Dict[str, Any]:
+    """Readiness, time-to-ready and this worker's RSS"""
+    stats = dict(_state)
+    stats["pid"] = os.getpid()
+    stats["rss_mb"] = round(rss_mb(), 1)
+    stats["uptime_seconds"] = round(time.time() - PROCESS_STARTED_AT, 1)
+    return stats
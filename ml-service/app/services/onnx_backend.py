@@ -0,0 +1,191 @@
+"""
+ONNX Runtime CLIP Backend
+Quantized CPU inference for CLIP (selected with CLIP_BACKEND=onnx).
+
+On first use the PyTorch model is exported to two ONNX graphs (vision and
+text towers, dynamic batch axis), quantized with dynamic int8 weights and
+cached in ONNX_MODEL_DIR. Later starts load the int8 graphs directly.
+
+onnxruntime is optional: if it isn't installed (or export fails) the
+service falls back to the PyTorch backend.
+"""
+import os
+from typing import Callable, Optional
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    ONNX_AVAILABLE = True
+except ImportError:
+    ort = None
+    ONNX_AVAILABLE = False
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "/tmp/rizko-onnx")
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "true").lower() in ("1", "true", "yes")
+# Same per-worker core split as gunicorn.conf.py post_fork applies to torch
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0")) or max(
+    1, (os.cpu_count() or 1) // max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+)
+ONNX_INTER_OP_THREADS = int(os.getenv("ONNX_INTER_OP_THREADS", "1"))
+ONNX_OPSET = 17
+
+
+class OnnxClipBackend:
+    """Vision + text CLIP towers as ONNX Runtime sessions"""
+
+    def __init__(self, vision_path: str, text_path: str):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+        options.inter_op_num_threads = ONNX_INTER_OP_THREADS
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        providers = ["CPUExecutionProvider"]
+        self.vision = ort.InferenceSession(vision_path, options, providers=providers)
+        self.text = ort.InferenceSession(text_path, options, providers=providers)
+        self.quantized = vision_path.endswith(".int8.onnx")
+
+    def image_features(self, pixel_values: np.ndarray) -> np.ndarray:
+        """(N, 3, H, W) float32 -> (N, D) float32"""
+        return self.vision.run(None, {"pixel_values": pixel_values.astype(np.float32, copy=False)})[0]
+
+    def text_features(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """(N, L) int64 token ids + mask -> (N, D) float32"""
+        return self.text.run(None, {
+            "input_ids": input_ids.astype(np.int64, copy=False),
+            "attention_mask": attention_mask.astype(np.int64, copy=False),
+        })[0]
+
+
+def _model_dir(model_name: str) -> str:
+    return os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "__"))
+
+
+def export_onnx(model, model_dir: str) -> None:
+    """Export the vision and text towers of a CLIPModel to ONNX (fp32)"""
+    import torch
+
+    class VisionTower(torch.nn.Module):
+        def __init__(self, clip):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, pixel_values):
+            return self.clip.get_image_features(pixel_values=pixel_values)
+
+    class TextTower(torch.nn.Module):
+        def __init__(self, clip):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, input_ids, attention_mask):
+            return self.clip.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+    os.makedirs(model_dir, exist_ok=True)
+    model = model.cpu().eval()
+    image_size = model.config.vision_config.image_size
+
+    with torch.no_grad():
+        torch.onnx.export(
+            VisionTower(model),
+            (torch.zeros(1, 3, image_size, image_size),),
+            os.path.join(model_dir, "vision.onnx"),
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+            do_constant_folding=True
+        )
+        torch.onnx.export(
+            TextTower(model),
+            (torch.ones(1, 8, dtype=torch.long), torch.ones(1, 8, dtype=torch.long)),
+            os.path.join(model_dir, "text.onnx"),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["text_embeds"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "text_embeds": {0: "batch"},
+            },
+            opset_version=ONNX_OPSET,
+            do_constant_folding=True
+        )
+
+
+def quantize_onnx(model_dir: str) -> None:
+    """Dynamic int8 quantization of MatMul/Gemm weights (conv stem stays fp32)"""
+    for tower in ("vision", "text"):
+        quantize_dynamic(
+            os.path.join(model_dir, f"{tower}.onnx"),
+            os.path.join(model_dir, f"{tower}.int8.onnx"),
+            weight_type=QuantType.QInt8,
+            op_types_to_quantize=["MatMul", "Gemm"]
+        )
+
+
+def _graph_paths(model_name: str, quantize: bool):
+    model_dir = _model_dir(model_name)
+    suffix = ".int8.onnx" if quantize else ".onnx"
+    return model_dir, os.path.join(model_dir, f"vision{suffix}"), os.path.join(model_dir, f"text{suffix}")
+
+
+def ensure_onnx_export(
+    model_name: str,
+    get_torch_model: Callable[[], object],
+    quantize: bool = ONNX_QUANTIZE
+) -> bool:
+    """
+    Export/quantize the graphs if they aren't on disk yet (no session is created,
+    so this is safe to run in a pre-fork master). Returns True if graphs exist.
+    """
+    if not ONNX_AVAILABLE:
+        return False
+
+    model_dir, vision_path, text_path = _graph_paths(model_name, quantize)
+    if os.path.exists(vision_path) and os.path.exists(text_path):
+        return True
+
+    if not os.path.exists(os.path.join(model_dir, "vision.onnx")):
+        print(f"📦 Exporting CLIP to ONNX ({model_dir})...")
+        export_onnx(get_torch_model(), model_dir)
+    if quantize:
+        print("📦 Quantizing ONNX graphs (dynamic int8)...")
+        quantize_onnx(model_dir)
+    return True
+
+
+def load_onnx_backend(
+    model_name: str,
+    get_torch_model: Callable[[], object],
+    quantize: bool = ONNX_QUANTIZE
+) -> Optional[OnnxClipBackend]:
+    """
+    Load (exporting/quantizing on first run) the ONNX backend.
+
+    Args:
+        model_name: HF model id, used for the cache directory
+        get_torch_model: Returns the loaded CLIPModel; only called if an export is needed
+        quantize: Use int8 graphs (default ONNX_QUANTIZE)
+
+    Returns:
+        OnnxClipBackend, or None if onnxruntime is unavailable or loading fails
+    """
+    if not ONNX_AVAILABLE:
+        print("⚠️ CLIP_BACKEND=onnx but onnxruntime is not installed, using PyTorch")
+        return None
+
+    _, vision_path, text_path = _graph_paths(model_name, quantize)
+
+    try:
+        ensure_onnx_export(model_name, get_torch_model, quantize)
+        backend = OnnxClipBackend(vision_path, text_path)
+        print(
+            f"✅ CLIP ONNX backend loaded ({'int8' if quantize else 'fp32'}, "
+            f"intra_op={ONNX_INTRA_OP_THREADS}, inter_op={ONNX_INTER_OP_THREADS})"
+        )
+        return backend
+    except Exception as e:
+        print(f"⚠️ ONNX backend unavailable, using PyTorch: {e}")
+        return None
@@ -0,0 +1,63 @@
+"""
+Binary Embedding Transport
+Compact wire format for embedding batches (JSON stays the default).
+
+Negotiated via `Accept: application/vnd.rizko.embeddings[; dtype=float16|float32]`.
+
+Layout (little-endian):
+    header  "<4sBBHI"  magic b"RZEM", version, dtype code, dim, count   (12 bytes)
+    mask    count x uint8 (1 = embedding present), zero-padded to 8 bytes
+    data    valid_count x dim values of the given dtype (rows for mask == 1 only)
+
+The server decodes it with np.frombuffer (see server/app/services/embedding_codec.py).
+"""
+import struct
+from typing import List, Optional
+
+import numpy as np
+
+EMBEDDINGS_MEDIA_TYPE = "application/vnd.rizko.embeddings"
+
+MAGIC = b"RZEM"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHI")
+DTYPE_CODES = {"float16": 1, "float32": 2}
+_NUMPY_DTYPES = {"float16": "<f2", "float32": "<f4"}
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """
+    Return the requested dtype if the client accepts the binary format, else None.
+    e.g. "application/vnd.rizko.embeddings; dtype=float16, application/json" -> "float16"
+    """
+    if not accept:
+        return None
+    for part in accept.split(","):
+        fields = [f.strip() for f in part.split(";")]
+        if fields[0].lower() != EMBEDDINGS_MEDIA_TYPE:
+            continue
+        dtype = "float32"
+        for param in fields[1:]:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "dtype" and value.strip().lower() in DTYPE_CODES:
+                dtype = value.strip().lower()
+        return dtype
+    return None
+
+
+def encode_embeddings(embeddings: List[Optional[List[float]]], dtype: str = "float32") -> bytes:
+    """Pack a list of embeddings (None for failures) into the binary format"""
+    valid = [e for e in embeddings if e is not None]
+    dim = len(valid[0]) if valid else 0
+
+    mask = bytes(1 if e is not None else 0 for e in embeddings)
+    padding = b"\x00" * (-len(mask) % 8)
+
+    data = np.asarray(valid, dtype=_NUMPY_DTYPES[dtype]).reshape(len(valid), dim) if valid else np.empty(0)
+
+    return b"".join([
+        HEADER.pack(MAGIC, VERSION, DTYPE_CODES[dtype], dim, len(embeddings)),
+        mask,
+        padding,
+        data.tobytes(),
+    ])
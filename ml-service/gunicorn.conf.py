@@ -0,0 +1,32 @@
+"""
+Gunicorn config for the ML service.
+
+preload_app imports the app in the master and loads the CLIP weights once
+(on_starting); forked workers share those pages copy-on-write instead of
+each holding a private copy. Every worker then warms up in its startup
+event and only starts accepting connections once it is ready.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8001')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+os.environ.setdefault("WEB_CONCURRENCY", str(workers))  # the app splits ONNX threads by it
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    from app.services.clip_service import preload_shared_weights
+    preload_shared_weights()
+
+
+def post_fork(server, worker):
+    # Split the cores between workers instead of every worker using all of them
+    import torch
+    threads = int(os.getenv("TORCH_NUM_THREADS", "0")) or max(1, (os.cpu_count() or 1) // workers)
+    torch.set_num_threads(threads)
@@ -16,6 +16,7 @@ from sqlalchemy import desc
 from ..core.database import get_db
 from ..db.models import User, ChatSession, ChatMessage
 from .dependencies import get_current_user, CreditManager
+from ..services.credit_ledger import CreditLedger
 
 router = APIRouter(tags=["Chat Sessions"])
 
@@ -293,7 +294,12 @@ async def get_credits_info(
     # Check and reset monthly credits if needed
     CreditManager.check_and_reset_monthly(current_user, db)
 
-    return CreditManager.get_credits_info(current_user)
+    info = CreditManager.get_credits_info(current_user)
+
+    # Spend breakdown for the current month from the append-only ledger
+    now = datetime.utcnow()
+    info["usage"] = CreditLedger.usage_summary(db, current_user.id, since=datetime(now.year, now.month, 1))
+    return info
 
 
 @router.get("/", response_model=List[ChatSessionResponse])
@@ -628,7 +634,9 @@ async def send_message(
     db.add(ai_msg)
 
     # --- DEDUCT CREDITS after successful response ---
-    remaining_credits = await CreditManager.deduct_credits(credit_cost, current_user, db)
+    remaining_credits = await CreditManager.deduct_credits(
+        credit_cost, current_user, db, reason=f"chat:{current_model}"
+    )
     print(f"[Credits] User {current_user.id}: deducted {credit_cost}, remaining={remaining_credits}")
 
     # Update session
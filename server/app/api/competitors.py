@@ -8,8 +8,8 @@ Enterprise-grade competitor analysis with:
 - Rate limiting based on subscription tier
 """
 import logging
-from datetime import datetime
-from typing import List, Optional
+from datetime import datetime, timedelta
+from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
@@ -22,6 +22,15 @@ from ..services.instagram_profile_adapter import adapt_instagram_profile_to_post
 from ..services.scorer import TrendScorer
 from ..services.apify_storage import ApifyStorage
 from ..services.storage import SupabaseStorage
+from ..services.url_refresher import url_refresher
+from ..services.competitor_refresher import (
+    COMPETITOR_FRESH_MINUTES,
+    apply_snapshots,
+    build_snapshot,
+    fix_tt_url,
+    normalize_video_data,
+    scrape_profiles
+)
 from .dependencies import get_current_user, check_rate_limit, CreditManager
 from .schemas.competitors import (
     CompetitorCreate,
@@ -45,105 +54,6 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-# =============================================================================
-# HELPER FUNCTIONS
-# =============================================================================
-
-def fix_tt_url(url: str) -> Optional[str]:
-    """
-    Fix TikTok CDN URLs by removing expiring signatures.
-
-    Calls ApifyStorage.fix_tiktok_url() to remove -sign- subdomain and
-    signature parameters (x-expires, x-signature) from TikTok CDN URLs.
-    Also handles .heic to .jpeg conversion for compatibility.
-    """
-    if not url or not isinstance(url, str):
-        return None
-
-    # Remove TikTok signatures first
-    url = ApifyStorage.fix_tiktok_url(url)
-
-    # Convert .heic to .jpeg for compatibility
-    if url and ".heic" in url:
-        url = url.replace(".heic", ".jpeg")
-
-    return url
-
-
-def normalize_video_data(item: dict) -> dict:
-    """
-    Normalize video data from various Apify response formats.
-    """
-    stats = item.get("stats") or {}
-    views = item.get("views") or item.get("playCount") or stats.get("playCount") or 0
-    likes = item.get("likes") or item.get("diggCount") or stats.get("diggCount") or 0
-    comments = item.get("comments") or item.get("commentCount") or stats.get("commentCount") or 0
-    shares = item.get("shares") or item.get("shareCount") or stats.get("shareCount") or 0
-
-    uploaded_at = item.get("uploadedAt") or item.get("createTime") or 0
-
-    channel = item.get("channel") or item.get("authorMeta") or {}
-    author_name = channel.get("username") or channel.get("name") or "unknown"
-    avatar = fix_tt_url(channel.get("avatar") or channel.get("avatarThumb"))
-
-    video_obj = item.get("video") or item.get("videoMeta") or {}
-    # Get ORIGINAL cover URL (with signature!) - DO NOT fix_tt_url yet
-    cover_raw = (
-        video_obj.get("cover") or
-        video_obj.get("coverUrl") or
-        video_obj.get("dynamicCover") or
-        video_obj.get("originCover") or
-        item.get("cover_url") or
-        item.get("coverUrl") or
-        item.get("videoCover") or
-        item.get("cover") or
-        ""
-    )
-
-    # Extract video URL for playback (video.url is the main field)
-    video_url = fix_tt_url(
-        video_obj.get("url") or
-        video_obj.get("playAddr") or
-        video_obj.get("downloadAddr") or
-        item.get("video_url") or
-        item.get("videoUrl")
-    )
-
-    # Upload thumbnail to Supabase Storage using ORIGINAL signed URL
-    # The signature is needed to download from TikTok CDN!
-    cover_url_final = fix_tt_url(cover_raw) or cover_raw  # fallback default
-    if cover_raw:
-        # Try with original signed URL first (best chance of success)
-        uploaded_cover = SupabaseStorage.upload_thumbnail(cover_raw)
-        if uploaded_cover:
-            cover_url_final = uploaded_cover
-        else:
-            # Fallback: try with fixed URL (remove signatures, works ~1-3 days)
-            cover_url_final = ApifyStorage.fix_tiktok_url(cover_raw)
-
-    return {
-        "id": str(item.get("id")),
-        "title": item.get("title") or item.get("desc") or "",
-        "url": item.get("postPage") or item.get("webVideoUrl") or item.get("url"),
-        "cover_url": cover_url_final,
-        "thumbnail_url": cover_url_final,  # Frontend expects this field
-        "video_url": video_url,
-        "uploaded_at": uploaded_at,
-        "views": int(views),
-        "stats": {
-            "playCount": int(views),
-            "diggCount": int(likes),
-            "commentCount": int(comments),
-            "shareCount": int(shares)
-        },
-        "author": {
-            "username": author_name,
-            "avatar": avatar,
-            "followers": channel.get("followers") or channel.get("fans") or 0
-        }
-    }
-
-
 # =============================================================================
 # SEARCH ENDPOINTS
 # =============================================================================
@@ -634,60 +544,30 @@ def refresh_competitor_data(
             detail=f"Competitor @{clean_username} not found"
         )
 
+    platform = competitor.platform or "tiktok"
+    fresh_since = datetime.utcnow() - timedelta(minutes=COMPETITOR_FRESH_MINUTES)
+    if competitor.last_analyzed_at and competitor.last_analyzed_at >= fresh_since:
+        # Just refreshed (fleet job or another user tracking the same profile): no new scrape
+        logger.info(f"♻️ Competitor @{clean_username} is fresh, skipping scrape")
+        return CompetitorResponse.model_validate(competitor)
+
     logger.info(f"🔄 User {current_user.id} refreshing competitor: @{clean_username}")
 
-    collector = TikTokCollector()
-    raw_videos = collector.collect([clean_username], limit=30, mode="profile")
+    scraped, _ = scrape_profiles(platform, [clean_username])
+    raw_videos = scraped.get(clean_username)
+    snapshot = build_snapshot(raw_videos or [])
 
-    if not raw_videos:
+    if not snapshot:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Failed to refresh @{clean_username} - profile not found"
         )
 
-    # Process videos
-    scorer = TrendScorer()
-    clean_videos = []
-    total_views = 0
-    total_engagement = 0
-
-    for raw in raw_videos:
-        vid = normalize_video_data(raw)
-        scorer_data = {
-            "views": vid["views"],
-            "author_followers": vid["author"]["followers"],
-            "collect_count": 0,
-            "share_count": vid["stats"]["shareCount"]
-        }
-        vid["uts_score"] = scorer.calculate_uts(scorer_data, history_data=None, cascade_count=1)
-        clean_videos.append(vid)
-        total_views += vid["views"]
-        total_engagement += (
-            vid["stats"]["diggCount"] +
-            vid["stats"]["commentCount"] +
-            vid["stats"]["shareCount"]
-        )
-
-    avg_views = total_views / len(clean_videos) if clean_videos else 0
-    engagement_rate = (total_engagement / total_views * 100) if total_views > 0 else 0
-
-    # Update competitor
-    first_vid = clean_videos[0]
-    competitor.followers_count = first_vid["author"]["followers"]
-
-    # Upload new avatar to Supabase Storage (permanent)
-    avatar_cdn_url = first_vid["author"]["avatar"]
-    uploaded_avatar = SupabaseStorage.upload_avatar(avatar_cdn_url)
-    competitor.avatar_url = uploaded_avatar if uploaded_avatar else avatar_cdn_url
-    competitor.total_videos = len(clean_videos)
-    competitor.avg_views = avg_views
-    competitor.engagement_rate = round(engagement_rate, 2)
-    competitor.recent_videos = clean_videos
-    competitor.last_analyzed_at = datetime.utcnow()
-    competitor.updated_at = datetime.utcnow()
-
+    # Every user tracking this profile gets the fresh data (one scrape for all)
+    updated = apply_snapshots(db, platform, {clean_username: snapshot})
     db.commit()
     db.refresh(competitor)
+    logger.info(f"👥 Refresh of @{clean_username} applied to {updated} tracking rows")
 
     logger.info(f"✅ User {current_user.id} refreshed competitor @{clean_username}")
 
@@ -724,6 +604,7 @@ def spy_competitor(
         )
 
     clean_feed = competitor.recent_videos
+    url_refresher.track_competitor(competitor)
     channel_data = ChannelData(
         nickName=competitor.display_name or competitor.username,
         uniqueId=competitor.username,
@@ -745,6 +626,7 @@ def spy_competitor(
             title=vid.get("title", ""),
             url=vid.get("url", ""),
             cover_url=vid.get("cover_url"),
+            cover_srcset=vid.get("cover_srcset"),
             uploaded_at=vid.get("uploaded_at"),
             views=vid.get("views", 0),
             stats=CompetitorVideoStats(**vid.get("stats", {})),
@@ -821,6 +703,7 @@ def get_competitor_feed(
     
     # Get videos from recent_videos field (JSONB)
     videos_data = competitor.recent_videos or []
+    url_refresher.track_competitor(competitor, videos_data[:20])
 
     # Log summary
     logger.info(f"Returning {len(videos_data)} videos for @{clean_username}")
@@ -859,6 +742,7 @@ def get_competitor_feed(
             title=vid.get("title", ""),
             description=vid.get("title", ""),  # TikTok doesn't have separate description
             thumbnail_url=cover_url_value,
+            cover_srcset=vid.get("cover_srcset"),
             video_url=vid.get("video_url"),  # Add video URL for playback
             url=vid.get("url", ""),
             stats=CompetitorVideoStats(
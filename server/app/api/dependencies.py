@@ -27,6 +27,7 @@ from sqlalchemy.orm import Session
 from ..core.database import get_db
 from ..core.security import decode_token
 from ..db.models import User, UserSettings, SubscriptionTier
+from ..services.credit_ledger import CreditLedger, InsufficientCreditsError
 
 # Logger for authentication debugging and monitoring
 logger = logging.getLogger(__name__)
@@ -599,25 +600,25 @@ class CreditManager:
         """
         Check if credits should be reset for the new month.
         Resets credits to the plan's monthly allocation if a month has passed.
+
+        The reset is a single conditional UPDATE, so concurrent requests
+        can't both reset (or clobber a charge made in between).
         """
         from dateutil.relativedelta import relativedelta
 
         now = datetime.utcnow()
 
-        # If credits_reset_at is not set, initialize it
-        if user.credits_reset_at is None:
-            user.credits_reset_at = now + relativedelta(months=1)
-            monthly_limit = cls.get_monthly_limit(user.subscription_tier)
-            user.credits = monthly_limit
-            db.commit()
+        # Fast path: nothing to do, no DB round-trip
+        if user.credits_reset_at is not None and now < user.credits_reset_at:
             return
 
-        # Check if reset time has passed
-        if now >= user.credits_reset_at:
-            monthly_limit = cls.get_monthly_limit(user.subscription_tier)
-            user.credits = monthly_limit
-            user.credits_reset_at = now + relativedelta(months=1)
-            db.commit()
+        CreditLedger.reset_monthly(
+            db,
+            user,
+            monthly_limit=cls.get_monthly_limit(user.subscription_tier),
+            next_reset_at=now + relativedelta(months=1),
+            now=now
+        )
 
     @classmethod
     async def check_credits_for_chat(
@@ -656,12 +657,17 @@ class CreditManager:
         cls,
         cost: int,
         user: User,
-        db: Session
+        db: Session,
+        reason: str = "chat"
     ) -> int:
-        """Deduct credits after successful AI response. Returns remaining credits."""
-        user.credits = max(0, user.credits - cost)
-        db.commit()
-        return user.credits
+        """
+        Deduct credits after successful AI response. Returns remaining credits.
+
+        The response is already generated, so the debit is clamped at zero
+        instead of failing. Not committed here — the caller's commit (which
+        also saves the messages) makes it durable.
+        """
+        return CreditLedger.charge(db, user, cost, reason, clamp=True, commit=False)
 
     @classmethod
     async def check_and_deduct(
@@ -672,27 +678,27 @@ class CreditManager:
     ) -> None:
         """
         Check if user has enough credits and deduct (for non-chat operations).
+        Check and debit are one conditional UPDATE.
 
         Raises:
             HTTPException: 402 if insufficient credits
         """
         cost = cls.OPERATION_COSTS.get(operation, 1)
 
-        if user.credits < cost:
+        try:
+            CreditLedger.charge(db, user, cost, operation)
+        except InsufficientCreditsError as e:
             raise HTTPException(
                 status_code=status.HTTP_402_PAYMENT_REQUIRED,
                 detail={
                     "error": "Insufficient credits",
                     "required": cost,
-                    "available": user.credits,
+                    "available": e.available,
                     "operation": operation,
                     "purchase_url": "/pricing"
                 }
             )
 
-        user.credits -= cost
-        db.commit()
-
     @classmethod
     def get_operation_cost(cls, operation: str) -> int:
         """Get cost for an operation."""
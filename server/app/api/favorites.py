@@ -8,12 +8,16 @@ Full CRUD operations with user isolation.
 import logging
 from typing import Optional, List
 
+from anyio import from_thread
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session, joinedload
 
 from ..core.database import get_db
 from pydantic import BaseModel
 from ..db.models import User, Trend, UserFavorite, SearchMode as DBSearchMode
+from ..services.storage import SupabaseStorage
+from ..services.thumbnail_pipeline import thumbnail_pipeline
+from ..services.url_refresher import url_refresher
 from .dependencies import get_current_user, check_rate_limit
 from .schemas.favorites import (
     FavoriteCreate,
@@ -62,6 +66,7 @@ def get_favorites(
     favorites = query.order_by(
         UserFavorite.created_at.desc()
     ).offset(offset).limit(per_page).all()
+    url_refresher.track_trends(fav.trend for fav in favorites)
 
     items = []
     for fav in favorites:
@@ -74,6 +79,7 @@ def get_favorites(
                 play_addr=fav.trend.play_addr,  # Direct CDN URL for inline video playback
                 description=fav.trend.description,
                 cover_url=fav.trend.cover_url,
+                cover_srcset=SupabaseStorage.srcset(fav.trend.cover_renditions),
                 author_username=fav.trend.author_username,
                 uts_score=fav.trend.uts_score or 0.0,
                 stats=fav.trend.stats or {}
@@ -152,6 +158,7 @@ def add_favorite(
         url=trend.url,
         description=trend.description,
         cover_url=trend.cover_url,
+        cover_srcset=SupabaseStorage.srcset(trend.cover_renditions),
         author_username=trend.author_username,
         uts_score=trend.uts_score or 0.0,
         stats=trend.stats or {}
@@ -198,6 +205,7 @@ def get_favorite(
             url=favorite.trend.url,
             description=favorite.trend.description,
             cover_url=favorite.trend.cover_url,
+            cover_srcset=SupabaseStorage.srcset(favorite.trend.cover_renditions),
             author_username=favorite.trend.author_username,
             uts_score=favorite.trend.uts_score or 0.0,
             stats=favorite.trend.stats or {}
@@ -256,6 +264,7 @@ def update_favorite(
             url=favorite.trend.url,
             description=favorite.trend.description,
             cover_url=favorite.trend.cover_url,
+            cover_srcset=SupabaseStorage.srcset(favorite.trend.cover_renditions),
             author_username=favorite.trend.author_username,
             uts_score=favorite.trend.uts_score or 0.0,
             stats=favorite.trend.stats or {}
@@ -447,6 +456,14 @@ def check_if_favorited(
 # SAVE VIDEO (Light Analyze → DB + Favorite in one step)
 # =============================================================================
 
+def _mirror_cover(user_id: int, trend: Trend) -> None:
+    """Now that the video is persisted, mirror its CDN cover in the background"""
+    try:
+        from_thread.run_sync(thumbnail_pipeline.submit, user_id, [(trend.id, trend.cover_url)])
+    except Exception as e:
+        logger.warning(f"Thumbnail pipeline unavailable: {e}")
+
+
 class SaveVideoRequest(BaseModel):
     """Save a video from Light Analyze results directly to favorites."""
     platform_id: str
@@ -485,7 +502,9 @@ def save_video_to_favorites(
             trend = existing_trend
             # Update stats
             trend.stats = data.stats
-            trend.cover_url = data.cover_url
+            # Keep an already mirrored cover (light results carry CDN URLs)
+            if data.cover_url and not SupabaseStorage.is_stored_url(trend.cover_url):
+                trend.cover_url = data.cover_url
             trend.play_addr = data.play_addr
         else:
             # Create new trend
@@ -533,6 +552,7 @@ def save_video_to_favorites(
         db.commit()
 
         logger.info(f"⭐ User {current_user.id} saved video {data.platform_id} to favorites")
+        _mirror_cover(current_user.id, trend)
 
         return {
             "id": favorite.id,
@@ -0,0 +1,121 @@
+"""
+Internal service metrics (admin only).
+Latency/error counters for the backend's outbound dependencies and
+sizes of in-process caches/indexes.
+"""
+import logging
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from ...core.database import get_db
+from ...db.models import User
+from ...services.ml_client import get_ml_client
+from ...services.competitor_refresher import competitor_refresher
+from ...services.image_index import image_index
+from ...services.job_queue import queue_stats as pipeline_queue_stats
+from ...services.loop_monitor import loop_monitor
+from ...services.scheduler import leader
+from ...services.rescan_dispatcher import queue_stats
+from ...services.thumbnail_pipeline import thumbnail_pipeline
+from ...services.url_refresher import url_refresher
+from ...services.vector_index import vector_index
+from ..dependencies import get_current_admin_user
+from ..proxy import proxy_stats
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+@router.get("/ml-client")
+async def ml_client_metrics(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    ML service client metrics.
+
+    Returns circuit breaker state and per-endpoint request/error/retry
+    counts with p50/p95/p99 latency.
+    """
+    return get_ml_client().stats()
+
+
+@router.get("/vector-index")
+async def vector_index_metrics(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """In-process vector index size (users/rows loaded)."""
+    return vector_index.stats()
+
+
+@router.get("/thumbnails")
+async def thumbnail_pipeline_metrics(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Background thumbnail mirroring: running jobs, uploads, failures."""
+    return thumbnail_pipeline.stats()
+
+
+@router.get("/image-index")
+async def image_index_metrics(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Stored image index: source/content hit rates, orphan sweeps."""
+    return image_index.stats()
+
+
+@router.get("/proxy")
+async def image_proxy_metrics(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Image proxy: cache hit rate, upstream/residential bytes, residential bytes saved."""
+    return proxy_stats()
+
+
+@router.get("/url-refresher")
+async def url_refresher_metrics(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Expiring CDN URL refresher: tracked items, next expiry, collector runs."""
+    return url_refresher.stats()
+
+
+@router.get("/rescans")
+def rescan_metrics(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Rescan queue depth, scheduler lag (claimed - due) and throughput."""
+    return queue_stats(db)
+
+
+@router.get("/event-loop")
+async def event_loop_metrics(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Event loop lag (sleep drift) p50/p99/max, overall and while rescans run."""
+    return loop_monitor.stats()
+
+
+@router.get("/leader")
+async def leader_metrics(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Scheduler leader election: this process's role, elections/demotions."""
+    return leader.stats()
+
+
+@router.get("/pipeline")
+def pipeline_metrics(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Pipeline worker queues: pending/running jobs, oldest pending age, last hour done/failed."""
+    return pipeline_queue_stats(db)
+
+
+@router.get("/competitor-refresher")
+async def competitor_refresher_metrics(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Competitor fleet refresh: actor runs, profiles per run, tenant rows per profile."""
+    return competitor_refresher.stats()
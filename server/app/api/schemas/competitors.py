@@ -137,6 +137,7 @@ class CompetitorVideo(BaseModel):
     title: str
     url: str
     cover_url: Optional[str] = None
+    cover_srcset: Optional[Dict[str, str]] = None  # format -> "url 240w, url 480w, ..."
     uploaded_at: Optional[int] = None  # Unix timestamp
     views: int = 0
     stats: CompetitorVideoStats
@@ -270,6 +271,7 @@ class CompetitorFeedVideo(BaseModel):
     title: str
     description: str = ""
     thumbnail_url: Optional[str] = None
+    cover_srcset: Optional[Dict[str, str]] = None  # format -> "url 240w, url 480w, ..."
     video_url: Optional[str] = None  # URL for video playback
     url: str
     stats: CompetitorVideoStats
@@ -4,7 +4,7 @@ Pydantic schemas for User Favorites (Bookmarks).
 Allows users to save and organize interesting trends.
 """
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List
 from pydantic import BaseModel, Field, field_validator
 import re
 
@@ -96,6 +96,7 @@ class TrendSummary(BaseModel):
     play_addr: Optional[str] = None  # Direct CDN video URL for inline playback
     description: Optional[str] = None
     cover_url: Optional[str] = None
+    cover_srcset: Optional[Dict[str, str]] = None  # format -> "url 240w, url 480w, ..."
     author_username: Optional[str] = None
     uts_score: float = 0.0
     stats: dict = {}
@@ -229,6 +229,7 @@ class TrendBase(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
     cover_url: Optional[str] = None
+    cover_srcset: Optional[Dict[str, str]] = None  # format -> "url 240w, url 480w, ..."
     author_username: Optional[str] = None
 
 
@@ -320,6 +321,7 @@ class SavedTrendResponse(BaseModel):
     url: Optional[str] = None
     description: Optional[str] = None
     cover_url: Optional[str] = None
+    cover_srcset: Optional[Dict[str, str]] = None
     author_username: Optional[str] = None
     stats: Dict[str, Any] = {}
     uts_score: float = 0.0
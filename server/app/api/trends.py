@@ -13,7 +13,9 @@ import logging
 from datetime import datetime, timedelta
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from anyio import from_thread
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from sqlalchemy import or_, delete
 
@@ -25,10 +27,16 @@ from ..services.instagram_adapter import adapt_instagram_to_standard
 from ..services.instagram_profile_adapter import adapt_instagram_profile_to_posts
 from ..services.scorer import TrendScorer
 from ..services.ml_client import get_ml_client
-from ..services.clustering import cluster_trends_by_visuals
-from ..services.scheduler import scheduler, rescan_videos_task
+from ..services.clustering import embed_trend_covers
+from ..services.cluster_engine import assign_trends, sync_cluster_sizes
+from ..services.vector_index import (
+    vector_index, load_trend_embeddings, store_trend_embeddings, index_trend_embeddings
+)
+from ..services import job_queue
+from ..services.rescan_dispatcher import schedule_rescans
 from ..services.storage import SupabaseStorage
-from ..services.apify_storage import ApifyStorage
+from ..services.thumbnail_pipeline import thumbnail_pipeline
+from ..services.url_refresher import url_refresher
 
 from .dependencies import (
     get_current_user,
@@ -75,6 +83,7 @@ def trend_to_dict(trend: Trend) -> dict:
         "url": trend.url,
         "play_addr": trend.play_addr,  # Direct CDN video playback URL
         "cover_url": trend.cover_url,
+        "cover_srcset": SupabaseStorage.srcset(trend.cover_renditions),
         "description": trend.description,
         "author_username": trend.author_username,
         "stats": trend.stats,
@@ -103,19 +112,8 @@ def parse_video_data(item: dict, idx: int = 0) -> dict:
     if not cover_url:
         cover_url = item.get("coverUrl") or item.get("cover") or item.get("videoCover") or ""
     cover_url = cover_url.replace(".heic", ".jpeg").replace(".webp", ".jpeg") if cover_url else ""
-
-    # Upload thumbnail to Supabase Storage (permanent, no expiration)
-    # Fallback: if Supabase fails, use fix_tiktok_url (works ~1-3 days)
-    if cover_url:
-        video_id = str(item.get("id", "unknown"))
-        uploaded_cover = SupabaseStorage.upload_thumbnail(cover_url)
-        if uploaded_cover:
-            cover_url = uploaded_cover
-            logger.info(f"✅ Thumbnail uploaded to Supabase for video {video_id[:20]}")
-        else:
-            # Fallback: remove TikTok signatures (temporary fix)
-            cover_url = ApifyStorage.fix_tiktok_url(cover_url)
-            logger.warning(f"⚠️ Supabase upload failed, using fix_tiktok_url for {video_id[:20]}")
+    # CDN URL as-is: saved trends are mirrored to Supabase Storage in the
+    # background (thumbnail_pipeline), light results aren't persisted at all
 
     # Video URL
     video_url = (
@@ -334,6 +332,7 @@ def get_my_trends(
     offset = (page - 1) * per_page
 
     trends = query.order_by(Trend.created_at.desc()).offset(offset).limit(per_page).all()
+    url_refresher.track_trends(trends)  # keep signed play/cover URLs of viewed trends fresh
 
     items = [
         SavedTrendResponse(
@@ -343,6 +342,7 @@ def get_my_trends(
             url=t.url,
             description=t.description,
             cover_url=t.cover_url,
+            cover_srcset=SupabaseStorage.srcset(t.cover_renditions),
             author_username=t.author_username,
             stats=t.stats or {},
             uts_score=t.uts_score or 0.0,
@@ -640,6 +640,11 @@ def search_trends(
             uts_breakdown = scorer.calculate_uts_breakdown(uts_data, history_data, cascade_count)
 
             if existing:
+                # Not mirrored yet (or no renditions) -> take the fresh (signed) CDN cover for the pipeline
+                if parsed["cover_url"] and not (
+                    SupabaseStorage.is_stored_url(existing.cover_url) and existing.cover_renditions
+                ):
+                    existing.cover_url = parsed["cover_url"]
                 existing.initial_stats = current_stats
                 existing.stats = current_stats
                 existing.uts_score = uts_breakdown['final_score']
@@ -681,28 +686,83 @@ def search_trends(
         logger.error(f"Batch commit failed, rolling back: {e}")
         db.rollback()
 
+    # Mirror covers to Supabase Storage in the background; URLs are patched in when done
+    thumbnail_job = None
+    queued_thumbnails = None
+    if processed_trends and job_queue.queue_mode():
+        # Pipeline workers (python -m app.worker) mirror and cluster; the API only enqueues
+        try:
+            items = [[t.id, t.cover_url] for t in processed_trends if t.id and t.cover_url]
+            if items:
+                queued_thumbnails = {
+                    "job_id": job_queue.enqueue(
+                        db, job_queue.THUMBNAILS_QUEUE, {"items": items}, user_id=current_user.id
+                    ),
+                    "status": "queued",
+                    "total": len(items),
+                }
+            if req.is_deep:
+                job_queue.enqueue(
+                    db, job_queue.CLUSTERING_QUEUE,
+                    {"trend_ids": [t.id for t in processed_trends if t.id]}, user_id=current_user.id
+                )
+            db.commit()
+        except Exception as e:
+            logger.error(f"Enqueueing pipeline jobs failed: {e}")
+            db.rollback()
+            queued_thumbnails = None
+    elif processed_trends:
+        try:
+            thumbnail_job = from_thread.run_sync(
+                thumbnail_pipeline.submit,
+                current_user.id,
+                [(t.id, t.cover_url) for t in processed_trends if t.id]
+            )
+        except Exception as e:
+            logger.warning(f"Thumbnail pipeline unavailable: {e}")
+
     # Clustering
-    if req.is_deep and processed_trends:
+    if req.is_deep and processed_trends and not job_queue.queue_mode():
         logger.info(f"🧩 Clustering {len(processed_trends)} videos...")
-        processed_trends = cluster_trends_by_visuals(processed_trends)
+        # Re-scanned videos already have a stored cover embedding — don't embed them again
+        try:
+            reused = load_trend_embeddings(db, processed_trends)
+            if reused:
+                logger.info(f"♻️ Reusing {reused} stored cover embeddings")
+        except Exception as e:
+            logger.warning(f"Loading stored embeddings failed: {e}")
+        # Async ML client lives on the event loop; this handler runs in the threadpool
+        processed_trends = from_thread.run(embed_trend_covers, processed_trends)
         for t in processed_trends:
             db.add(t)
         try:
+            # Keep the cover embeddings (semantic search / similar trends)
+            stored = store_trend_embeddings(db, processed_trends)
+            db.commit()
+            index_trend_embeddings(stored)
+            logger.info(f"🧭 Stored {len(stored)} cover embeddings")
+        except Exception as e:
+            logger.error(f"Saving cover embeddings failed: {e}")
+            db.rollback()
+        try:
+            # Online assignment to the user's persistent visual clusters (stable ids, O(k) per cover)
+            assign_trends(db, current_user.id, processed_trends)
             db.commit()
-        except:
+        except Exception as e:
+            logger.error(f"Saving clustering results failed: {e}")
             db.rollback()
 
-    # Schedule rescan
+    # Schedule rescan (durable: video_rescans, batched across users by the dispatcher)
     if req.is_deep and processed_trends:
-        saved_urls = [t.url for t in processed_trends if t.url]
-        if saved_urls:
-            run_date = datetime.now() + timedelta(hours=req.rescan_hours)
-            scheduler.add_job(
-                rescan_videos_task, 'date',
-                run_date=run_date,
-                args=[saved_urls, f"batch_{int(time.time())}_{current_user.id}"]
-            )
-            logger.info(f"⏱️ Rescan scheduled in {req.rescan_hours}h for user {current_user.id}")
+        try:
+            due_at = datetime.utcnow() + timedelta(hours=req.rescan_hours)
+            queued = schedule_rescans(db, processed_trends, due_at)
+            db.commit()
+            if queued:
+                logger.info(f"⏱️ Rescan of {queued} videos scheduled in {req.rescan_hours}h for user {current_user.id}")
+        except Exception as e:
+            logger.error(f"Scheduling rescan failed: {e}")
+            db.rollback()
 
     # Build deep response
     deep_results = []
@@ -774,8 +834,120 @@ def search_trends(
         "status": "ok",
         "mode": "deep",
         "items": deep_results,
-        "clusters": clusters_list
+        "clusters": clusters_list,
+        "thumbnails": thumbnail_job.to_dict() if thumbnail_job else queued_thumbnails
+    }
+
+
+@router.get("/thumbnails/{job_id}")
+def get_thumbnail_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Status of a background thumbnail mirroring job (handle returned by a
+    deep search). cover_urls maps trend_id -> stored cover URL.
+    """
+    job = thumbnail_pipeline.get_job(job_id)
+    if not job and job_queue.queue_mode():
+        # Mirrored by a pipeline worker: pipeline_jobs row (result = the job's to_dict())
+        queued = job_queue.get_job(db, job_id)
+        if queued and queued.user_id == current_user.id:
+            return {
+                **(queued.result or {"total": len(queued.payload.get("items", []))}),
+                "job_id": queued.id,
+                "status": "queued" if queued.status == "pending" else queued.status,
+            }
+    if not job or job.user_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Thumbnail job not found (finished jobs expire; stored URLs are on the trends)"
+        )
+    return job.to_dict()
+
+
+@router.get("/semantic-search")
+def semantic_search_trends(
+    q: str = Query(..., min_length=2, max_length=300),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Search the user's saved trends by meaning.
+
+    The query is embedded with CLIP text features and ranked against the
+    stored cover embeddings by cosine similarity (in-process vector index).
+
+    User Isolation: Only searches trends belonging to the authenticated user.
+    """
+    query_embedding = from_thread.run(get_ml_client().get_text_embedding, q)
+    if query_embedding is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Semantic search is temporarily unavailable"
+        )
+
+    hits = vector_index.search(db, current_user.id, np.asarray(query_embedding, dtype=np.float32), limit)
+    if not hits:
+        return {"status": "ok", "query": q, "items": []}
+
+    # Re-check ownership/existence (index rows may outlive deleted trends)
+    trends_by_id = {
+        t.id: t for t in db.query(Trend).filter(
+            Trend.user_id == current_user.id,
+            Trend.id.in_([trend_id for trend_id, _ in hits])
+        ).all()
     }
+    items = [
+        {**trend_to_dict(trends_by_id[trend_id]), "similarity": round(score, 4)}
+        for trend_id, score in hits if trend_id in trends_by_id
+    ]
+
+    return {"status": "ok", "query": q, "items": items}
+
+
+@router.get("/{trend_id}/similar")
+def get_similar_trends(
+    trend_id: int,
+    limit: int = Query(12, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Visually similar trends from the user's library.
+
+    Uses the stored cover embeddings only (no ML service call).
+
+    User Isolation: Only returns trends belonging to the authenticated user.
+    """
+    trend = db.query(Trend).filter(
+        Trend.id == trend_id,
+        Trend.user_id == current_user.id
+    ).first()
+    if not trend:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trend not found")
+
+    hits = vector_index.similar(db, current_user.id, trend_id, limit)
+    if hits is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No visual embedding for this trend yet (run a deep search first)"
+        )
+
+    trends_by_id = {
+        t.id: t for t in db.query(Trend).filter(
+            Trend.user_id == current_user.id,
+            Trend.id.in_([hit_id for hit_id, _ in hits])
+        ).all()
+    } if hits else {}
+    items = [
+        {**trend_to_dict(trends_by_id[hit_id]), "similarity": round(score, 4)}
+        for hit_id, score in hits if hit_id in trends_by_id
+    ]
+
+    return {"status": "ok", "trend_id": trend_id, "items": items}
 
 
 @router.delete("/clear")
@@ -795,7 +967,9 @@ def clear_user_trends(
         query = query.filter(Trend.vertical.ilike(f"%{vertical}%"))
 
     deleted_count = query.delete(synchronize_session=False)
+    sync_cluster_sizes(db, current_user.id)
     db.commit()
+    vector_index.invalidate(current_user.id)
 
     logger.info(f"🗑️ Cleared {deleted_count} trends for user {current_user.id}")
 
@@ -14,6 +14,7 @@ import logging
 from ..core.database import get_db
 from ..services.gemini_script_generator import GeminiScriptGenerator
 from .dependencies import get_current_user, CreditManager
+from ..services.credit_ledger import CreditLedger, InsufficientCreditsError
 from ..db.models import User, Workflow, WorkflowStatus, WorkflowRun, WorkflowRunStatus
 from ..services.workflow_templates import get_templates, get_template_by_id
 
@@ -454,12 +455,14 @@ async def analyze_video(
     """
     CREDIT_COST = 3
 
-    # Check credits
+    # Check credits and hold them while the analysis runs
     CreditManager.check_and_reset_monthly(current_user, db)
-    if current_user.credits < CREDIT_COST:
+    try:
+        reservation = CreditLedger.reserve(db, current_user, CREDIT_COST, "analyze_video")
+    except InsufficientCreditsError as e:
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
-            detail=f"Insufficient credits. Need {CREDIT_COST}, have {current_user.credits}"
+            detail=f"Insufficient credits. Need {CREDIT_COST}, have {e.available}"
         )
 
     try:
@@ -481,8 +484,7 @@ async def analyze_video(
         )
 
         # Deduct credits
-        current_user.credits -= CREDIT_COST
-        db.commit()
+        CreditLedger.settle(db, current_user, reservation, used=CREDIT_COST)
 
         return {
             "success": True,
@@ -493,6 +495,8 @@ async def analyze_video(
 
     except Exception as e:
         logger.error(f"[VIDEO-API] Analysis error: {e}")
+        db.rollback()  # a failed settle leaves the session unusable
+        CreditLedger.refund(db, current_user, reservation)
         raise HTTPException(
             status_code=500,
             detail=f"Video analysis failed: {str(e)}"
@@ -1193,6 +1197,9 @@ async def execute_workflow(
     db.commit()
     db.refresh(workflow_run)
 
+    reservation = None
+    total_credits_used = 0
+
     try:
         logger.info(f"[WORKFLOW] User {current_user.id} executing workflow (run {workflow_run.id}) with {len(request.nodes)} nodes")
 
@@ -1210,20 +1217,25 @@ async def execute_workflow(
         # Check monthly credit reset
         CreditManager.check_and_reset_monthly(current_user, db)
 
-        # Pre-check: estimate total cost
+        # Reserve the estimated total cost up front; settled against actual usage at the end
         estimated_cost = CreditManager.estimate_workflow_cost(request.nodes)
-        if current_user.credits < estimated_cost:
+        try:
+            reservation = CreditLedger.reserve(
+                db, current_user, estimated_cost, "workflow",
+                reference=f"workflow_run:{workflow_run.id}"
+            )
+        except InsufficientCreditsError as e:
             workflow_run.status = WorkflowRunStatus.FAILED
-            workflow_run.error_message = f"Insufficient credits: need {estimated_cost}, have {current_user.credits}"
+            workflow_run.error_message = f"Insufficient credits: need {estimated_cost}, have {e.available}"
             workflow_run.completed_at = datetime.utcnow()
             db.commit()
             raise HTTPException(
                 status_code=status.HTTP_402_PAYMENT_REQUIRED,
                 detail={
                     "error": "Insufficient credits for workflow",
-                    "message": f"This workflow costs ~{estimated_cost} credits, you have {current_user.credits}",
+                    "message": f"This workflow costs ~{estimated_cost} credits, you have {e.available}",
                     "required": estimated_cost,
-                    "available": current_user.credits,
+                    "available": e.available,
                     "upgrade_url": "/pricing"
                 }
             )
@@ -1237,7 +1249,6 @@ async def execute_workflow(
         results: List[NodeResult] = []
         final_script = None
         storyboard = None
-        total_credits_used = 0
 
         nodes_by_id = {n.id: n for n in request.nodes}
 
@@ -1283,12 +1294,9 @@ async def execute_workflow(
 
                 node_outputs[node_id] = output
 
-                # Deduct credits for AI nodes
+                # Count credits for AI nodes (charged against the reservation)
                 node_model = (node_config.model if node_config and node_config.model else "gemini")
-                node_cost = CreditManager.get_workflow_node_cost(node.type, node_model)
-                if node_cost > 0:
-                    current_user.credits = max(0, current_user.credits - node_cost)
-                    total_credits_used += node_cost
+                total_credits_used += CreditManager.get_workflow_node_cost(node.type, node_model)
 
                 results.append(NodeResult(
                     node_id=node_id,
@@ -1327,7 +1335,14 @@ async def execute_workflow(
                 wf.last_run_results = {"run_id": workflow_run.id, "credits_used": total_credits_used}
                 wf.status = WorkflowStatus.COMPLETED
 
-        db.commit()
+        # Refund unused reserved credits in the same transaction as the run record
+        CreditLedger.settle(db, current_user, reservation, used=total_credits_used, commit=False)
+        try:
+            db.commit()
+        except Exception:
+            # Settle rolled back with the run record: reopen it so the failure path refunds
+            CreditLedger.rollback(db, reservation)
+            raise
 
         logger.info(f"[WORKFLOW] Completed run {workflow_run.id} with {len(results)} results, {total_credits_used} credits used, {execution_time_ms}ms")
 
@@ -1344,10 +1359,14 @@ async def execute_workflow(
         raise
     except Exception as e:
         logger.error(f"[WORKFLOW] Execution error: {e}")
+        db.rollback()  # the session may hold a failed flush/commit
         workflow_run.status = WorkflowRunStatus.FAILED
         workflow_run.error_message = str(e)
         workflow_run.completed_at = datetime.utcnow()
         workflow_run.execution_time_ms = int((time.time() - start_time) * 1000)
+        workflow_run.credits_used = total_credits_used
+        if reservation:
+            CreditLedger.settle(db, current_user, reservation, used=total_credits_used, commit=False)
         db.commit()
         raise HTTPException(
             status_code=500,
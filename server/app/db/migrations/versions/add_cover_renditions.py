@@ -0,0 +1,26 @@
+"""add thumbnail renditions (trends.cover_renditions, stored_images.renditions)
+
+Revision ID: add_cover_renditions
+Revises: add_stored_images
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_cover_renditions'
+down_revision = 'add_stored_images'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE trends ADD COLUMN IF NOT EXISTS cover_renditions JSONB")
+    op.execute("ALTER TABLE stored_images ADD COLUMN IF NOT EXISTS renditions JSONB")
+
+
+def downgrade():
+    op.execute("ALTER TABLE stored_images DROP COLUMN IF EXISTS renditions")
+    op.execute("ALTER TABLE trends DROP COLUMN IF EXISTS cover_renditions")
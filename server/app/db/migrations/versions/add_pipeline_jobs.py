@@ -0,0 +1,51 @@
+"""add pipeline_jobs table (queue for standalone pipeline workers)
+
+Revision ID: add_pipeline_jobs
+Revises: add_rescan_tracking
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_pipeline_jobs'
+down_revision = 'add_rescan_tracking'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_jobs (
+            id VARCHAR(32) PRIMARY KEY,
+            queue VARCHAR(32) NOT NULL,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            payload JSONB NOT NULL DEFAULT '{}',
+            result JSONB,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            run_after TIMESTAMP NOT NULL DEFAULT NOW(),
+            leased_until TIMESTAMP,
+            worker_id VARCHAR(100),
+            error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_pipeline_jobs_user_id ON pipeline_jobs (user_id)")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_pipeline_jobs_queue_status_run "
+        "ON pipeline_jobs (queue, status, run_after)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_pipeline_jobs_status_lease "
+        "ON pipeline_jobs (status, leased_until)"
+    )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS pipeline_jobs")
@@ -0,0 +1,36 @@
+"""add adaptive rescan tracking fields to trends
+
+Revision ID: add_rescan_tracking
+Revises: add_video_rescans
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_rescan_tracking'
+down_revision = 'add_video_rescans'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE trends ADD COLUMN IF NOT EXISTS scan_count INTEGER NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE trends ADD COLUMN IF NOT EXISTS views_per_hour DOUBLE PRECISION")
+    op.execute("ALTER TABLE trends ADD COLUMN IF NOT EXISTS stagnant_scans INTEGER NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE trends ADD COLUMN IF NOT EXISTS tracking_stopped_at TIMESTAMP")
+    # Per-user daily rescan budget: rescans claimed in the last 24h
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_video_rescans_user_started "
+        "ON video_rescans (user_id, started_at)"
+    )
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_video_rescans_user_started")
+    op.execute("ALTER TABLE trends DROP COLUMN IF EXISTS tracking_stopped_at")
+    op.execute("ALTER TABLE trends DROP COLUMN IF EXISTS stagnant_scans")
+    op.execute("ALTER TABLE trends DROP COLUMN IF EXISTS views_per_hour")
+    op.execute("ALTER TABLE trends DROP COLUMN IF EXISTS scan_count")
@@ -0,0 +1,39 @@
+"""add stored_images table (content-addressed thumbnail index)
+
+Revision ID: add_stored_images
+Revises: add_visual_clusters
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_stored_images'
+down_revision = 'add_visual_clusters'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS stored_images (
+            id SERIAL PRIMARY KEY,
+            source_key VARCHAR(2048) NOT NULL,
+            content_hash VARCHAR(64) NOT NULL,
+            path VARCHAR(255) NOT NULL,
+            public_url VARCHAR(1000) NOT NULL,
+            content_type VARCHAR(50),
+            size_bytes INTEGER,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_stored_images_id ON stored_images (id)")
+    op.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_stored_images_source_key ON stored_images (source_key)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_stored_images_content_hash ON stored_images (content_hash)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_stored_images_path ON stored_images (path)")
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS stored_images")
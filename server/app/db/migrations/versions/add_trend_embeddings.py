@@ -0,0 +1,35 @@
+"""add trend_embeddings table (float16 cover embeddings)
+
+Revision ID: add_trend_embeddings
+Revises: add_credit_ledger
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_trend_embeddings'
+down_revision = 'add_credit_ledger'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS trend_embeddings (
+            trend_id INTEGER PRIMARY KEY REFERENCES trends(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            model VARCHAR(100) NOT NULL,
+            dim INTEGER NOT NULL,
+            vector BYTEA NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_trend_embeddings_user_id ON trend_embeddings (user_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_trend_embeddings_user_model ON trend_embeddings (user_id, model)")
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS trend_embeddings")
@@ -0,0 +1,29 @@
+"""add url_refresh_claims table (cross-worker dedupe of CDN URL refreshes)
+
+Revision ID: add_url_refresh_claims
+Revises: add_pipeline_jobs
+Create Date: 2026-10-20 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_url_refresh_claims'
+down_revision = 'add_pipeline_jobs'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS url_refresh_claims (
+            page_key TEXT PRIMARY KEY,
+            claimed_until TIMESTAMP NOT NULL
+        )
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS url_refresh_claims")
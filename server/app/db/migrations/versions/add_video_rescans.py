@@ -0,0 +1,48 @@
+"""add video_rescans table (durable cross-user rescan queue)
+
+Revision ID: add_video_rescans
+Revises: add_cover_renditions
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_video_rescans'
+down_revision = 'add_cover_renditions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS video_rescans (
+            id SERIAL PRIMARY KEY,
+            trend_id INTEGER NOT NULL REFERENCES trends(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            url TEXT NOT NULL,
+            due_at TIMESTAMP NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            batch_id VARCHAR(64),
+            error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_video_rescans_id ON video_rescans (id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_video_rescans_trend_id ON video_rescans (trend_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_video_rescans_user_id ON video_rescans (user_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_video_rescans_status_due ON video_rescans (status, due_at)")
+    # One pending rescan per trend (re-scheduling moves it)
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uix_video_rescans_pending_trend "
+        "ON video_rescans (trend_id) WHERE status = 'pending'"
+    )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS video_rescans")
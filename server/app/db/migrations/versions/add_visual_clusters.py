@@ -0,0 +1,46 @@
+"""add visual_clusters table and trend_embeddings.cluster_id
+
+Revision ID: add_visual_clusters
+Revises: add_trend_embeddings
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_visual_clusters'
+down_revision = 'add_trend_embeddings'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS visual_clusters (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            model VARCHAR(100) NOT NULL,
+            centroid BYTEA NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            merged_into INTEGER,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_visual_clusters_id ON visual_clusters (id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_visual_clusters_user_id ON visual_clusters (user_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_visual_clusters_user_model ON visual_clusters (user_id, model)")
+
+    op.execute("""
+        ALTER TABLE trend_embeddings
+        ADD COLUMN IF NOT EXISTS cluster_id INTEGER REFERENCES visual_clusters(id) ON DELETE SET NULL
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_trend_embeddings_cluster_id ON trend_embeddings (cluster_id)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_trend_embeddings_cluster_id")
+    op.execute("ALTER TABLE trend_embeddings DROP COLUMN IF EXISTS cluster_id")
+    op.execute("DROP TABLE IF EXISTS visual_clusters")
@@ -12,8 +12,8 @@ Architecture:
 """
 from datetime import datetime
 from sqlalchemy import (
-    Column, Integer, String, Float, Text, DateTime, Boolean,
-    ForeignKey, UniqueConstraint, Index, Enum as SQLEnum
+    Column, Integer, String, Float, Text, DateTime, Boolean, LargeBinary,
+    ForeignKey, UniqueConstraint, Index, Enum as SQLEnum, text
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB
@@ -236,6 +236,42 @@ class UserSettings(Base):
         return f"<UserSettings(user_id={self.user_id})>"
 
 
+class CreditLedgerEntry(Base):
+    """
+    Append-only log of every credit balance change.
+
+    Written in the same statement as the users.credits update
+    (see services/credit_ledger.py), never updated or deleted.
+    delta < 0 is a debit, delta > 0 a refund/grant.
+    """
+    __tablename__ = "credit_ledger"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+
+    delta = Column(Integer, nullable=False)
+    balance_after = Column(Integer, nullable=False)
+    kind = Column(String(20), nullable=False)  # 'charge', 'reserve', 'settle', 'refund', 'reset'
+    reason = Column(String(50), nullable=False)  # 'chat:claude', 'workflow', 'competitor_add', ...
+    reference = Column(String(100), nullable=True)  # e.g. 'workflow_run:42'
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # Index for per-user usage stats
+    __table_args__ = (
+        Index('ix_credit_ledger_user_created', 'user_id', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f"<CreditLedgerEntry(user_id={self.user_id}, delta={self.delta}, reason='{self.reason}')>"
+
+
 # =============================================================================
 # TREND MODELS
 # =============================================================================
@@ -274,6 +310,7 @@ class Trend(Base):
     # Content
     description = Column(Text)
     cover_url = Column(Text)  # Supabase or TikTok CDN URL
+    cover_renditions = Column(JSONB, nullable=True)  # {"webp": {"240": url, ...}, ...} (see storage.srcset)
     vertical = Column(String(100), index=True)  # Search keyword/category
 
     # Music/Sound Data (for sound cascade analysis)
@@ -307,6 +344,12 @@ class Trend(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     last_scanned_at = Column(DateTime, nullable=True)
 
+    # Adaptive rescan tracking (see services/rescan_cadence.py)
+    scan_count = Column(Integer, default=0, nullable=False)
+    views_per_hour = Column(Float, nullable=True)  # Relative growth per hour at the last rescan
+    stagnant_scans = Column(Integer, default=0, nullable=False)  # Consecutive flat rescans
+    tracking_stopped_at = Column(DateTime, nullable=True)  # Growth flattened / tracking window over
+
     # Relationship
     user = relationship("User", back_populates="trends")
     favorites = relationship("UserFavorite", back_populates="trend", cascade="all, delete-orphan")
@@ -327,6 +370,231 @@ class Trend(Base):
         return f"<Trend(id={self.id}, user_id={self.user_id}, platform_id='{self.platform_id}')>"
 
 
+class TrendEmbedding(Base):
+    """
+    CLIP cover embedding of a trend, stored compactly as float16 bytes
+    (dim * 2 bytes, 1 KB for 512-dim) instead of a JSON/float list.
+
+    Written by visual clustering; read by the in-process vector index
+    (see services/vector_index.py) for semantic search and similar trends.
+    """
+    __tablename__ = "trend_embeddings"
+
+    trend_id = Column(
+        Integer,
+        ForeignKey("trends.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+
+    model = Column(String(100), nullable=False)  # e.g. 'openai/clip-vit-base-patch32'
+    dim = Column(Integer, nullable=False)
+    vector = Column(LargeBinary, nullable=False)  # little-endian float16, dim values
+
+    # Visual cluster membership (see services/cluster_engine.py)
+    cluster_id = Column(
+        Integer,
+        ForeignKey("visual_clusters.id", ondelete="SET NULL"),
+        nullable=True,
+        index=True
+    )
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # Index for loading a user's index
+    __table_args__ = (
+        Index('ix_trend_embeddings_user_model', 'user_id', 'model'),
+    )
+
+    def __repr__(self):
+        return f"<TrendEmbedding(trend_id={self.trend_id}, user_id={self.user_id}, dim={self.dim})>"
+
+
+class VisualCluster(Base):
+    """
+    Persistent visual cluster of a user's trend covers.
+
+    The id is stable across searches: new covers join the nearest centroid
+    (online assignment), and periodic re-clustering maps its labels back
+    onto existing ids. Trend.cluster_id mirrors the id once a cluster has
+    2+ members (-1 otherwise, like DBSCAN noise).
+    """
+    __tablename__ = "visual_clusters"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+
+    model = Column(String(100), nullable=False)
+    centroid = Column(LargeBinary, nullable=False)  # float16 running mean of normalized member embeddings
+    size = Column(Integer, default=0, nullable=False)
+    merged_into = Column(Integer, nullable=True)  # set when merged into another cluster (id remap)
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Index for loading a user's active clusters
+    __table_args__ = (
+        Index('ix_visual_clusters_user_model', 'user_id', 'model'),
+    )
+
+    def __repr__(self):
+        return f"<VisualCluster(id={self.id}, user_id={self.user_id}, size={self.size})>"
+
+
+class StoredImage(Base):
+    """
+    Index of images mirrored to Supabase Storage (content-addressed paths).
+
+    One row per canonical source URL (signatures stripped); rows with the
+    same content_hash share one object. Lets re-scans and competitor
+    refreshes reuse the stored copy instead of downloading/uploading again.
+    """
+    __tablename__ = "stored_images"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source_key = Column(String(2048), unique=True, nullable=False, index=True)
+    content_hash = Column(String(64), nullable=False, index=True)  # sha256 of the downloaded bytes
+    path = Column(String(255), nullable=False, index=True)  # object path in the bucket
+    public_url = Column(String(1000), nullable=False)
+    content_type = Column(String(50), nullable=True)
+    size_bytes = Column(Integer, nullable=True)
+    renditions = Column(JSONB, nullable=True)  # {"webp": {"240": url, ...}, "avif": {...}, "jpeg": {...}}
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<StoredImage(id={self.id}, path='{self.path}')>"
+
+
+class VideoRescan(Base):
+    """
+    Durable rescan queue (point B of the UTS growth measurement).
+
+    One row per trend per scheduled rescan. The dispatcher claims due rows
+    with FOR UPDATE SKIP LOCKED (safe with several workers), scrapes each
+    distinct URL once for all users and fans the stats out to every Trend
+    with that URL. At most one pending row per trend.
+    """
+    __tablename__ = "video_rescans"
+
+    id = Column(Integer, primary_key=True, index=True)
+    trend_id = Column(
+        Integer,
+        ForeignKey("trends.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+    url = Column(Text, nullable=False)
+
+    due_at = Column(DateTime, nullable=False)
+    status = Column(String(20), default="pending", nullable=False)  # pending, running, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    batch_id = Column(String(64), nullable=True)
+    error = Column(Text, nullable=True)
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    # Index for claiming due rescans
+    __table_args__ = (
+        Index('ix_video_rescans_status_due', 'status', 'due_at'),
+        # Per-user daily rescan budget
+        Index('ix_video_rescans_user_started', 'user_id', 'started_at'),
+        Index(
+            'uix_video_rescans_pending_trend', 'trend_id',
+            unique=True, postgresql_where=text("status = 'pending'")
+        ),
+    )
+
+    def __repr__(self):
+        return f"<VideoRescan(id={self.id}, trend_id={self.trend_id}, status='{self.status}')>"
+
+
+class PipelineJob(Base):
+    """
+    Work queue for standalone pipeline workers (python -m app.worker).
+
+    One row per unit of work on a stage queue ("thumbnails", "clustering").
+    Workers claim rows with FOR UPDATE SKIP LOCKED and hold them for a lease
+    (leased_until, extended while the job runs); a job whose worker died is
+    picked up again once the lease expires.
+    """
+    __tablename__ = "pipeline_jobs"
+
+    id = Column(String(32), primary_key=True)  # uuid hex, also the client-facing job handle
+    queue = Column(String(32), nullable=False)
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=True,
+        index=True
+    )
+    payload = Column(JSONB, default={}, nullable=False)
+    result = Column(JSONB, nullable=True)
+
+    status = Column(String(20), default="pending", nullable=False)  # pending, running, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    run_after = Column(DateTime, default=datetime.utcnow, nullable=False)
+    leased_until = Column(DateTime, nullable=True)
+    worker_id = Column(String(100), nullable=True)
+    error = Column(Text, nullable=True)
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Claiming: pending rows of a queue in order
+        Index('ix_pipeline_jobs_queue_status_run', 'queue', 'status', 'run_after'),
+        # Reclaiming expired leases
+        Index('ix_pipeline_jobs_status_lease', 'status', 'leased_until'),
+    )
+
+    def __repr__(self):
+        return f"<PipelineJob(id='{self.id}', queue='{self.queue}', status='{self.status}')>"
+
+
+class UrlRefreshClaim(Base):
+    """
+    Cross-worker dedupe for the expiring CDN URL refresher.
+
+    Every worker tracks the items its own users viewed, so the same post can
+    be due on several of them at once. Before scraping, a worker claims the
+    post's page_key until claimed_until; a page another worker holds a live
+    claim on is skipped instead of being scraped twice.
+    """
+    __tablename__ = "url_refresh_claims"
+
+    page_key = Column(Text, primary_key=True)  # url_refresher.page_key(post url)
+    claimed_until = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<UrlRefreshClaim(page_key='{self.page_key}', claimed_until={self.claimed_until})>"
+
+
 class UserFavorite(Base):
     """
     User's bookmarked/favorited trends.
@@ -34,12 +34,17 @@ from .db import models
 
 # API Routers - Updated with new enterprise routes
 from .api import trends, profiles, competitors, ai_scripts, proxy, favorites
-from .api.routes import auth, oauth, feedback, usage
+from .api.routes import auth, oauth, feedback, usage, metrics
 from .api import chat_sessions as chat_sessions_router
 from .api import workflows as workflows_router
 
 # Background Scheduler
-from .services.scheduler import start_scheduler
+from .services.scheduler import leader, start_scheduler
+from .services.ml_client import get_ml_client
+from .services.image_decode import shutdown_pool as shutdown_image_decode_pool
+from .services.thumbnail_pipeline import thumbnail_pipeline
+from .services.loop_monitor import loop_monitor
+from .services.rescan_dispatcher import rescans_active, shutdown_executor as shutdown_rescan_executor
 
 
 # =============================================================================
@@ -92,7 +97,7 @@ async def api_key_middleware(request: Request, call_next):
         return await call_next(request)
 
     # Skip protection if no key is set (development) or for public endpoints
-    public_paths = ["/", "/health", "/docs", "/redoc", "/openapi.json", "/api/auth/login", "/api/auth/register", "/api/auth/oauth/sync", "/api/proxy/image"]
+    public_paths = ["/", "/health", "/docs", "/redoc", "/openapi.json", "/api/auth/login", "/api/auth/register", "/api/auth/oauth/sync", "/api/proxy/image", "/api/proxy/video"]
 
     if API_SECRET_KEY and request.url.path not in public_paths:
         # Check for API key in header
@@ -271,6 +276,13 @@ app.include_router(
 )
 
 
+# Internal service metrics (admin only)
+app.include_router(
+    metrics.router,
+    prefix="/api"
+)
+
+
 # =============================================================================
 # LIFECYCLE EVENTS
 # =============================================================================
@@ -290,6 +302,9 @@ async def startup_event():
     except Exception as e:
         logger.info(f"ℹ️  play_addr column fix skipped: {e}")
 
+    # Event loop lag (separately while rescans run) -> /api/metrics/event-loop
+    loop_monitor.start(busy=rescans_active)
+
     # Start background scheduler for auto-rescan
     try:
         logger.info("⏳ Initializing Background Scheduler...")
@@ -306,6 +321,13 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown."""
     logger.info("🛑 Shutting down Rizko.ai Backend...")
+    await get_ml_client().aclose()
+    await thumbnail_pipeline.aclose()
+    await proxy.close_clients()
+    await loop_monitor.stop()
+    await leader.stop()  # releases the advisory lock -> a standby takes over at once
+    shutdown_image_decode_pool()
+    shutdown_rescan_executor()
 
 
 # =============================================================================
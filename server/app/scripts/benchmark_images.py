@@ -0,0 +1,103 @@
+"""
+Benchmark image conversion: the old inline full decode vs image_decode.
+
+Each path runs in a fresh process over a folder of sample covers (mix in
+HEIC/WebP files to exercise the process pool) and reports images/sec,
+CPU time per image (including pool processes) and peak RSS.
+
+Usage:
+    python -m app.scripts.benchmark_images --images ./covers/ --rounds 5
+    python -m app.scripts.benchmark_images --images ./covers/ --max-side 540
+"""
+import argparse
+import mimetypes
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+CONTENT_TYPES = {".heic": "image/heic", ".heif": "image/heif", ".avif": "image/avif", ".webp": "image/webp"}
+
+
+def _content_type(name: str) -> str:
+    ext = os.path.splitext(name)[1].lower()
+    return CONTENT_TYPES.get(ext) or mimetypes.guess_type(name)[0] or "image/jpeg"
+
+
+def _legacy(data: bytes, max_side) -> bytes:
+    from io import BytesIO
+    from PIL import Image
+
+    img = Image.open(BytesIO(data)).convert("RGB")
+    if max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=None)
+    output = BytesIO()
+    img.save(output, format="JPEG", quality=85, optimize=True)
+    return output.getvalue()
+
+
+def _worker(job) -> dict:
+    """One path in a fresh process: ru_maxrss is this path's peak only"""
+    import resource
+    from app.services.image_decode import shutdown_pool, to_jpeg
+
+    images_dir, mode, rounds, max_side = job
+    files = []
+    for name in sorted(os.listdir(images_dir)):
+        with open(os.path.join(images_dir, name), "rb") as f:
+            files.append((f.read(), _content_type(name)))
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    wall = time.perf_counter()
+    cpu_self = resource.getrusage(resource.RUSAGE_SELF)
+    converted = 0
+    for _ in range(rounds):
+        for data, content_type in files:
+            try:
+                if mode == "legacy":
+                    _legacy(data, max_side)
+                else:
+                    to_jpeg(data, content_type, max_side)
+                converted += 1
+            except Exception:
+                pass
+    elapsed = time.perf_counter() - wall
+    shutdown_pool()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (usage.ru_utime + usage.ru_stime - cpu_self.ru_utime - cpu_self.ru_stime
+           + children.ru_utime + children.ru_stime)
+    return {
+        "images": converted,
+        "wall": elapsed,
+        "cpu": cpu,
+        "peak_mb": (usage.ru_maxrss - baseline_kb) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image conversion benchmark")
+    parser.add_argument("--images", required=True, help="Folder of sample covers")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--max-side", type=int, default=None, help="Also downscale (thumbnail size)")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("legacy", "image_decode"):
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results[mode] = pool.submit(_worker, (args.images, mode, args.rounds, args.max_side)).result()
+
+    print("=" * 50)
+    for mode, r in results.items():
+        per_image = r["cpu"] * 1000 / max(r["images"], 1)
+        print(f"   {mode:13} {r['images'] / r['wall']:7.1f} images/s   "
+              f"CPU {per_image:6.2f}ms/image   peak +{r['peak_mb']:.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Visual Cluster Engine
+Incremental clustering of cover embeddings with stable cluster ids.
+
+Each user has a set of persistent clusters (visual_clusters: running-mean
+centroid + size). A new cover joins the nearest centroid if it is within
+CLUSTER_ASSIGN_DISTANCE (cosine), otherwise it starts a new cluster; two
+centroids that drift within CLUSTER_MERGE_DISTANCE are merged. Assigning a
+batch costs O(k) per cover instead of re-running DBSCAN over the whole set.
+
+Online assignment depends on arrival order, so a periodic offline job
+(recluster_user) runs DBSCAN over the user's library and maps the new labels
+back onto existing ids by majority overlap — ids stay stable, centroids and
+memberships are corrected.
+
+Membership lives in trend_embeddings.cluster_id. Trend.cluster_id mirrors it
+once the cluster has 2+ members; singletons stay -1 (DBSCAN "noise").
+"""
+import logging
+import os
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from sklearn.cluster import DBSCAN
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..db.models import TrendEmbedding, VisualCluster
+from .vector_index import EMBEDDING_MODEL, from_blobs, to_blob
+
+logger = logging.getLogger(__name__)
+
+# Same radius the per-search DBSCAN used (eps=0.15)
+CLUSTER_ASSIGN_DISTANCE = float(os.getenv("CLUSTER_ASSIGN_DISTANCE", "0.15"))
+CLUSTER_MERGE_DISTANCE = float(os.getenv("CLUSTER_MERGE_DISTANCE", "0.08"))
+# Full re-clustering is O(n^2) in memory; bigger libraries recluster their newest rows only
+RECLUSTER_MAX_ROWS = int(os.getenv("RECLUSTER_MAX_ROWS", "20000"))
+RECLUSTER_INTERVAL_HOURS = float(os.getenv("RECLUSTER_INTERVAL_HOURS", "24"))
+
+# pg_advisory_xact_lock(namespace, user_id): serializes a user's cluster updates across workers
+_LOCK_NAMESPACE = 36
+
+_UPDATE_PUBLIC_IDS = text("""
+    UPDATE trends t
+    SET cluster_id = CASE WHEN vc.size >= 2 THEN vc.id ELSE -1 END
+    FROM trend_embeddings te
+    JOIN visual_clusters vc ON vc.id = te.cluster_id
+    WHERE te.trend_id = t.id AND vc.id = ANY(:cluster_ids)
+""")
+
+_UPDATE_MEMBERSHIP = text(
+    "UPDATE trend_embeddings SET cluster_id = :cluster_id WHERE trend_id = :trend_id"
+)
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _lock_user(db: Session, user_id: int) -> None:
+    db.execute(text("SELECT pg_advisory_xact_lock(:ns, :user_id)"), {"ns": _LOCK_NAMESPACE, "user_id": user_id})
+
+
+class _ClusterSet:
+    """A user's active clusters as a centroid matrix (loaded per operation, k rows)"""
+
+    def __init__(self, db: Session, user_id: int, model: str = EMBEDDING_MODEL):
+        self.db = db
+        self.user_id = user_id
+        self.model = model
+        self.clusters: List[VisualCluster] = db.query(VisualCluster).filter(
+            VisualCluster.user_id == user_id,
+            VisualCluster.model == model,
+            VisualCluster.merged_into.is_(None)
+        ).all()
+        dim = None
+        if self.clusters:
+            dim = len(self.clusters[0].centroid) // 2
+        self.means: List[np.ndarray] = [
+            from_blobs([bytes(c.centroid)], dim)[0].astype(np.float32) for c in self.clusters
+        ]
+        self.units = np.vstack([_unit(m) for m in self.means]) if self.means else None
+        self.touched: set = set()
+        self.merged: set = set()
+
+    def nearest(self, vector: np.ndarray, skip: Optional[int] = None):
+        """(index, cosine distance) of the closest active centroid, or (None, inf)"""
+        if self.units is None:
+            return None, float("inf")
+        sims = self.units @ vector
+        for i in self.merged:
+            sims[i] = -np.inf
+        if skip is not None:
+            sims[skip] = -np.inf
+        best = int(np.argmax(sims))
+        if not np.isfinite(sims[best]):
+            return None, float("inf")
+        return best, 1.0 - float(sims[best])
+
+    def _set_mean(self, i: int, mean: np.ndarray) -> None:
+        self.means[i] = mean
+        self.units[i] = _unit(mean)
+        self.clusters[i].centroid = to_blob(mean)
+        self.touched.add(i)
+
+    def add(self, i: int, vector: np.ndarray) -> None:
+        cluster = self.clusters[i]
+        self._set_mean(i, (self.means[i] * cluster.size + vector) / (cluster.size + 1))
+        cluster.size += 1
+
+    def spawn(self, vector: np.ndarray) -> int:
+        cluster = VisualCluster(user_id=self.user_id, model=self.model, centroid=to_blob(vector), size=1)
+        self.db.add(cluster)
+        self.clusters.append(cluster)
+        self.means.append(vector.copy())
+        unit = _unit(vector)[None, :]
+        self.units = unit if self.units is None else np.vstack([self.units, unit])
+        self.touched.add(len(self.clusters) - 1)
+        return len(self.clusters) - 1
+
+    def merge_close(self) -> List[tuple]:
+        """Merge touched clusters into a near neighbour. Returns [(source, target)] indexes."""
+        merges = []
+        pending = list(self.touched)
+        while pending:
+            i = pending.pop()
+            if i in self.merged:
+                continue
+            j, distance = self.nearest(self.units[i], skip=i)
+            if j is None or distance > CLUSTER_MERGE_DISTANCE:
+                continue
+            # Smaller cluster folds into the bigger one (its id survives)
+            source, target = (i, j) if self.clusters[i].size <= self.clusters[j].size else (j, i)
+            src, dst = self.clusters[source], self.clusters[target]
+            total = src.size + dst.size
+            self._set_mean(target, (self.means[source] * src.size + self.means[target] * dst.size) / total)
+            dst.size = total
+            src.size = 0
+            self.merged.add(source)
+            merges.append((source, target))
+            pending.append(target)
+        return merges
+
+
+def assign_trends(db: Session, user_id: int, trends: list) -> Dict[int, int]:
+    """
+    Assign trends with an embedding (trend.embedding) to the user's visual
+    clusters: nearest centroid, new cluster, merge. Embeddings must already
+    be stored (store_trend_embeddings). Sets trend.cluster_id; caller commits.
+    Returns {trend_id: visual cluster id}.
+    """
+    items = [t for t in trends if t.id and getattr(t, "embedding", None) is not None]
+    if not items:
+        return {}
+
+    _lock_user(db, user_id)
+    existing = dict(db.query(TrendEmbedding.trend_id, TrendEmbedding.cluster_id).filter(
+        TrendEmbedding.trend_id.in_([t.id for t in items]),
+        TrendEmbedding.cluster_id.isnot(None)
+    ).all())
+
+    clusters = _ClusterSet(db, user_id)
+    index_of = {c.id: i for i, c in enumerate(clusters.clusters)}
+    assigned: Dict[int, int] = {}  # trend_id -> cluster index
+    for trend in items:
+        # Re-scanned video: keep its cluster (the offline job corrects drift)
+        if existing.get(trend.id) in index_of:
+            assigned[trend.id] = index_of[existing[trend.id]]
+            continue
+        vector = _unit(trend.embedding)
+        i, distance = clusters.nearest(vector)
+        if i is not None and distance <= CLUSTER_ASSIGN_DISTANCE:
+            clusters.add(i, vector)
+        else:
+            i = clusters.spawn(vector)
+        assigned[trend.id] = i
+
+    merges = clusters.merge_close()
+    db.flush()  # ids for new clusters
+
+    for source, target in merges:
+        src, dst = clusters.clusters[source], clusters.clusters[target]
+        src.merged_into = dst.id
+        db.execute(
+            text("UPDATE trend_embeddings SET cluster_id = :target WHERE cluster_id = :source"),
+            {"target": dst.id, "source": src.id}
+        )
+        db.execute(
+            text("UPDATE visual_clusters SET merged_into = :target WHERE merged_into = :source"),
+            {"target": dst.id, "source": src.id}
+        )
+
+    by_id = {c.id: c for c in clusters.clusters}
+
+    def resolve(i: int) -> VisualCluster:
+        cluster = clusters.clusters[i]
+        while cluster.merged_into is not None:
+            cluster = by_id[cluster.merged_into]
+        return cluster
+
+    result = {trend_id: resolve(i).id for trend_id, i in assigned.items()}
+    new_members = [
+        {"trend_id": trend_id, "cluster_id": cluster_id}
+        for trend_id, cluster_id in result.items() if existing.get(trend_id) != cluster_id
+    ]
+    if new_members:
+        db.execute(_UPDATE_MEMBERSHIP, new_members)
+
+    touched_ids = [clusters.clusters[i].id for i in clusters.touched - clusters.merged]
+    if touched_ids:
+        # Clusters that just reached 2 members expose their id on earlier members too
+        db.execute(_UPDATE_PUBLIC_IDS, {"cluster_ids": touched_ids})
+
+    sizes = {c.id: c.size for c in clusters.clusters}
+    for trend in items:
+        cluster_id = result[trend.id]
+        trend.cluster_id = cluster_id if sizes.get(cluster_id, 0) >= 2 else -1
+
+    logger.info(
+        f"🧩 Visual clusters: assigned {len(items)} covers for user {user_id} "
+        f"(k={len(clusters.clusters)}, merged {len(merges)})"
+    )
+    return result
+
+
+def sync_cluster_sizes(db: Session, user_id: int) -> int:
+    """
+    Recount cluster sizes from memberships and drop clusters left without
+    members (e.g. after trends were deleted). Returns the number dropped.
+    Centroids are left as is until the next re-clustering. Caller commits.
+    """
+    db.execute(text("""
+        UPDATE visual_clusters vc SET size = m.n
+        FROM (SELECT cluster_id, COUNT(*) AS n FROM trend_embeddings WHERE user_id = :user_id GROUP BY cluster_id) m
+        WHERE m.cluster_id = vc.id AND vc.size <> m.n
+    """), {"user_id": user_id})
+    return db.execute(text("""
+        DELETE FROM visual_clusters vc
+        WHERE vc.user_id = :user_id AND vc.merged_into IS NULL
+          AND NOT EXISTS (SELECT 1 FROM trend_embeddings te WHERE te.cluster_id = vc.id)
+    """), {"user_id": user_id}).rowcount or 0
+
+
+def recluster_user(db: Session, user_id: int, model: str = EMBEDDING_MODEL) -> Dict[str, int]:
+    """
+    Offline full re-clustering of a user's library (DBSCAN, same radius as
+    online assignment). New labels keep the existing id that most of their
+    members already had; ids nobody claims any more are dropped.
+    Caller commits.
+    """
+    _lock_user(db, user_id)
+    rows = db.query(TrendEmbedding.trend_id, TrendEmbedding.dim, TrendEmbedding.vector, TrendEmbedding.cluster_id).filter(
+        TrendEmbedding.user_id == user_id,
+        TrendEmbedding.model == model
+    ).order_by(TrendEmbedding.created_at.desc()).limit(RECLUSTER_MAX_ROWS).all()
+    if len(rows) < 2:
+        return {"rows": len(rows), "clusters": 0}
+
+    dim = rows[0].dim
+    X = from_blobs([bytes(r.vector) for r in rows], dim).astype(np.float32)
+    X /= np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+    labels = DBSCAN(eps=CLUSTER_ASSIGN_DISTANCE, min_samples=2, metric="cosine", algorithm="brute").fit(X).labels_
+    old_ids = [r.cluster_id for r in rows]
+
+    groups: Dict[int, List[int]] = {}
+    for i, label in enumerate(labels):
+        groups.setdefault(int(label), []).append(i)
+    noise = groups.pop(-1, [])
+
+    claimed: set = set()
+    new_ids: List[Optional[int]] = [None] * len(rows)
+    spawn: List[List[int]] = []  # member index lists that need a fresh cluster
+
+    # Biggest groups pick first so a split cluster keeps its id on the larger half
+    for members in sorted(groups.values(), key=len, reverse=True):
+        votes = Counter(old_ids[i] for i in members if old_ids[i] is not None and old_ids[i] not in claimed)
+        if votes:
+            cluster_id = votes.most_common(1)[0][0]
+            claimed.add(cluster_id)
+            for i in members:
+                new_ids[i] = cluster_id
+        else:
+            spawn.append(members)
+
+    for i in noise:
+        if old_ids[i] is not None and old_ids[i] not in claimed:
+            claimed.add(old_ids[i])
+            new_ids[i] = old_ids[i]
+        else:
+            spawn.append([i])
+
+    for members in spawn:
+        cluster = VisualCluster(user_id=user_id, model=model, centroid=b"", size=0)
+        db.add(cluster)
+        db.flush()
+        for i in members:
+            new_ids[i] = cluster.id
+
+    # Recompute centroids/sizes from the new memberships
+    by_cluster: Dict[int, List[int]] = {}
+    for i, cluster_id in enumerate(new_ids):
+        by_cluster.setdefault(cluster_id, []).append(i)
+    clusters = {c.id: c for c in db.query(VisualCluster).filter(VisualCluster.id.in_(list(by_cluster))).all()}
+    for cluster_id, members in by_cluster.items():
+        cluster = clusters[cluster_id]
+        cluster.centroid = to_blob(X[members].mean(axis=0))
+        cluster.size = len(members)
+        cluster.merged_into = None
+
+    changed = [
+        {"trend_id": rows[i].trend_id, "cluster_id": new_ids[i]}
+        for i in range(len(rows)) if new_ids[i] != old_ids[i]
+    ]
+    if changed:
+        db.execute(_UPDATE_MEMBERSHIP, changed)
+    db.flush()
+
+    # Rows outside the window still count towards their cluster's size
+    dropped = sync_cluster_sizes(db, user_id)
+    db.execute(_UPDATE_PUBLIC_IDS, {"cluster_ids": list(by_cluster)})
+
+    return {
+        "rows": len(rows),
+        "clusters": len(by_cluster),
+        "moved": len(changed),
+        "spawned": len(spawn),
+        "dropped": dropped,
+    }
+
+
+def recluster_all(
+    db: Session,
+    model: str = EMBEDDING_MODEL,
+    keep_going: Optional[Callable[[], bool]] = None
+) -> Dict[str, int]:
+    """
+    Re-cluster every user with stored embeddings (one transaction per user).
+    Stops between users once keep_going() returns False (leader stepped down).
+    """
+    user_ids = [row[0] for row in db.query(TrendEmbedding.user_id).filter(
+        TrendEmbedding.model == model
+    ).distinct().all()]
+
+    totals = {"users": 0, "rows": 0, "moved": 0, "failed": 0}
+    for user_id in user_ids:
+        if keep_going and not keep_going():
+            totals["stopped"] = True
+            break
+        try:
+            stats = recluster_user(db, user_id, model)
+            db.commit()
+            totals["users"] += 1
+            totals["rows"] += stats["rows"]
+            totals["moved"] += stats.get("moved", 0)
+        except Exception as e:
+            db.rollback()
+            totals["failed"] += 1
+            logger.error(f"Re-clustering failed for user {user_id}: {e}")
+    return totals
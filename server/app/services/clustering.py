@@ -1,59 +1,46 @@
 # backend/app/services/clustering.py
-import numpy as np
-from sklearn.cluster import DBSCAN
 from .ml_client import get_ml_client
 
-def cluster_trends_by_visuals(trends_list: list) -> list:
+async def embed_trend_covers(trends_list: list) -> list:
     """
     Принимает список объектов Trend.
-    Генерирует embeddings через ML Service и группирует по визуальному сходству.
+    Генерирует embeddings обложек через ML Service (trend.embedding).
+    Trend с уже сохранённым embedding (trend.embedding, см. vector_index.
+    load_trend_embeddings) повторно не отправляются в ML Service.
+    Группировку по визуальному сходству делает cluster_engine.assign_trends
+    (стабильные ID кластеров вместо DBSCAN на каждый поиск).
     """
     # 1. Получаем ML client
     ml_client = get_ml_client()
 
     # 2. Собираем URL обложек для генерации embeddings
-    trends_with_covers = [t for t in trends_list if t.cover_url]
+    trends_with_covers = [t for t in trends_list if t.cover_url or getattr(t, "embedding", None) is not None]
 
     if not trends_with_covers:
-        print("⚠️ No trends with cover images to cluster")
+        print("⚠️ No trends with cover images to embed")
         return trends_list
 
-    # 3. Генерируем embeddings через ML сервис (batch)
-    print(f"🖼️ Generating embeddings for {len(trends_with_covers)} cover images...")
-    cover_urls = [t.cover_url for t in trends_with_covers]
-    embeddings = ml_client.get_batch_image_embeddings(cover_urls)
+    missing = [t for t in trends_with_covers if getattr(t, "embedding", None) is None and t.cover_url]
 
-    # 4. Присваиваем embeddings к объектам Trend
-    valid_trends = []
-    for i, trend in enumerate(trends_with_covers):
-        if embeddings[i] is not None:
-            trend.embedding = embeddings[i]
-            valid_trends.append(trend)
+    # Circuit breaker открыт — ML сервис недоступен, не ждём таймаутов
+    if missing and not ml_client.available:
+        print("⚠️ ML Service unavailable (circuit open), using stored embeddings only")
+        missing = []
 
-    if not valid_trends:
-        print("⚠️ No valid embeddings generated")
-        return trends_list
-
-    try:
-        # 5. Превращаем список векторов в матрицу numpy
-        X = np.array([t.embedding for t in valid_trends])
+    # 3. Генерируем embeddings через ML сервис (batch) — только для новых обложек
+    if missing:
+        print(f"🖼️ Generating embeddings for {len(missing)} cover images "
+              f"({len(trends_with_covers) - len(missing)} reused)...")
+        # Бинарный ответ ML сервиса: сразу матрица (N_valid, 512) + маска
+        matrix, mask = await ml_client.get_batch_image_embedding_matrix([t.cover_url for t in missing])
 
-        # 6. Запускаем DBSCAN
-        # eps=0.15 - насколько похожи должны быть картинки (0.0 - копии, 1.0 - разные)
-        # min_samples=2 - минимальное кол-во видео, чтобы считать это группой
-        clustering = DBSCAN(eps=0.15, min_samples=2, metric='cosine').fit(X)
+        # 4. Присваиваем embeddings к объектам Trend
+        for trend, row in zip([t for t, ok in zip(missing, mask) if ok], matrix):
+            trend.embedding = row
 
-        labels = clustering.labels_ # Список типа [0, 0, 1, -1, 1 ...]
+    valid_trends = [t for t in trends_with_covers if getattr(t, "embedding", None) is not None]
 
-        # 7. Присваиваем ID кластеров обратно объектам
-        for i, trend in enumerate(valid_trends):
-            # -1 означает "шум" (уникальное видео, ни на что не похоже)
-            trend.cluster_id = int(labels[i])
-
-        n_clusters = len(set(labels)) - (1 if -1 in labels else 0)
-        print(f"🧩 Visual Clustering: Найдено {n_clusters} визуальных групп среди {len(valid_trends)} видео.")
-
-    except Exception as e:
-        print(f"⚠️ Ошибка кластеризации: {e}")
+    if not valid_trends:
+        print("⚠️ No valid embeddings generated")
 
     return trends_list
\ No newline at end of file
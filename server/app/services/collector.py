@@ -16,12 +16,22 @@ class TikTokCollector:
         # Используем именно этот актор
         self.actor_id = "apidojo/tiktok-scraper"
 
-    def collect(self, targets: List[str], limit: int = 30, mode: str = "search", is_deep: bool = False):
+    def collect(
+        self,
+        targets: List[str],
+        limit: int = 30,
+        mode: str = "search",
+        is_deep: bool = False,
+        results_per_page: int = 100
+    ):
         """
         Режимы (mode):
         - "search": Ищет по ключевым словам.
         - "profile": Ищет видео конкретных юзеров.
         - "urls":   Сканирует СПИСОК КОНКРЕТНЫХ ВИДЕО (для рескана).
+
+        limit -> maxItems (на весь запуск), results_per_page -> resultsPerPage
+        (на каждую цель: профиль / ключевое слово).
         """
         if not self.client or not targets:
             return []
@@ -36,7 +46,7 @@ class TikTokCollector:
         # Базовый конфиг
         run_input = {
             "maxItems": final_limit,
-            "resultsPerPage": 100,
+            "resultsPerPage": results_per_page,
         }
 
         # 2. Логика формирования инпутов (АДАПТИРОВАНО ПОД STARTURLS)
@@ -0,0 +1,379 @@
+"""
+Competitor Refresher
+Fleet refresh of tracked competitor profiles, shared across tenants.
+
+Many users track the same creators; refreshing per user per competitor
+(PUT /competitors/{username}/refresh) scraped the same 30 videos once per
+tenant. The fleet job (scheduler, every COMPETITOR_REFRESH_INTERVAL_MINUTES,
+leader only):
+
+1. gathers every active Competitor row and deduplicates by
+   (platform, username); a profile is due when the strictest tier among
+   the users tracking it says so (COMPETITOR_STALENESS_HOURS: agency 6h,
+   pro 24h, creator 72h, free weekly);
+2. packs COMPETITOR_PROFILES_PER_RUN profiles into one actor run
+   (TikTok startUrls / Instagram usernames) instead of one run per profile;
+3. builds each profile's snapshot once (video normalization, UTS,
+   thumbnail and avatar mirroring) and writes it to every tenant's row with
+   one UPDATE ... FROM (VALUES ...) per run.
+
+Profiles the actor returned nothing for are retried after
+COMPETITOR_RETRY_HOURS — unless the run stopped at its total item cap,
+in which case they simply stay due for the next tick. The manual refresh endpoint uses the same snapshot
+and fan-out, and skips the scrape if the profile was refreshed within
+COMPETITOR_FRESH_MINUTES (by the fleet job or another tenant).
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..core.database import SessionLocal
+from ..db.models import SubscriptionTier
+from .apify_storage import ApifyStorage
+from .collector import TikTokCollector
+from .instagram_collector import InstagramCollector
+from .instagram_profile_adapter import adapt_instagram_profile_to_posts
+from .scorer import TrendScorer
+from .storage import SupabaseStorage
+
+logger = logging.getLogger(__name__)
+
+COMPETITOR_REFRESH_INTERVAL_MINUTES = int(os.getenv("COMPETITOR_REFRESH_INTERVAL_MINUTES", "30"))
+COMPETITOR_PROFILES_PER_RUN = int(os.getenv("COMPETITOR_PROFILES_PER_RUN", "25"))
+COMPETITOR_VIDEOS_PER_PROFILE = int(os.getenv("COMPETITOR_VIDEOS_PER_PROFILE", "30"))
+COMPETITOR_MAX_PROFILES_PER_TICK = int(os.getenv("COMPETITOR_MAX_PROFILES_PER_TICK", "500"))
+COMPETITOR_RETRY_HOURS = float(os.getenv("COMPETITOR_RETRY_HOURS", "6"))
+COMPETITOR_FRESH_MINUTES = int(os.getenv("COMPETITOR_FRESH_MINUTES", "15"))
+
+# Staleness SLO: max age of a tracked profile's data, by the tracking user's tier
+COMPETITOR_STALENESS_HOURS = {
+    SubscriptionTier.FREE: 168,
+    SubscriptionTier.CREATOR: 72,
+    SubscriptionTier.PRO: 24,
+    SubscriptionTier.AGENCY: 6,
+}
+
+ProfileKey = Tuple[str, str]  # (platform, username)
+
+
+def fix_tt_url(url: str) -> Optional[str]:
+    """
+    Fix TikTok CDN URLs by removing expiring signatures.
+
+    Calls ApifyStorage.fix_tiktok_url() to remove -sign- subdomain and
+    signature parameters (x-expires, x-signature) from TikTok CDN URLs.
+    Also handles .heic to .jpeg conversion for compatibility.
+    """
+    if not url or not isinstance(url, str):
+        return None
+
+    # Remove TikTok signatures first
+    url = ApifyStorage.fix_tiktok_url(url)
+
+    # Convert .heic to .jpeg for compatibility
+    if url and ".heic" in url:
+        url = url.replace(".heic", ".jpeg")
+
+    return url
+
+
+def normalize_video_data(item: dict) -> dict:
+    """
+    Normalize video data from various Apify response formats.
+    """
+    stats = item.get("stats") or {}
+    views = item.get("views") or item.get("playCount") or stats.get("playCount") or 0
+    likes = item.get("likes") or item.get("diggCount") or stats.get("diggCount") or 0
+    comments = item.get("comments") or item.get("commentCount") or stats.get("commentCount") or 0
+    shares = item.get("shares") or item.get("shareCount") or stats.get("shareCount") or 0
+
+    uploaded_at = item.get("uploadedAt") or item.get("createTime") or 0
+
+    channel = item.get("channel") or item.get("authorMeta") or {}
+    author_name = channel.get("username") or channel.get("name") or "unknown"
+    avatar = fix_tt_url(channel.get("avatar") or channel.get("avatarThumb"))
+
+    video_obj = item.get("video") or item.get("videoMeta") or {}
+    # Get ORIGINAL cover URL (with signature!) - DO NOT fix_tt_url yet
+    cover_raw = (
+        video_obj.get("cover") or
+        video_obj.get("coverUrl") or
+        video_obj.get("dynamicCover") or
+        video_obj.get("originCover") or
+        item.get("cover_url") or
+        item.get("coverUrl") or
+        item.get("videoCover") or
+        item.get("cover") or
+        ""
+    )
+
+    # Extract video URL for playback (video.url is the main field)
+    video_url = fix_tt_url(
+        video_obj.get("url") or
+        video_obj.get("playAddr") or
+        video_obj.get("downloadAddr") or
+        item.get("video_url") or
+        item.get("videoUrl")
+    )
+
+    # Upload thumbnail to Supabase Storage using ORIGINAL signed URL
+    # The signature is needed to download from TikTok CDN!
+    cover_url_final = fix_tt_url(cover_raw) or cover_raw  # fallback default
+    cover_srcset = None
+    if cover_raw:
+        # Try with original signed URL first (best chance of success)
+        stored_cover = SupabaseStorage.ingest_thumbnail(cover_raw)
+        if stored_cover:
+            cover_url_final = stored_cover.public_url
+            cover_srcset = SupabaseStorage.srcset(stored_cover.renditions)
+        else:
+            # Fallback: try with fixed URL (remove signatures, works ~1-3 days)
+            cover_url_final = ApifyStorage.fix_tiktok_url(cover_raw)
+
+    return {
+        "id": str(item.get("id")),
+        "title": item.get("title") or item.get("desc") or "",
+        "url": item.get("postPage") or item.get("webVideoUrl") or item.get("url"),
+        "cover_url": cover_url_final,
+        "thumbnail_url": cover_url_final,  # Frontend expects this field
+        "cover_srcset": cover_srcset,  # {"avif"|"webp"|"jpeg": "url 240w, ..."}
+        "video_url": video_url,
+        "uploaded_at": uploaded_at,
+        "views": int(views),
+        "stats": {
+            "playCount": int(views),
+            "diggCount": int(likes),
+            "commentCount": int(comments),
+            "shareCount": int(shares)
+        },
+        "author": {
+            "username": author_name,
+            "avatar": avatar,
+            "followers": channel.get("followers") or channel.get("fans") or 0
+        }
+    }
+
+
+
+def build_snapshot(raw_videos: List[dict]) -> Optional[dict]:
+    """
+    Normalized videos (with UTS) + profile metrics from a profile scrape;
+    the Competitor fields a refresh writes. None if there are no videos.
+    """
+    if not raw_videos:
+        return None
+    scorer = TrendScorer()
+    clean_videos = []
+    total_views = 0
+    total_engagement = 0
+
+    for raw in raw_videos:
+        vid = normalize_video_data(raw)
+        scorer_data = {
+            "views": vid["views"],
+            "author_followers": vid["author"]["followers"],
+            "collect_count": 0,
+            "share_count": vid["stats"]["shareCount"]
+        }
+        vid["uts_score"] = scorer.calculate_uts(scorer_data, history_data=None, cascade_count=1)
+        clean_videos.append(vid)
+        total_views += vid["views"]
+        total_engagement += (
+            vid["stats"]["diggCount"] +
+            vid["stats"]["commentCount"] +
+            vid["stats"]["shareCount"]
+        )
+
+    avg_views = total_views / len(clean_videos) if clean_videos else 0
+    engagement_rate = (total_engagement / total_views * 100) if total_views > 0 else 0
+
+    # Upload new avatar to Supabase Storage (permanent)
+    first_vid = clean_videos[0]
+    avatar_cdn_url = first_vid["author"]["avatar"]
+    uploaded_avatar = SupabaseStorage.upload_avatar(avatar_cdn_url)
+
+    return {
+        "followers_count": int(first_vid["author"]["followers"] or 0),
+        "avatar_url": uploaded_avatar if uploaded_avatar else avatar_cdn_url,
+        "total_videos": len(clean_videos),
+        "avg_views": avg_views,
+        "engagement_rate": round(engagement_rate, 2),
+        "recent_videos": clean_videos,
+    }
+
+
+def _author(item: dict) -> str:
+    channel = item.get("channel") or item.get("authorMeta") or {}
+    return (channel.get("username") or channel.get("name") or "").lower()
+
+
+def scrape_profiles(platform: str, usernames: List[str]) -> Tuple[Dict[str, List[dict]], bool]:
+    """
+    ({username: raw videos}, capped) for several profiles in ONE actor run.
+    capped: the run stopped at its total item limit, so profiles missing
+    from the result may just not have been reached.
+    """
+    if platform == "instagram":
+        profiles = InstagramCollector().collect(usernames, limit=COMPETITOR_VIDEOS_PER_PROFILE, mode="profile")
+        return {
+            (profile.get("username") or "").lower(): adapt_instagram_profile_to_posts(profile)
+            for profile in profiles or [] if profile.get("username")
+        }, False
+
+    # TikTok: maxItems is for the whole run, resultsPerPage caps each profile
+    max_items = COMPETITOR_VIDEOS_PER_PROFILE * len(usernames)
+    items = list(TikTokCollector().collect(
+        usernames, limit=max_items, mode="profile", results_per_page=COMPETITOR_VIDEOS_PER_PROFILE
+    ) or [])
+    wanted = set(usernames)
+    by_author: Dict[str, List[dict]] = {}
+    for item in items:
+        author = _author(item)
+        if author in wanted and len(by_author.get(author, [])) < COMPETITOR_VIDEOS_PER_PROFILE:
+            by_author.setdefault(author, []).append(item)
+    if len(usernames) == 1 and not by_author and items:
+        # Single profile: every item is that profile's, whatever the author field says
+        by_author[usernames[0]] = items[:COMPETITOR_VIDEOS_PER_PROFILE]
+    return by_author, len(items) >= max_items
+
+
+def apply_snapshots(db: Session, platform: str, snapshots: Dict[str, dict]) -> int:
+    """Write each profile's snapshot to every active tenant row tracking it. Caller commits."""
+    if not snapshots:
+        return 0
+    now = datetime.utcnow()
+    params = {"platform": platform, "now": now}
+    values = []
+    for i, (username, snap) in enumerate(snapshots.items()):
+        values.append(
+            f"(CAST(:u{i} AS text), CAST(:f{i} AS integer), CAST(:a{i} AS text), CAST(:t{i} AS integer), "
+            f"CAST(:v{i} AS double precision), CAST(:e{i} AS double precision), CAST(:r{i} AS jsonb))"
+        )
+        params.update({
+            f"u{i}": username, f"f{i}": snap["followers_count"], f"a{i}": snap["avatar_url"],
+            f"t{i}": snap["total_videos"], f"v{i}": snap["avg_views"], f"e{i}": snap["engagement_rate"],
+            f"r{i}": json.dumps(snap["recent_videos"]),
+        })
+    result = db.execute(text(f"""
+        UPDATE competitors AS c
+        SET followers_count = v.followers, avatar_url = v.avatar, total_videos = v.total,
+            avg_views = v.avg_views, engagement_rate = v.engagement, recent_videos = v.videos,
+            last_analyzed_at = :now, updated_at = :now
+        FROM (VALUES {", ".join(values)}) AS v(username, followers, avatar, total, avg_views, engagement, videos)
+        WHERE c.platform = :platform AND c.username = v.username AND c.is_active
+    """), params)
+    return result.rowcount or 0
+
+
+class CompetitorRefresher:
+    def __init__(self):
+        self._retry_after: Dict[ProfileKey, float] = {}
+        self.counters = {
+            "runs": 0, "actor_runs": 0, "profiles_due": 0, "profiles_refreshed": 0,
+            "rows_updated": 0, "not_found": 0, "requeued": 0,
+        }
+
+    def due_profiles(self, db: Session, now: datetime) -> List[ProfileKey]:
+        """(platform, username) whose data is older than the strictest SLO of the users tracking it"""
+        slo = "CASE u.subscription_tier::text " + " ".join(
+            f"WHEN '{tier.name}' THEN {hours}" for tier, hours in COMPETITOR_STALENESS_HOURS.items()
+        ) + f" ELSE {max(COMPETITOR_STALENESS_HOURS.values())} END"
+        rows = db.execute(text(f"""
+            SELECT c.platform, c.username,
+                   MIN(COALESCE(c.last_analyzed_at, TIMESTAMP 'epoch') + make_interval(hours => {slo})) AS due_at
+            FROM competitors c
+            JOIN users u ON u.id = c.user_id
+            WHERE c.is_active
+            GROUP BY c.platform, c.username
+            HAVING MIN(COALESCE(c.last_analyzed_at, TIMESTAMP 'epoch') + make_interval(hours => {slo})) <= :now
+            ORDER BY due_at
+        """), {"now": now}).fetchall()
+        current = time.time()
+        due = [
+            (row.platform or "tiktok", row.username) for row in rows
+            if self._retry_after.get((row.platform or "tiktok", row.username), 0) <= current
+        ]
+        return due[:COMPETITOR_MAX_PROFILES_PER_TICK]
+
+    def refresh_due(self, keep_going: Optional[Callable[[], bool]] = None) -> dict:
+        """
+        One fleet pass. Blocking (collector + SQL): run it in a thread.
+        Stops between actor runs once keep_going() returns False (leader stepped down).
+        """
+        self.counters["runs"] += 1
+        db = SessionLocal()
+        try:
+            due = self.due_profiles(db, datetime.utcnow())
+            self.counters["profiles_due"] += len(due)
+            refreshed = rows = 0
+            for platform in ("tiktok", "instagram"):
+                usernames = [username for p, username in due if p == platform]
+                for start in range(0, len(usernames), COMPETITOR_PROFILES_PER_RUN):
+                    if keep_going and not keep_going():
+                        return {"due": len(due), "refreshed": refreshed, "rows_updated": rows, "stopped": True}
+                    chunk = usernames[start:start + COMPETITOR_PROFILES_PER_RUN]
+                    try:
+                        done, updated = self._refresh_chunk(db, platform, chunk)
+                    except Exception as e:
+                        db.rollback()
+                        logger.error(f"Competitor refresh run failed ({platform}, {len(chunk)} profiles): {e}")
+                        self._back_off(platform, chunk)
+                        continue
+                    refreshed += done
+                    rows += updated
+            return {"due": len(due), "refreshed": refreshed, "rows_updated": rows}
+        finally:
+            db.close()
+
+    def _refresh_chunk(self, db: Session, platform: str, usernames: List[str]) -> Tuple[int, int]:
+        self.counters["actor_runs"] += 1
+        scraped, capped = scrape_profiles(platform, usernames)
+        snapshots = {}
+        for username in usernames:
+            snapshot = build_snapshot(scraped.get(username) or [])
+            if snapshot:
+                snapshots[username] = snapshot
+        missing = [username for username in usernames if username not in snapshots]
+        if missing and capped:
+            # The run ran out of items before reaching them: still due, picked up next tick
+            self.counters["requeued"] += len(missing)
+        elif missing:
+            self.counters["not_found"] += len(missing)
+            self._back_off(platform, missing)
+
+        updated = apply_snapshots(db, platform, snapshots)
+        db.commit()
+        self.counters["profiles_refreshed"] += len(snapshots)
+        self.counters["rows_updated"] += updated
+        logger.info(
+            f"👥 Competitor refresh ({platform}): {len(snapshots)}/{len(usernames)} profiles "
+            f"in one run -> {updated} tenant rows"
+        )
+        return len(snapshots), updated
+
+    def _back_off(self, platform: str, usernames: List[str]) -> None:
+        retry_at = time.time() + COMPETITOR_RETRY_HOURS * 3600
+        for username in usernames:
+            self._retry_after[(platform, username)] = retry_at
+        # Forget expired entries
+        now = time.time()
+        for key in [key for key, until in self._retry_after.items() if until <= now]:
+            del self._retry_after[key]
+
+    def stats(self) -> dict:
+        c = self.counters
+        return {
+            **c,
+            "rows_per_profile": round(c["rows_updated"] / c["profiles_refreshed"], 2) if c["profiles_refreshed"] else 0,
+            "profiles_per_run": round(c["profiles_refreshed"] / c["actor_runs"], 2) if c["actor_runs"] else 0,
+            "backing_off": len(self._retry_after),
+        }
+
+
+competitor_refresher = CompetitorRefresher()
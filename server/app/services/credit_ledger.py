@@ -0,0 +1,322 @@
+"""
+Credit Ledger Service
+Atomic, single-statement credit accounting on top of users.credits.
+
+Every balance change is one conditional UPDATE ... RETURNING fused with an
+INSERT into the append-only credit_ledger table (one round-trip, no
+read-modify-write in Python), so concurrent chats/workflows can't lose updates.
+
+Multi-step operations (workflows, video analysis) reserve the estimated cost
+up front and settle (refund the unused part) or refund when they finish.
+"""
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from ..db.models import User
+
+logger = logging.getLogger(__name__)
+
+
+# Ledger entry kinds
+KIND_CHARGE = "charge"
+KIND_RESERVE = "reserve"
+KIND_SETTLE = "settle"
+KIND_REFUND = "refund"
+KIND_RESET = "reset"
+
+
+class InsufficientCreditsError(Exception):
+    """Raised when a conditional debit finds fewer credits than required."""
+
+    def __init__(self, required: int, available: int):
+        self.required = required
+        self.available = available
+        super().__init__(f"Insufficient credits: need {required}, have {available}")
+
+
+@dataclass
+class Reservation:
+    """Credits held for a multi-step operation until settle()/refund()."""
+    user_id: int
+    amount: int
+    reason: str
+    reference: Optional[str] = None
+    closed: bool = False
+
+
+# Debit only if the balance covers it. No row returned => insufficient credits.
+_DEBIT_SQL = text("""
+    WITH debited AS (
+        UPDATE users SET credits = credits - :amount
+        WHERE id = :user_id AND credits >= :amount
+        RETURNING id, credits
+    )
+    INSERT INTO credit_ledger (user_id, delta, balance_after, kind, reason, reference, created_at)
+    SELECT id, -:amount, credits, :kind, :reason, :reference, :now FROM debited
+    RETURNING balance_after
+""")
+
+# Debit clamped at zero (used after the work is already done, e.g. chat replies).
+# The locked `prev` row lets the ledger record what was actually taken.
+_DEBIT_CLAMPED_SQL = text("""
+    WITH prev AS (
+        SELECT id, credits FROM users WHERE id = :user_id FOR UPDATE
+    ), debited AS (
+        UPDATE users u SET credits = GREATEST(u.credits - :amount, 0)
+        FROM prev WHERE u.id = prev.id
+        RETURNING u.id, u.credits, u.credits - prev.credits AS delta
+    )
+    INSERT INTO credit_ledger (user_id, delta, balance_after, kind, reason, reference, created_at)
+    SELECT id, delta, credits, :kind, :reason, :reference, :now FROM debited
+    RETURNING balance_after
+""")
+
+_CREDIT_SQL = text("""
+    WITH credited AS (
+        UPDATE users SET credits = credits + :amount
+        WHERE id = :user_id
+        RETURNING id, credits
+    )
+    INSERT INTO credit_ledger (user_id, delta, balance_after, kind, reason, reference, created_at)
+    SELECT id, :amount, credits, :kind, :reason, :reference, :now FROM credited
+    RETURNING balance_after
+""")
+
+# Monthly reset: only the first concurrent request past credits_reset_at wins.
+_RESET_SQL = text("""
+    WITH prev AS (
+        SELECT id, credits FROM users
+        WHERE id = :user_id AND (credits_reset_at IS NULL OR credits_reset_at <= :now)
+        FOR UPDATE
+    ), reset AS (
+        UPDATE users u SET credits = :monthly_limit, credits_reset_at = :next_reset_at
+        FROM prev WHERE u.id = prev.id
+        RETURNING u.id, u.credits, u.credits - prev.credits AS delta
+    )
+    INSERT INTO credit_ledger (user_id, delta, balance_after, kind, reason, reference, created_at)
+    SELECT id, delta, credits, :kind, 'monthly_reset', NULL, :now FROM reset
+    RETURNING balance_after
+""")
+
+_USAGE_SQL = text("""
+    SELECT reason, -SUM(delta) AS spent
+    FROM credit_ledger
+    WHERE user_id = :user_id AND created_at >= :since AND kind <> :reset_kind
+    GROUP BY reason
+""")
+
+
+class CreditLedger:
+    """Atomic credit operations. All methods update the ORM user in place."""
+
+    @staticmethod
+    def _apply(db: Session, user: User, balance: Optional[int], commit: bool) -> Optional[int]:
+        if balance is not None:
+            # Keep the ORM object in sync WITHOUT marking it dirty — a dirty
+            # `credits` would be flushed back later and undo concurrent charges.
+            set_committed_value(user, "credits", balance)
+        if commit:
+            db.commit()
+        return balance
+
+    @staticmethod
+    def _available(db: Session, user: User) -> int:
+        balance = db.execute(
+            text("SELECT credits FROM users WHERE id = :user_id"),
+            {"user_id": user.id}
+        ).scalar()
+        balance = int(balance or 0)
+        set_committed_value(user, "credits", balance)
+        return balance
+
+    @staticmethod
+    def charge(
+        db: Session,
+        user: User,
+        amount: int,
+        reason: str,
+        reference: Optional[str] = None,
+        clamp: bool = False,
+        commit: bool = True,
+        kind: str = KIND_CHARGE
+    ) -> int:
+        """
+        Debit credits in one statement. Returns the new balance.
+
+        Args:
+            clamp: Take whatever is left instead of failing (never goes below 0)
+            commit: Commit immediately (releases the row lock)
+
+        Raises:
+            InsufficientCreditsError: If the balance doesn't cover `amount` (clamp=False)
+        """
+        if amount <= 0:
+            return user.credits
+
+        params = {
+            "user_id": user.id,
+            "amount": amount,
+            "kind": kind,
+            "reason": reason,
+            "reference": reference,
+            "now": datetime.utcnow(),
+        }
+        sql = _DEBIT_CLAMPED_SQL if clamp else _DEBIT_SQL
+        balance = db.execute(sql, params).scalar()
+
+        if balance is None:
+            raise InsufficientCreditsError(amount, CreditLedger._available(db, user))
+
+        return CreditLedger._apply(db, user, int(balance), commit)
+
+    @staticmethod
+    def credit(
+        db: Session,
+        user: User,
+        amount: int,
+        reason: str,
+        reference: Optional[str] = None,
+        commit: bool = True,
+        kind: str = KIND_REFUND
+    ) -> int:
+        """Credit (refund/grant) credits in one statement. Returns the new balance."""
+        if amount <= 0:
+            return user.credits
+
+        balance = db.execute(_CREDIT_SQL, {
+            "user_id": user.id,
+            "amount": amount,
+            "kind": kind,
+            "reason": reason,
+            "reference": reference,
+            "now": datetime.utcnow(),
+        }).scalar()
+        return CreditLedger._apply(db, user, int(balance) if balance is not None else None, commit)
+
+    @staticmethod
+    def reserve(
+        db: Session,
+        user: User,
+        amount: int,
+        reason: str,
+        reference: Optional[str] = None
+    ) -> Reservation:
+        """
+        Hold `amount` credits for a multi-step operation (committed immediately).
+
+        Raises:
+            InsufficientCreditsError: If the balance doesn't cover the estimate
+        """
+        CreditLedger.charge(db, user, amount, reason, reference, kind=KIND_RESERVE)
+        return Reservation(user_id=user.id, amount=amount, reason=reason, reference=reference)
+
+    @staticmethod
+    def settle(
+        db: Session,
+        user: User,
+        reservation: Reservation,
+        used: int,
+        commit: bool = True
+    ) -> int:
+        """
+        Close a reservation, refunding whatever wasn't used.
+        Usage above the reserved amount is charged (clamped at zero).
+        Returns the new balance.
+
+        With commit=False the reservation only counts as closed once the
+        caller's commit succeeds; if it fails, call rollback() so the
+        settle can run again.
+        """
+        if reservation.closed:
+            return user.credits
+
+        # Closed only once the ledger write went through: if it raises, the caller can retry or refund
+        unused = reservation.amount - used
+        if unused > 0:
+            balance = CreditLedger.credit(
+                db, user, unused, reservation.reason, reservation.reference,
+                commit=commit, kind=KIND_SETTLE
+            )
+        elif unused < 0:
+            balance = CreditLedger.charge(
+                db, user, -unused, reservation.reason, reservation.reference,
+                clamp=True, commit=commit, kind=KIND_SETTLE
+            )
+        else:
+            if commit:
+                db.commit()
+            balance = user.credits
+        reservation.closed = True
+        return balance
+
+    @staticmethod
+    def refund(db: Session, user: User, reservation: Reservation, commit: bool = True) -> int:
+        """Release the whole reservation (operation failed before doing any work)."""
+        if reservation.closed:
+            return user.credits
+        balance = CreditLedger.credit(
+            db, user, reservation.amount, reservation.reason, reservation.reference,
+            commit=commit, kind=KIND_REFUND
+        )
+        reservation.closed = True
+        return balance
+
+    @staticmethod
+    def rollback(db: Session, reservation: Optional[Reservation]) -> None:
+        """
+        The caller's commit after settle()/refund(commit=False) failed: roll
+        the session back and reopen the reservation (its ledger entry was
+        rolled back too), so it can still be settled or refunded.
+        """
+        db.rollback()
+        if reservation is not None:
+            reservation.closed = False
+
+    @staticmethod
+    def reset_monthly(
+        db: Session,
+        user: User,
+        monthly_limit: int,
+        next_reset_at: datetime,
+        now: Optional[datetime] = None
+    ) -> bool:
+        """
+        Reset the balance to `monthly_limit` if the reset date has passed.
+        Concurrent callers race on one conditional UPDATE; only one wins.
+        Returns True if this call performed the reset.
+        """
+        now = now or datetime.utcnow()
+        balance = db.execute(_RESET_SQL, {
+            "user_id": user.id,
+            "monthly_limit": monthly_limit,
+            "next_reset_at": next_reset_at,
+            "kind": KIND_RESET,
+            "now": now,
+        }).scalar()
+
+        if balance is None:
+            # Someone else reset it — pick up the fresh values
+            db.refresh(user, attribute_names=["credits", "credits_reset_at"])
+            return False
+
+        set_committed_value(user, "credits", int(balance))
+        set_committed_value(user, "credits_reset_at", next_reset_at)
+        db.commit()
+        logger.info(f"🔄 Monthly credits reset for user {user.id}: {balance}")
+        return True
+
+    @staticmethod
+    def usage_summary(db: Session, user_id: int, since: datetime) -> Dict[str, int]:
+        """Net credits spent per reason since `since` (reservations net of refunds)."""
+        rows = db.execute(_USAGE_SQL, {
+            "user_id": user_id,
+            "since": since,
+            "reset_kind": KIND_RESET,
+        }).all()
+        return {reason: int(spent) for reason, spent in rows if spent}
@@ -0,0 +1,69 @@
+"""
+Embedding Codec
+Decoder for the ML service's binary embedding format
+(application/vnd.rizko.embeddings, see ml-service/app/services/transport.py).
+
+Layout (little-endian):
+    header  "<4sBBHI"  magic b"RZEM", version, dtype code, dim, count   (12 bytes)
+    mask    count x uint8 (1 = embedding present), zero-padded to 8 bytes
+    data    valid_count x dim values (rows for mask == 1 only)
+"""
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+EMBEDDINGS_MEDIA_TYPE = "application/vnd.rizko.embeddings"
+
+MAGIC = b"RZEM"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHI")
+DTYPES = {1: np.dtype("<f2"), 2: np.dtype("<f4")}
+
+
+class EmbeddingCodecError(ValueError):
+    """Raised when a binary embedding payload is malformed."""
+
+
+def accept_header(dtype: str = "float16") -> str:
+    """Accept header preferring the binary format, falling back to JSON"""
+    return f"{EMBEDDINGS_MEDIA_TYPE}; dtype={dtype}, application/json;q=0.5"
+
+
+def decode_embeddings(payload: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decode a binary embedding payload without copying the vector data.
+
+    Returns:
+        (matrix, mask): matrix is a read-only (valid_count, dim) view over the
+        payload; mask is a bool array of length count (True = row present).
+    """
+    if len(payload) < HEADER.size:
+        raise EmbeddingCodecError("payload shorter than header")
+
+    magic, version, dtype_code, dim, count = HEADER.unpack_from(payload, 0)
+    if magic != MAGIC or version != VERSION:
+        raise EmbeddingCodecError(f"unsupported payload (magic={magic!r}, version={version})")
+    if dtype_code not in DTYPES:
+        raise EmbeddingCodecError(f"unknown dtype code {dtype_code}")
+
+    offset = HEADER.size
+    mask = np.frombuffer(payload, dtype=np.uint8, count=count, offset=offset).astype(bool)
+    offset += count + (-count % 8)
+
+    valid_count = int(mask.sum())
+    dtype = DTYPES[dtype_code]
+    expected = offset + valid_count * dim * dtype.itemsize
+    if len(payload) != expected:
+        raise EmbeddingCodecError(f"payload size {len(payload)} != expected {expected}")
+
+    matrix = np.frombuffer(payload, dtype=dtype, count=valid_count * dim, offset=offset)
+    return matrix.reshape(valid_count, dim), mask
+
+
+def from_json(embeddings: List[Optional[List[float]]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Same (matrix, mask) shape for a JSON response (fallback path)"""
+    mask = np.array([e is not None for e in embeddings], dtype=bool)
+    valid = [e for e in embeddings if e is not None]
+    matrix = np.asarray(valid, dtype=np.float32) if valid else np.empty((0, 0), dtype=np.float32)
+    return matrix, mask
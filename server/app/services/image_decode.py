@@ -0,0 +1,190 @@
+"""
+Image Decoding Service
+Shared decode/convert helpers for stored images (thumbnails, avatars).
+
+- JPEG sources are decoded with PIL draft() straight to (about) the target
+  size: libjpeg scales by 1/2..1/8 during the DCT, so a 1080x1920 cover
+  never exists as a full bitmap when a smaller one is wanted.
+- HEIC/HEIF/WebP/TIFF/AVIF are expensive codecs (pillow-heif, libwebp) that
+  hold the GIL for most of the decode. They run in a small process pool
+  (IMAGE_DECODE_PROCESSES) so request threads and the event loop keep going.
+- Thumbnail renditions: one decode, then RENDITION_WIDTHS-wide WebP (and
+  AVIF when Pillow can encode it) plus a progressive JPEG fallback, also
+  encoded in the pool.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Register HEIC/HEIF support for Pillow (TikTok CDN sometimes returns HEIC).
+# Runs in the pool processes too (they import this module).
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_SUPPORTED = True
+except ImportError:
+    HEIF_SUPPORTED = False
+
+# AVIF: native in Pillow >= 11.3, or via pillow-avif-plugin
+try:
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+Image.init()
+AVIF_SUPPORTED = "AVIF" in Image.SAVE
+
+IMAGE_DECODE_PROCESSES = int(os.getenv("IMAGE_DECODE_PROCESSES", "2"))
+IMAGE_DECODE_TIMEOUT = float(os.getenv("IMAGE_DECODE_TIMEOUT", "30"))
+JPEG_QUALITY = 85
+
+# Decoded out of process
+HEAVY_FORMATS = {'image/heic', 'image/heif', 'image/webp', 'image/tiff', 'image/avif'}
+
+# Grid tile / card / detail view widths
+RENDITION_WIDTHS = tuple(sorted(int(w) for w in os.getenv("RENDITION_WIDTHS", "240,480,720").split(",") if w.strip()))
+# (name, content type, Pillow format, save options) — best compression first
+RENDITION_FORMATS = [
+    ("webp", "image/webp", "WEBP", {"quality": 75, "method": 4}),
+]
+if AVIF_SUPPORTED:
+    RENDITION_FORMATS.insert(0, ("avif", "image/avif", "AVIF", {"quality": 50, "speed": 6}))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def decode(image_data: bytes, max_side: Optional[int] = None) -> Image.Image:
+    """
+    Decode to RGB. With max_side the result fits in max_side x max_side
+    (aspect kept); JPEG decodes at reduced scale, others are reduced after.
+    """
+    image = Image.open(BytesIO(image_data))
+    if max_side:
+        # thumbnail() uses draft() for JPEG and reduce() + resample otherwise
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')  # JPEG doesn't support alpha / palette
+    return image
+
+
+def encode_jpeg(image: Image.Image, quality: int = JPEG_QUALITY) -> bytes:
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def convert_to_jpeg(image_data: bytes, max_side: Optional[int] = None, quality: int = JPEG_QUALITY) -> bytes:
+    """Decode + re-encode as JPEG (module-level so it can run in the pool)"""
+    return encode_jpeg(decode(image_data, max_side), quality)
+
+
+def render_renditions(image_data: bytes, widths: Tuple[int, ...] = RENDITION_WIDTHS) -> List[Tuple[str, int, str, bytes]]:
+    """
+    One decode -> [(format, width, content_type, bytes)] for every width not
+    wider than the source, in every RENDITION_FORMATS format, plus a
+    progressive JPEG at the largest width (fallback for old browsers).
+    """
+    image = Image.open(BytesIO(image_data))
+    source_width = image.size[0]
+    targets = sorted({w for w in widths if w < source_width} | {min(max(widths), source_width)})
+    if image.format == 'JPEG':
+        image.draft('RGB', (targets[-1], 1))  # DCT-scaled decode, width-bound only
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    renditions = []
+    current = image
+    for width in reversed(targets):  # downscale step by step from the largest
+        if width != current.size[0]:
+            height = max(1, round(current.size[1] * width / current.size[0]))
+            current = current.resize((width, height), Image.LANCZOS)
+        for name, content_type, pil_format, options in RENDITION_FORMATS:
+            output = BytesIO()
+            current.save(output, format=pil_format, **options)
+            renditions.append((name, width, content_type, output.getvalue()))
+        if width == targets[-1]:
+            output = BytesIO()
+            current.save(output, format='JPEG', quality=80, optimize=True, progressive=True)
+            renditions.append(("jpeg", width, 'image/jpeg', output.getvalue()))
+    return renditions
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    with _pool_lock:
+        if _pool is None and IMAGE_DECODE_PROCESSES > 0:
+            # spawn: forking a threaded server process can deadlock in the child
+            _pool = ProcessPoolExecutor(
+                max_workers=IMAGE_DECODE_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Replace a broken/stuck pool (once, however many threads noticed) and shut it down"""
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return  # another thread already replaced it
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def to_jpeg(
+    image_data: bytes,
+    content_type: str,
+    max_side: Optional[int] = None,
+    quality: int = JPEG_QUALITY
+) -> Tuple[bytes, str]:
+    """
+    Convert any decodable image to JPEG. Heavy codecs go through the process
+    pool (bounded: at most IMAGE_DECODE_PROCESSES conversions at once);
+    falls back to converting inline if the pool is unavailable.
+    Raises on undecodable input.
+    """
+    if content_type in HEAVY_FORMATS:
+        return _run_pooled(convert_to_jpeg, image_data, max_side, quality), 'image/jpeg'
+    return convert_to_jpeg(image_data, max_side, quality), 'image/jpeg'
+
+
+def make_renditions(image_data: bytes) -> List[Tuple[str, int, str, bytes]]:
+    """render_renditions() in the process pool (encoding WebP/AVIF is CPU-heavy)"""
+    return _run_pooled(render_renditions, image_data)
+
+
+def _run_pooled(fn, *args):
+    pool = _get_pool()
+    if pool is not None:
+        future = None
+        try:
+            future = pool.submit(fn, *args)
+            return future.result(timeout=IMAGE_DECODE_TIMEOUT)
+        except BrokenProcessPool:
+            logger.warning("⚠️ Image decode pool crashed — restarting, converting inline")
+            _discard_pool(pool)
+        except FutureTimeoutError:
+            # A worker is stuck on this image (e.g. a decompression bomb): don't retry it
+            # inline, and don't let later images queue behind it — start a fresh pool
+            future.cancel()
+            logger.warning(f"⚠️ Image decode timed out after {IMAGE_DECODE_TIMEOUT}s — restarting the pool")
+            _discard_pool(pool)
+            raise
+    return fn(*args)
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,334 @@
+"""
+Stored Image Index
+Content-addressed index of images mirrored to Supabase Storage.
+
+Two keys lead to an already stored object:
+- canonical source URL: the CDN URL with signatures stripped (the way
+  ApifyStorage.fix_tiktok_url does), so the same cover seen in another
+  search, re-scan or competitor refresh is a hit *before* downloading;
+- content hash (sha256 of the downloaded bytes): a re-upload under a new
+  URL is a hit before converting/uploading.
+
+Object paths are derived from the content hash, so the bucket holds one
+object per distinct image (plus its renditions, see image_decode).
+Lookups go to an in-process LRU first (no network at all), then to
+stored_images (shared by all workers).
+
+sweep_orphans() deletes objects no trend/competitor references any more,
+in batches.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set
+from urllib.parse import urlsplit
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..core.database import SessionLocal
+from ..db.models import Competitor, StoredImage, Trend, UserAccount
+from .apify_storage import ApifyStorage
+
+logger = logging.getLogger(__name__)
+
+IMAGE_INDEX_MEMORY_ITEMS = int(os.getenv("IMAGE_INDEX_MEMORY_ITEMS", "50000"))
+ORPHAN_SWEEP_BATCH = int(os.getenv("ORPHAN_SWEEP_BATCH", "500"))
+ORPHAN_GRACE_HOURS = int(os.getenv("ORPHAN_GRACE_HOURS", "24"))
+
+EXTENSIONS = {
+    "image/jpeg": "jpg", "image/png": "png", "image/webp": "webp",
+    "image/gif": "gif", "image/avif": "avif", "image/svg+xml": "svg",
+}
+
+# Query strings on these CDNs are only signatures/expiry (the path identifies the file)
+_SIGNED_CDN_DOMAINS = ("cdninstagram.com", "fbcdn.net")
+
+
+def canonical_source(url: str) -> str:
+    """Source URL without signatures: the same image always gets the same key"""
+    if not url:
+        return url
+    if "tiktokcdn" in url:
+        return ApifyStorage.fix_tiktok_url(url)
+    host = urlsplit(url).netloc
+    if any(host.endswith(domain) for domain in _SIGNED_CDN_DOMAINS):
+        return url.split("?")[0]
+    return url
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def content_path(digest: str, folder: str, content_type: str) -> str:
+    """Content-addressed object path: same bytes -> same object"""
+    return f"{folder}/{digest[:2]}/{digest[:32]}.{EXTENSIONS.get(content_type, 'jpg')}"
+
+
+def rendition_path(digest: str, folder: str, width: int, content_type: str) -> str:
+    return f"{folder}/{digest[:2]}/{digest[:32]}_{width}w.{EXTENSIONS.get(content_type, 'jpg')}"
+
+
+def rendition_urls(renditions: Optional[dict]) -> List[str]:
+    return [url for by_width in (renditions or {}).values() for url in by_width.values()]
+
+
+class StoredRef(NamedTuple):
+    """An already stored image: main object URL + renditions map (may be empty)"""
+    public_url: str
+    renditions: Optional[dict] = None
+
+
+class _LRU:
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self.items: "OrderedDict[str, StoredRef]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[StoredRef]:
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: StoredRef) -> None:
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+
+class ImageIndex:
+    """Thread-safe: used from request threads and the event loop (via to_thread)"""
+
+    def __init__(self, max_items: int = IMAGE_INDEX_MEMORY_ITEMS):
+        self._by_source = _LRU(max_items)
+        self._lock = threading.Lock()
+        self.counters = {
+            "source_hits_memory": 0, "source_hits_db": 0, "source_misses": 0,
+            "content_hits": 0, "content_misses": 0, "recorded": 0,
+            "swept_objects": 0,
+        }
+
+    def lookup_sources(self, urls: Iterable[str]) -> Dict[str, StoredRef]:
+        """{url: StoredRef} for the URLs already stored (one query for all memory misses)"""
+        found: Dict[str, StoredRef] = {}
+        missing: Dict[str, List[str]] = {}
+        with self._lock:
+            for url in urls:
+                if not url:
+                    continue
+                key = canonical_source(url)
+                ref = self._by_source.get(key)
+                if ref:
+                    found[url] = ref
+                    self.counters["source_hits_memory"] += 1
+                else:
+                    missing.setdefault(key, []).append(url)
+        if not missing:
+            return found
+
+        db = SessionLocal()
+        try:
+            rows = db.query(StoredImage.source_key, StoredImage.public_url, StoredImage.renditions).filter(
+                StoredImage.source_key.in_(list(missing))
+            ).all()
+        except Exception as e:
+            logger.warning(f"Image index lookup failed: {e}")
+            rows = []
+        finally:
+            db.close()
+
+        with self._lock:
+            for row in rows:
+                ref = StoredRef(row.public_url, row.renditions)
+                self._by_source.put(row.source_key, ref)
+                for url in missing.pop(row.source_key, []):
+                    found[url] = ref
+                    self.counters["source_hits_db"] += 1
+            self.counters["source_misses"] += sum(len(urls) for urls in missing.values())
+        return found
+
+    def lookup_source(self, url: str) -> Optional[StoredRef]:
+        return self.lookup_sources([url]).get(url)
+
+    def lookup_content(self, digest: str) -> Optional[StoredImage]:
+        """A stored object with these bytes (path/public_url/content_type), or None"""
+        db = SessionLocal()
+        try:
+            row = db.query(StoredImage).filter(StoredImage.content_hash == digest).first()
+            if row is not None:
+                db.expunge(row)
+        except Exception as e:
+            logger.warning(f"Image index lookup failed: {e}")
+            row = None
+        finally:
+            db.close()
+
+        with self._lock:
+            self.counters["content_hits" if row is not None else "content_misses"] += 1
+        return row
+
+    def record(
+        self,
+        source_url: str,
+        digest: str,
+        path: str,
+        public_url: str,
+        content_type: Optional[str] = None,
+        size_bytes: Optional[int] = None,
+        renditions: Optional[dict] = None
+    ) -> StoredRef:
+        """Remember source -> stored object (upsert; the latest upload wins)"""
+        key = canonical_source(source_url)
+        db = SessionLocal()
+        try:
+            stmt = pg_insert(StoredImage).values(
+                source_key=key, content_hash=digest, path=path, public_url=public_url,
+                content_type=content_type, size_bytes=size_bytes, renditions=renditions,
+                created_at=datetime.utcnow()
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[StoredImage.source_key],
+                set_={
+                    "content_hash": stmt.excluded.content_hash,
+                    "path": stmt.excluded.path,
+                    "public_url": stmt.excluded.public_url,
+                    "content_type": stmt.excluded.content_type,
+                    "size_bytes": stmt.excluded.size_bytes,
+                    "renditions": stmt.excluded.renditions,
+                }
+            )
+            db.execute(stmt)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Image index write failed: {e}")
+        finally:
+            db.close()
+
+        ref = StoredRef(public_url, renditions)
+        with self._lock:
+            self._by_source.put(key, ref)
+            self.counters["recorded"] += 1
+        return ref
+
+    def indexed_paths(self, paths: List[str]) -> Set[str]:
+        """Subset of paths that are content-addressed (possibly shared) objects"""
+        if not paths:
+            return set()
+        db = SessionLocal()
+        try:
+            return {row[0] for row in db.query(StoredImage.path).filter(StoredImage.path.in_(paths)).distinct()}
+        finally:
+            db.close()
+
+    def forget_paths(self, paths: Iterable[str]) -> None:
+        paths = set(paths)
+        with self._lock:
+            for key, ref in list(self._by_source.items.items()):
+                if any(ref.public_url.endswith(path) for path in paths):
+                    del self._by_source.items[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self.counters)
+            source_total = c["source_hits_memory"] + c["source_hits_db"] + c["source_misses"]
+            content_total = c["content_hits"] + c["content_misses"]
+            return {
+                **c,
+                "memory_items": len(self._by_source.items),
+                "source_hit_rate": round((c["source_hits_memory"] + c["source_hits_db"]) / source_total, 4)
+                if source_total else 0,
+                "content_hit_rate": round(c["content_hits"] / content_total, 4) if content_total else 0,
+            }
+
+
+def _referenced_paths(db: Session, extract) -> Set[str]:
+    """Every bucket path some trend/competitor/account still points at"""
+    paths: Set[str] = set()
+
+    def add(url):
+        path = extract(url) if isinstance(url, str) else None
+        if path:
+            paths.add(path)
+
+    for (url,) in db.query(Trend.cover_url).filter(Trend.cover_url.like("%supabase%")).yield_per(5000):
+        add(url)
+    for avatar_url, recent_videos in db.query(Competitor.avatar_url, Competitor.recent_videos).yield_per(1000):
+        add(avatar_url)
+        for video in recent_videos or []:
+            if isinstance(video, dict):
+                add(video.get("cover_url"))
+                add(video.get("thumbnail_url"))
+    for (url,) in db.query(UserAccount.avatar_url).filter(UserAccount.avatar_url.like("%supabase%")):
+        add(url)
+    return paths
+
+
+def sweep_orphans(
+    db: Session,
+    batch_size: int = ORPHAN_SWEEP_BATCH,
+    grace_hours: int = ORPHAN_GRACE_HOURS,
+    keep_going: Optional[Callable[[], bool]] = None
+) -> dict:
+    """
+    Delete indexed objects nothing references, ORPHAN_SWEEP_BATCH paths per
+    storage call. Objects younger than grace_hours are kept (their trend
+    may not be patched yet). Stops between batches once keep_going()
+    returns False (leader stepped down).
+    """
+    from .storage import IMAGES_BUCKET, SupabaseStorage, _get_supabase
+
+    client = _get_supabase()
+    if not client:
+        return {"deleted": 0, "skipped": "storage not configured"}
+
+    referenced = _referenced_paths(db, SupabaseStorage.extract_path_from_url)
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+
+    deleted = 0
+    failed = 0
+    after = ""
+    while not keep_going or keep_going():
+        batch = [row[0] for row in db.query(StoredImage.path).filter(
+            StoredImage.path > after
+        ).group_by(StoredImage.path).having(
+            func.max(StoredImage.created_at) < cutoff
+        ).order_by(StoredImage.path).limit(batch_size)]
+        if not batch:
+            break
+        after = batch[-1]
+
+        orphans = [path for path in batch if path not in referenced]
+        if not orphans:
+            continue
+        # Renditions go with their main object
+        objects = list(orphans)
+        for (renditions,) in db.query(StoredImage.renditions).filter(
+            StoredImage.path.in_(orphans), StoredImage.renditions.isnot(None)
+        ):
+            for url in rendition_urls(renditions):
+                path = SupabaseStorage.extract_path_from_url(url)
+                if path and path not in objects:
+                    objects.append(path)
+        try:
+            client.storage.from_(IMAGES_BUCKET).remove(objects)
+            db.query(StoredImage).filter(StoredImage.path.in_(orphans)).delete(synchronize_session=False)
+            db.commit()
+            image_index.forget_paths(orphans)
+            deleted += len(orphans)
+        except Exception as e:
+            db.rollback()
+            failed += len(orphans)
+            logger.error(f"Orphan sweep batch failed: {e}")
+
+    image_index.counters["swept_objects"] += deleted
+    return {"deleted": deleted, "failed": failed, "referenced": len(referenced)}
+
+
+image_index = ImageIndex()
@@ -0,0 +1,159 @@
+"""
+Job Queue
+Postgres-backed work queue (pipeline_jobs) for standalone pipeline
+workers (python -m app.worker).
+
+With PIPELINE_MODE=queue the API only enqueues the heavy post-search
+stages — cover mirroring ("thumbnails") and CLIP embedding + visual
+clustering ("clustering") — and workers on other processes/nodes run them,
+so API latency no longer competes with batch work for the same CPU. With
+PIPELINE_MODE=inline (default) everything runs in the API process as before.
+
+Claiming is UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED):
+concurrent workers never wait on each other's rows, so throughput grows
+with the number of workers. A claimed job is leased for
+PIPELINE_LEASE_SECONDS (the worker extends the lease while it runs); a job
+whose lease expired — worker crashed or lost its connection — is claimed
+again, up to max_attempts.
+"""
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..db.models import PipelineJob
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "inline").lower()  # inline | queue
+PIPELINE_LEASE_SECONDS = int(os.getenv("PIPELINE_LEASE_SECONDS", "120"))
+PIPELINE_RETRY_SECONDS = int(os.getenv("PIPELINE_RETRY_SECONDS", "30"))
+PIPELINE_MAX_ATTEMPTS = int(os.getenv("PIPELINE_MAX_ATTEMPTS", "3"))
+
+THUMBNAILS_QUEUE = "thumbnails"
+CLUSTERING_QUEUE = "clustering"
+QUEUES = (THUMBNAILS_QUEUE, CLUSTERING_QUEUE)
+
+
+def queue_mode() -> bool:
+    return PIPELINE_MODE == "queue"
+
+
+def enqueue(db: Session, queue: str, payload: dict, user_id: Optional[int] = None) -> str:
+    """Add a job; returns its id (the job handle). Caller commits."""
+    job = PipelineJob(
+        id=uuid.uuid4().hex,
+        queue=queue,
+        user_id=user_id,
+        payload=payload,
+        status="pending",
+        attempts=0,
+        max_attempts=PIPELINE_MAX_ATTEMPTS,
+        run_after=datetime.utcnow(),
+        created_at=datetime.utcnow()
+    )
+    db.add(job)
+    return job.id
+
+
+def claim(db: Session, queue: str, worker_id: str, limit: int = 1) -> list:
+    """
+    Lease up to `limit` runnable jobs of a queue to this worker (commits).
+    Rows: (id, user_id, payload, attempts, max_attempts).
+    """
+    now = datetime.utcnow()
+    # Expired leases with no attempts left: give up on them
+    db.execute(text("""
+        UPDATE pipeline_jobs SET status = 'failed', finished_at = :now,
+                                 error = COALESCE(error, 'lease expired')
+        WHERE queue = :queue AND status = 'running' AND leased_until < :now AND attempts >= max_attempts
+    """), {"queue": queue, "now": now})
+    rows = db.execute(text("""
+        UPDATE pipeline_jobs SET status = 'running', attempts = attempts + 1, worker_id = :worker_id,
+                                 started_at = :now, leased_until = :leased_until
+        WHERE id IN (
+            SELECT id FROM pipeline_jobs
+            WHERE queue = :queue
+              AND ((status = 'pending' AND run_after <= :now)
+                   OR (status = 'running' AND leased_until < :now))
+            ORDER BY run_after
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, user_id, payload, attempts, max_attempts
+    """), {
+        "queue": queue,
+        "worker_id": worker_id,
+        "now": now,
+        "leased_until": now + timedelta(seconds=PIPELINE_LEASE_SECONDS),
+        "limit": limit,
+    }).fetchall()
+    db.commit()
+    return rows
+
+
+def extend_lease(db: Session, job_id: str, worker_id: str) -> bool:
+    """False if the job is no longer ours (lease expired and someone else claimed it)"""
+    updated = db.execute(text("""
+        UPDATE pipeline_jobs SET leased_until = :leased_until
+        WHERE id = :id AND worker_id = :worker_id AND status = 'running'
+    """), {
+        "id": job_id,
+        "worker_id": worker_id,
+        "leased_until": datetime.utcnow() + timedelta(seconds=PIPELINE_LEASE_SECONDS),
+    }).rowcount
+    db.commit()
+    return bool(updated)
+
+
+def complete(db: Session, job_id: str, worker_id: str, result: Optional[dict] = None) -> None:
+    db.execute(text("""
+        UPDATE pipeline_jobs SET status = 'done', result = CAST(:result AS jsonb), error = NULL,
+                                 finished_at = :now, leased_until = NULL
+        WHERE id = :id AND worker_id = :worker_id
+    """), {"id": job_id, "worker_id": worker_id, "result": _json(result), "now": datetime.utcnow()})
+    db.commit()
+
+
+def fail(db: Session, job_id: str, worker_id: str, error: str) -> None:
+    """Back to pending after PIPELINE_RETRY_SECONDS * attempts, or failed when out of attempts"""
+    now = datetime.utcnow()
+    db.execute(text("""
+        UPDATE pipeline_jobs
+        SET status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END,
+            run_after = :now + make_interval(secs => :retry * attempts),
+            finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE :now END,
+            leased_until = NULL, error = :error
+        WHERE id = :id AND worker_id = :worker_id
+    """), {"id": job_id, "worker_id": worker_id, "error": error[:2000], "now": now, "retry": PIPELINE_RETRY_SECONDS})
+    db.commit()
+
+
+def get_job(db: Session, job_id: str) -> Optional[PipelineJob]:
+    return db.query(PipelineJob).filter(PipelineJob.id == job_id).first()
+
+
+def queue_stats(db: Session) -> dict:
+    rows = db.execute(text("""
+        SELECT queue, status, COUNT(*) AS n,
+               EXTRACT(EPOCH FROM (NOW() AT TIME ZONE 'utc' - MIN(run_after))) AS oldest_s
+        FROM pipeline_jobs
+        WHERE status IN ('pending', 'running') OR finished_at >= NOW() AT TIME ZONE 'utc' - INTERVAL '1 hour'
+        GROUP BY queue, status
+    """)).fetchall()
+    stats = {queue: {} for queue in QUEUES}
+    for row in rows:
+        entry = stats.setdefault(row.queue, {})
+        entry[row.status] = row.n
+        if row.status == "pending":
+            entry["oldest_pending_s"] = int(row.oldest_s or 0)
+    return {"mode": PIPELINE_MODE, "queues": stats}
+
+
+def _json(value) -> Optional[str]:
+    return json.dumps(value) if value is not None else None
@@ -0,0 +1,189 @@
+"""
+Leader Election
+Exactly one process (across uvicorn workers and nodes) runs the
+time-based scheduler jobs; the others keep the scheduler loaded but
+paused and take over when the leader goes away.
+
+Leadership = a session-level Postgres advisory lock
+(pg_try_advisory_lock(LEADER_LOCK_KEY)) held on a dedicated connection:
+
+- standbys try to take the lock every LEADER_RETRY_SECONDS;
+- the leader renews its lease every LEADER_RENEW_SECONDS by using that
+  connection; if renewal fails or doesn't succeed for LEADER_LEASE_SECONDS
+  it steps down on its own (pauses the jobs) and drops the connection;
+- a dead leader's lock is released by Postgres with its session: at
+  once when the process dies, within ~11s (TCP keepalives below) when the
+  node drops off the network — after the old leader has already paused.
+
+Session advisory locks don't survive PgBouncer transaction pooling
+(Supabase port 6543), so the lock connection goes to LEADER_DATABASE_URL,
+by default the same database through the session pooler (port 5432).
+
+Everything touching the lock connection runs on one dedicated thread: a
+call that timed out on the event loop side may still be using the
+connection, and the close that follows must wait for it rather than
+close the connection under it.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+LEADER_ELECTION = os.getenv("LEADER_ELECTION", "true").lower() == "true"
+LEADER_DATABASE_URL = os.getenv("LEADER_DATABASE_URL") or settings.DATABASE_URL.replace(":6543/", ":5432/")
+LEADER_LOCK_KEY = int(os.getenv("LEADER_LOCK_KEY", "72470001"))
+LEADER_RENEW_SECONDS = float(os.getenv("LEADER_RENEW_SECONDS", "2"))
+LEADER_RETRY_SECONDS = float(os.getenv("LEADER_RETRY_SECONDS", "3"))
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "10"))
+
+
+class LeaderElector:
+    def __init__(
+        self,
+        key: int = LEADER_LOCK_KEY,
+        on_elected: Optional[Callable[[], None]] = None,
+        on_demoted: Optional[Callable[[], None]] = None
+    ):
+        self.key = key
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.identity = f"{socket.gethostname()}:{os.getpid()}"
+        self._engine = None
+        self._conn = None
+        # Single thread: connection calls never overlap, even after a timeout
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="leader-lock")
+        self._task: Optional[asyncio.Task] = None
+        self._leader_since: Optional[float] = None
+        self._renewed_at = 0.0
+        self.counters = {"elections": 0, "demotions": 0, "renew_failures": 0, "acquire_errors": 0}
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader_since is not None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            self._demote("shutdown")
+        try:
+            await asyncio.wait_for(self._on_lock_thread(self._close), LEADER_LEASE_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Closing the leader lock connection timed out")
+        self._executor.shutdown(wait=False)
+
+    def _on_lock_thread(self, fn) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn)
+
+    async def _run(self) -> None:
+        while True:
+            if self.is_leader:
+                await self._renew()
+                await asyncio.sleep(LEADER_RENEW_SECONDS)
+            else:
+                try:
+                    acquired = await asyncio.wait_for(self._on_lock_thread(self._try_acquire), LEADER_LEASE_SECONDS)
+                except Exception as e:
+                    self.counters["acquire_errors"] += 1
+                    logger.warning(f"Leader election attempt failed: {e}")
+                    # Queued behind the timed-out call: runs once it has let go of the connection
+                    await self._on_lock_thread(self._close)
+                    acquired = False
+                if acquired:
+                    self._elect()
+                    continue
+                await asyncio.sleep(LEADER_RETRY_SECONDS)
+
+    async def _renew(self) -> None:
+        try:
+            await asyncio.wait_for(self._on_lock_thread(self._ping), LEADER_RENEW_SECONDS)
+            self._renewed_at = time.monotonic()
+            return
+        except Exception as e:
+            self.counters["renew_failures"] += 1
+            logger.warning(f"Leader lease renewal failed: {e}")
+        if time.monotonic() - self._renewed_at >= LEADER_LEASE_SECONDS:
+            # Can't prove we still hold the lock: step down before anyone else takes over
+            self._demote("lease expired")
+            await self._on_lock_thread(self._close)
+
+    def _elect(self) -> None:
+        self._leader_since = time.time()
+        self._renewed_at = time.monotonic()
+        self.counters["elections"] += 1
+        logger.info(f"👑 Leader elected: {self.identity}")
+        if self.on_elected:
+            self.on_elected()
+
+    def _demote(self, reason: str) -> None:
+        self._leader_since = None
+        self.counters["demotions"] += 1
+        logger.warning(f"Leader {self.identity} stepped down: {reason}")
+        if self.on_demoted:
+            self.on_demoted()
+
+    # --- lock connection (blocking, run on the lock thread) ---
+
+    def _connect(self):
+        if self._engine is None:
+            self._engine = create_engine(
+                LEADER_DATABASE_URL,
+                poolclass=NullPool,
+                isolation_level="AUTOCOMMIT",
+                connect_args={
+                    "connect_timeout": 5,
+                    # Server side: drop the session (and the lock) of a vanished leader within ~11s
+                    "options": "-c statement_timeout=5000 -c tcp_keepalives_idle=5 "
+                               "-c tcp_keepalives_interval=2 -c tcp_keepalives_count=3",
+                    "keepalives": 1,
+                    "keepalives_idle": 5,
+                    "keepalives_interval": 2,
+                    "keepalives_count": 3,
+                }
+            )
+        if self._conn is None:
+            self._conn = self._engine.connect()
+        return self._conn
+
+    def _try_acquire(self) -> bool:
+        conn = self._connect()
+        return bool(conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}).scalar())
+
+    def _ping(self) -> None:
+        self._conn.execute(text("SELECT 1"))
+
+    def _close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()  # ends the session -> releases the lock
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "enabled": LEADER_ELECTION,
+            "identity": self.identity,
+            "is_leader": self.is_leader,
+            "leader_for_s": int(time.time() - self._leader_since) if self._leader_since else None,
+            **self.counters,
+        }
@@ -0,0 +1,77 @@
+"""
+Event Loop Lag Monitor
+Measures how long the event loop is blocked: a task sleeps
+LOOP_MONITOR_INTERVAL_MS and records how late it wakes up. Any blocking
+call on the loop (sync scraping, sync SQLAlchemy) shows up as drift.
+
+Samples taken while a rescan batch is running are kept separately, so the
+effect of rescans on API latency is visible in /metrics/event-loop.
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_INTERVAL_MS = int(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100"))
+LOOP_MONITOR_WINDOW = int(os.getenv("LOOP_MONITOR_WINDOW", "3000"))  # samples kept (~5 min at 100ms)
+
+
+def _percentiles(samples) -> dict:
+    values = sorted(samples)
+    if not values:
+        return {"samples": 0, "p50_ms": None, "p99_ms": None, "max_ms": None}
+
+    def pct(p):
+        return round(values[min(int(len(values) * p), len(values) - 1)] * 1000, 2)
+
+    return {"samples": len(values), "p50_ms": pct(0.5), "p99_ms": pct(0.99), "max_ms": round(values[-1] * 1000, 2)}
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL_MS / 1000, window: int = LOOP_MONITOR_WINDOW):
+        self.interval = interval
+        self._samples = deque(maxlen=window)
+        self._busy_samples = deque(maxlen=window)
+        self._busy: Optional[Callable[[], bool]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, busy: Optional[Callable[[], bool]] = None) -> None:
+        """busy(): True while the workload under observation (rescans) runs"""
+        if self._task is None or self._task.done():
+            self._busy = busy
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self._samples.append(lag)
+            if self._busy is not None and self._busy():
+                self._busy_samples.append(lag)
+            if lag > 1:
+                logger.warning(f"Event loop blocked for {lag:.2f}s")
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval_ms": round(self.interval * 1000),
+            "all": _percentiles(self._samples),
+            "during_rescans": _percentiles(self._busy_samples),
+        }
+
+
+loop_monitor = LoopLagMonitor()
@@ -1,10 +1,124 @@
 """
 ML Service Client
 Handles communication with the ML microservice
+
+Async client over one pooled httpx.AsyncClient (keep-alive connections),
+with per-endpoint timeouts, jittered retries for idempotent calls, a circuit
+breaker that fails fast while the ML service is down, and per-endpoint
+latency/error metrics.
 """
+import asyncio
 import os
-import requests
-from typing import Optional, List
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from .embedding_codec import (
+    EMBEDDINGS_MEDIA_TYPE, EmbeddingCodecError, accept_header, decode_embeddings, from_json
+)
+
+# Per-endpoint timeouts (seconds). Batch embedding downloads 50+ covers.
+ENDPOINT_TIMEOUTS = {
+    "/": 3.0,
+    "/embeddings/text": 10.0,
+    "/embeddings/image": 20.0,
+    "/embeddings/batch-texts": 30.0,
+    "/embeddings/batch-images": 90.0,
+    "/ai/trend-summary": 45.0,
+}
+DEFAULT_TIMEOUT = 30.0
+CONNECT_TIMEOUT = 3.0
+
+# Pure functions of their input -> safe to retry. trend-summary costs LLM tokens.
+IDEMPOTENT_ENDPOINTS = {
+    "/", "/embeddings/text", "/embeddings/image", "/embeddings/batch-texts", "/embeddings/batch-images"
+}
+
+MAX_RETRIES = int(os.getenv("ML_CLIENT_MAX_RETRIES", "2"))
+RETRY_BASE_DELAY = 0.25
+RETRY_MAX_DELAY = 2.0
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold consecutive failures) -> open
+    open -> (reset_timeout elapsed) -> half-open: one trial request
+    half-open -> success: closed / failure: open again
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self) -> None:
+        """The trial request ended without a verdict (cancelled, unexpected error)"""
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                print(f"⚠️ ML Service circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+class EndpointMetrics:
+    """Rolling latency + error counters for one endpoint"""
+
+    def __init__(self, window: int = 1000):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.short_circuited = 0
+        self.latencies: Deque[float] = deque(maxlen=window)
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.requests, 4) if self.requests else 0,
+            "retries": self.retries,
+            "short_circuited": self.short_circuited,
+            "latency_ms": {"p50": percentile(0.50), "p95": percentile(0.95), "p99": percentile(0.99)},
+        }
 
 
 class MLServiceClient:
@@ -12,26 +126,106 @@ class MLServiceClient:
 
     def __init__(self):
         self.base_url = os.getenv("ML_SERVICE_URL", "http://localhost:8001")
-        self.timeout = 30
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("ML_CIRCUIT_FAILURES", "5")),
+            reset_timeout=float(os.getenv("ML_CIRCUIT_RESET_SECONDS", "30"))
+        )
+        self.metrics: Dict[str, EndpointMetrics] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def available(self) -> bool:
+        """False while the circuit is open (callers can skip ML work immediately)"""
+        return self.breaker.state != "open"
+
+    async def _send(
+        self,
+        method: str,
+        endpoint: str,
+        data: dict = None,
+        headers: dict = None
+    ) -> Optional[httpx.Response]:
+        """Send with timeout/retry/breaker handling. Returns None on failure."""
+        metrics = self.metrics.setdefault(endpoint, EndpointMetrics())
 
-    def _make_request(self, method: str, endpoint: str, data: dict = None):
-        """Make HTTP request to ML service"""
-        url = f"{self.base_url}{endpoint}"
+        trial = self.breaker.state == "half_open"  # this call is the one half-open trial
+        if not self.breaker.allow():
+            metrics.short_circuited += 1
+            return None
+
+        timeout = httpx.Timeout(ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT), connect=CONNECT_TIMEOUT)
+        attempts = 1 + (MAX_RETRIES if endpoint in IDEMPOTENT_ENDPOINTS else 0)
+
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    metrics.retries += 1
+                    # Full jitter: spread retries from concurrent requests apart
+                    await asyncio.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+
+                metrics.requests += 1
+                started = time.perf_counter()
+                try:
+                    response = await self.client.request(
+                        method, endpoint, json=data, headers=headers, timeout=timeout
+                    )
+                    metrics.latencies.append(time.perf_counter() - started)
+
+                    if response.status_code in RETRY_STATUS_CODES and attempt < attempts - 1:
+                        metrics.errors += 1
+                        continue
+
+                    response.raise_for_status()
+                    self.breaker.record_success()
+                    return response
+                except httpx.HTTPStatusError as e:
+                    metrics.errors += 1
+                    print(f"⚠️ ML Service request failed: {e}")
+                    if e.response.status_code >= 500:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()  # 4xx: the service itself is healthy
+                    return None
+                except httpx.HTTPError as e:
+                    metrics.errors += 1
+                    metrics.latencies.append(time.perf_counter() - started)
+                    if attempt == attempts - 1:
+                        print(f"⚠️ ML Service request failed: {endpoint}: {e!r}")
+
+            self.breaker.record_failure()
+            return None
+        finally:
+            if trial:
+                # Cancelled / unexpected error: free the trial slot, or the breaker stays shut for good
+                self.breaker.release_trial()
+
+    async def _make_request(self, method: str, endpoint: str, data: dict = None):
+        """Make HTTP request to ML service (JSON in/out)"""
+        response = await self._send(method, endpoint, data)
+        if response is None:
+            return None
         try:
-            if method == "GET":
-                response = requests.get(url, timeout=self.timeout)
-            elif method == "POST":
-                response = requests.post(url, json=data, timeout=self.timeout)
-            else:
-                raise ValueError(f"Unsupported method: {method}")
-
-            response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"⚠️ ML Service request failed: {e}")
+        except ValueError as e:
+            print(f"⚠️ ML Service returned invalid JSON: {e}")
             return None
 
-    def get_text_embedding(self, text: str) -> Optional[List[float]]:
+    async def get_text_embedding(self, text: str) -> Optional[List[float]]:
         """
         Get CLIP embedding for text
 
@@ -41,12 +235,12 @@ class MLServiceClient:
         Returns:
             List of floats (embedding) or None if failed
         """
-        result = self._make_request("POST", "/embeddings/text", {"text": text})
+        result = await self._make_request("POST", "/embeddings/text", {"text": text})
         if result and "embedding" in result:
             return result["embedding"]
         return None
 
-    def get_image_embedding(self, image_url: str) -> Optional[List[float]]:
+    async def get_image_embedding(self, image_url: str) -> Optional[List[float]]:
         """
         Get CLIP embedding for image
 
@@ -56,12 +250,12 @@ class MLServiceClient:
         Returns:
             List of floats (embedding) or None if failed
         """
-        result = self._make_request("POST", "/embeddings/image", {"image_url": image_url})
+        result = await self._make_request("POST", "/embeddings/image", {"image_url": image_url})
         if result and "embedding" in result:
             return result["embedding"]
         return None
 
-    def get_batch_image_embeddings(self, image_urls: List[str]) -> List[Optional[List[float]]]:
+    async def get_batch_image_embeddings(self, image_urls: List[str]) -> List[Optional[List[float]]]:
         """
         Get CLIP embeddings for multiple images
 
@@ -71,12 +265,50 @@ class MLServiceClient:
         Returns:
             List of embeddings (None for failed images)
         """
-        result = self._make_request("POST", "/embeddings/batch-images", {"image_urls": image_urls})
+        result = await self._make_request("POST", "/embeddings/batch-images", {"image_urls": image_urls})
         if result and "embeddings" in result:
             return result["embeddings"]
         return [None] * len(image_urls)
 
-    def generate_trend_summary(self, description: str, views: int, cover_url: Optional[str] = None) -> str:
+    async def get_batch_image_embedding_matrix(
+        self,
+        image_urls: List[str],
+        dtype: str = "float16"
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get CLIP embeddings for multiple images as a numpy matrix.
+        Asks for the binary format (decoded zero-copy); falls back to JSON
+        if the ML service doesn't support it.
+
+        Args:
+            image_urls: List of image URLs
+            dtype: Wire dtype, "float16" (half the bytes) or "float32"
+
+        Returns:
+            (matrix, mask): matrix has one row per successful image (in order);
+            mask[i] is True if image_urls[i] has a row
+        """
+        empty = (np.empty((0, 0), dtype=np.float32), np.zeros(len(image_urls), dtype=bool))
+        response = await self._send(
+            "POST", "/embeddings/batch-images",
+            {"image_urls": image_urls},
+            headers={"Accept": accept_header(dtype)}
+        )
+        if response is None:
+            return empty
+
+        try:
+            if response.headers.get("content-type", "").startswith(EMBEDDINGS_MEDIA_TYPE):
+                return decode_embeddings(response.content)
+
+            result = response.json()
+            if "embeddings" in result:
+                return from_json(result["embeddings"])
+        except (EmbeddingCodecError, ValueError) as e:
+            print(f"⚠️ ML Service returned an invalid embedding payload: {e}")
+        return empty
+
+    async def generate_trend_summary(self, description: str, views: int, cover_url: Optional[str] = None) -> str:
         """
         Generate AI summary for a trend
 
@@ -95,21 +327,32 @@ class MLServiceClient:
         if cover_url:
             data["cover_url"] = cover_url
 
-        result = self._make_request("POST", "/ai/trend-summary", data)
+        result = await self._make_request("POST", "/ai/trend-summary", data)
         if result and "summary" in result:
             return result["summary"]
         return "Summary not available"
 
-    def health_check(self) -> bool:
+    async def health_check(self) -> bool:
         """
         Check if ML service is available
 
         Returns:
             True if service is healthy, False otherwise
         """
-        result = self._make_request("GET", "/")
+        result = await self._make_request("GET", "/")
         return result is not None and result.get("status") == "ok"
 
+    def stats(self) -> Dict[str, Any]:
+        """Circuit state + per-endpoint latency/error metrics"""
+        return {
+            "base_url": self.base_url,
+            "circuit": {
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.failures,
+            },
+            "endpoints": {endpoint: m.snapshot() for endpoint, m in self.metrics.items()},
+        }
+
 
 # Singleton instance
 _ml_client = None
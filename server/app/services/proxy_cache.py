@@ -0,0 +1,284 @@
+"""
+Proxy Cache
+Two-tier cache for the image proxy (api/proxy.py): memory LRU + disk.
+
+Entries are keyed by the canonical URL (image_index.canonical_source: CDN
+signatures stripped), so the same cover requested with a fresh signature
+is still a hit. Each entry keeps the upstream validators (ETag,
+Last-Modified) and freshness (Cache-Control max-age, else
+PROXY_CACHE_TTL): fresh entries are served without touching upstream,
+stale ones are revalidated with a conditional request (304 -> no body
+transferred, which matters on the $12.50/GB residential proxy).
+
+Both tiers are bounded by bytes; the disk tier evicts least recently
+used files and survives restarts. Disk I/O runs in a thread
+(asyncio.to_thread) — the cache itself is only used from the event loop.
+
+The disk directory is shared by every worker process on the host, while
+each worker only accounts for what it has seen. sweep() (scheduler, every
+PROXY_CACHE_SWEEP_SECONDS, on every worker) rescans the directory,
+evicts LRU files until the whole directory fits PROXY_DISK_CACHE_MB and
+resyncs the worker's index with what is actually on disk.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+
+from .image_index import canonical_source
+
+logger = logging.getLogger(__name__)
+
+PROXY_CACHE_DIR = os.getenv("PROXY_CACHE_DIR", "/tmp/trendscout-proxy-cache")
+PROXY_MEMORY_CACHE_MB = int(os.getenv("PROXY_MEMORY_CACHE_MB", "64"))
+PROXY_DISK_CACHE_MB = int(os.getenv("PROXY_DISK_CACHE_MB", "1024"))
+PROXY_CACHE_TTL = int(os.getenv("PROXY_CACHE_TTL", "86400"))
+# Larger bodies are streamed through but not cached
+PROXY_CACHE_MAX_ENTRY_BYTES = int(os.getenv("PROXY_CACHE_MAX_ENTRY_MB", "8")) * 1024 * 1024
+PROXY_CACHE_SWEEP_SECONDS = int(os.getenv("PROXY_CACHE_SWEEP_SECONDS", "300"))
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(canonical_source(url).encode()).hexdigest()
+
+
+def freshness(cache_control: Optional[str]) -> int:
+    """Seconds an upstream response stays fresh (no-store/no-cache -> 0)"""
+    cache_control = (cache_control or "").lower()
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    match = _MAX_AGE.search(cache_control)
+    return int(match.group(1)) if match else PROXY_CACHE_TTL
+
+
+@dataclass
+class CacheMeta:
+    content_type: str
+    size: int
+    fetched_at: float
+    max_age: int
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    geo_restricted: bool = False  # fetched via the residential proxy
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() - self.fetched_at < self.max_age
+
+    def validators(self) -> Dict[str, str]:
+        """Headers for a conditional upstream request"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+@dataclass
+class CacheEntry:
+    meta: CacheMeta
+    body: bytes
+
+
+class ProxyCache:
+    def __init__(
+        self,
+        directory: str = PROXY_CACHE_DIR,
+        memory_bytes: int = PROXY_MEMORY_CACHE_MB * 1024 * 1024,
+        disk_bytes: int = PROXY_DISK_CACHE_MB * 1024 * 1024
+    ):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._memory_used = 0
+        self._disk: Optional["OrderedDict[str, int]"] = None  # key -> size, LRU order (loaded lazily)
+        self._disk_used = 0
+        self.counters = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0, "revalidated": 0,
+            "stores": 0, "evictions_memory": 0, "evictions_disk": 0, "sweeps": 0,
+        }
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        """Memory, then disk (promoted to memory). Fresh or stale — callers check meta.fresh."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return entry
+
+        if self.disk_bytes > 0:
+            await self._load_disk_index()
+            if key in self._disk:
+                entry = await asyncio.to_thread(self._read, key)
+                if entry is not None:
+                    self._disk.move_to_end(key)
+                    self._remember(key, entry)
+                    self.counters["disk_hits"] += 1
+                    return entry
+                self._drop_disk(key)
+
+        self.counters["misses"] += 1
+        return None
+
+    async def put(self, key: str, entry: CacheEntry) -> None:
+        if entry.meta.size > PROXY_CACHE_MAX_ENTRY_BYTES:
+            return
+        self._remember(key, entry)
+        self.counters["stores"] += 1
+        if self.disk_bytes <= 0:
+            return
+        await self._load_disk_index()
+        try:
+            await asyncio.to_thread(self._write, key, entry)
+        except OSError as e:
+            logger.warning(f"Proxy disk cache write failed: {e}")
+            return
+        self._disk_used += entry.meta.size - self._disk.pop(key, 0)
+        self._disk[key] = entry.meta.size
+        evicted = []
+        while self._disk_used > self.disk_bytes and self._disk:
+            old_key, size = self._disk.popitem(last=False)
+            self._disk_used -= size
+            evicted.append(old_key)
+        if evicted:
+            self.counters["evictions_disk"] += len(evicted)
+            await asyncio.to_thread(self._delete_files, evicted)
+
+    async def refresh(self, key: str, entry: CacheEntry, max_age: int) -> None:
+        """Upstream answered 304: the cached body is good for another max_age"""
+        entry.meta.fetched_at = time.time()
+        entry.meta.max_age = max_age
+        self.counters["revalidated"] += 1
+        if self.disk_bytes > 0 and key in (self._disk or {}):
+            try:
+                await asyncio.to_thread(self._write_meta, key, entry.meta)
+            except OSError as e:
+                logger.warning(f"Proxy disk cache write failed: {e}")
+
+    async def sweep(self) -> dict:
+        """Enforce disk_bytes over the whole (shared) directory and resync the index with it"""
+        if self.disk_bytes <= 0:
+            return {}
+        # Files written by other workers are picked up, files they evicted are dropped.
+        # (Entries this worker stores during the scan are re-indexed by the next sweep.)
+        disk = OrderedDict(await asyncio.to_thread(self._scan))
+        used = sum(disk.values())
+        evicted = []
+        while used > self.disk_bytes and disk:
+            old_key, size = disk.popitem(last=False)
+            used -= size
+            evicted.append(old_key)
+        self._disk, self._disk_used = disk, used
+        self.counters["sweeps"] += 1
+        if evicted:
+            self.counters["evictions_disk"] += len(evicted)
+            await asyncio.to_thread(self._delete_files, evicted)
+        return {"files": len(disk), "evicted": len(evicted), "disk_mb": round(used / 1024 / 1024, 1)}
+
+    # --- memory tier ---
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_used -= previous.meta.size
+        self._memory[key] = entry
+        self._memory_used += entry.meta.size
+        while self._memory_used > self.memory_bytes and self._memory:
+            _, old = self._memory.popitem(last=False)
+            self._memory_used -= old.meta.size
+            self.counters["evictions_memory"] += 1
+
+    # --- disk tier ---
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    async def _load_disk_index(self) -> None:
+        if self._disk is None:
+            self._disk = OrderedDict()  # set first: concurrent callers don't rescan
+            files = await asyncio.to_thread(self._scan)
+            for key, size in files:
+                if key not in self._disk:  # written while scanning
+                    self._disk[key] = size
+                    self._disk_used += size
+
+    def _scan(self):
+        """[(key, size)] of cached bodies, least recently used first"""
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith((".json", ".tmp")):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                found.append((stat.st_atime, name, stat.st_size))
+        found.sort()
+        return [(name, size) for _, name, size in found]
+
+    def _read(self, key: str) -> Optional[CacheEntry]:
+        path = self._path(key)
+        try:
+            with open(path + ".json") as f:
+                meta = CacheMeta(**json.load(f))
+            with open(path, "rb") as f:
+                body = f.read()
+            os.utime(path)  # LRU order survives restarts
+        except (OSError, ValueError, TypeError):
+            return None
+        return CacheEntry(meta, body)
+
+    def _write(self, key: str, entry: CacheEntry) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(entry.body)
+        os.replace(tmp, path)  # readers never see a partial body
+        self._write_meta(key, entry.meta)
+
+    def _write_meta(self, key: str, meta: CacheMeta) -> None:
+        path = self._path(key) + ".json"
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(asdict(meta), f)
+        os.replace(tmp, path)
+
+    def _delete_files(self, keys) -> None:
+        for key in keys:
+            for path in (self._path(key), self._path(key) + ".json"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _drop_disk(self, key: str) -> None:
+        self._disk_used -= self._disk.pop(key, 0)
+
+    def stats(self) -> dict:
+        c = self.counters
+        lookups = c["memory_hits"] + c["disk_hits"] + c["misses"]
+        return {
+            **c,
+            "hit_rate": round((c["memory_hits"] + c["disk_hits"]) / lookups, 4) if lookups else 0,
+            "memory_items": len(self._memory),
+            "memory_mb": round(self._memory_used / 1024 / 1024, 1),
+            "disk_items": len(self._disk or {}),
+            "disk_mb": round(self._disk_used / 1024 / 1024, 1),
+        }
+
+
+proxy_cache = ProxyCache()
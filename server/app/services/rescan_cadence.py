@@ -0,0 +1,84 @@
+"""
+Rescan Cadence
+Adaptive tracking: when to rescan a video next, based on what the last
+rescan showed.
+
+- growth: relative view growth per hour since the previous scan
+  ((views - prev_views) / prev_views / hours);
+- breakouts (fast growth or high UTS) are rescanned every
+  RESCAN_MIN_HOURS;
+- growing videos every RESCAN_GROWING_HOURS;
+- stagnant videos (growth below RESCAN_FLAT_GROWTH) back off
+  exponentially from RESCAN_BASE_HOURS up to RESCAN_MAX_HOURS, and stop
+  being tracked after RESCAN_STOP_AFTER_STAGNANT flat scans in a row or
+  RESCAN_MAX_TRACKING_DAYS after the video was found.
+
+Scans per user per day are capped by subscription tier
+(RESCAN_DAILY_BUDGET, enforced when the dispatcher claims rows).
+"""
+import os
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from ..db.models import SubscriptionTier
+
+RESCAN_MIN_HOURS = float(os.getenv("RESCAN_MIN_HOURS", "2"))
+RESCAN_GROWING_HOURS = float(os.getenv("RESCAN_GROWING_HOURS", "6"))
+RESCAN_BASE_HOURS = float(os.getenv("RESCAN_BASE_HOURS", "24"))
+RESCAN_MAX_HOURS = float(os.getenv("RESCAN_MAX_HOURS", "168"))
+RESCAN_BREAKOUT_GROWTH = float(os.getenv("RESCAN_BREAKOUT_GROWTH", "0.05"))  # +5% views / hour
+RESCAN_GROWING_GROWTH = float(os.getenv("RESCAN_GROWING_GROWTH", "0.01"))  # +1% / hour
+RESCAN_FLAT_GROWTH = float(os.getenv("RESCAN_FLAT_GROWTH", "0.002"))  # ~5% / day
+RESCAN_BREAKOUT_UTS = float(os.getenv("RESCAN_BREAKOUT_UTS", "7"))
+RESCAN_STOP_AFTER_STAGNANT = int(os.getenv("RESCAN_STOP_AFTER_STAGNANT", "3"))
+RESCAN_MAX_TRACKING_DAYS = int(os.getenv("RESCAN_MAX_TRACKING_DAYS", "30"))
+
+# Rescans per user per rolling 24h
+RESCAN_DAILY_BUDGET = {
+    SubscriptionTier.FREE: 50,
+    SubscriptionTier.CREATOR: 200,
+    SubscriptionTier.PRO: 1000,
+    SubscriptionTier.AGENCY: 5000,
+}
+
+
+class Cadence(NamedTuple):
+    growth: float  # relative views growth per hour
+    stagnant_scans: int
+    next_due: Optional[datetime]  # None -> stop tracking
+
+
+def growth_per_hour(prev_views: int, views: int, hours: float) -> float:
+    if hours <= 0:
+        return 0.0
+    return max(views - prev_views, 0) / max(prev_views, 1) / hours
+
+
+def next_scan(
+    prev_views: int,
+    views: int,
+    prev_scanned_at: datetime,
+    uts_score: float,
+    stagnant_scans: int,
+    found_at: datetime,
+    now: datetime
+) -> Cadence:
+    hours = (now - prev_scanned_at).total_seconds() / 3600
+    growth = growth_per_hour(prev_views, views, hours)
+
+    if growth >= RESCAN_BREAKOUT_GROWTH or (uts_score or 0) >= RESCAN_BREAKOUT_UTS:
+        stagnant_scans, delay = 0, RESCAN_MIN_HOURS
+    elif growth >= RESCAN_GROWING_GROWTH:
+        stagnant_scans, delay = 0, RESCAN_GROWING_HOURS
+    elif growth >= RESCAN_FLAT_GROWTH:
+        stagnant_scans, delay = 0, RESCAN_BASE_HOURS
+    else:
+        stagnant_scans += 1
+        if stagnant_scans >= RESCAN_STOP_AFTER_STAGNANT:
+            return Cadence(growth, stagnant_scans, None)
+        delay = min(RESCAN_BASE_HOURS * 2 ** stagnant_scans, RESCAN_MAX_HOURS)
+
+    next_due = now + timedelta(hours=delay)
+    if next_due > found_at + timedelta(days=RESCAN_MAX_TRACKING_DAYS):
+        return Cadence(growth, stagnant_scans, None)
+    return Cadence(growth, stagnant_scans, next_due)
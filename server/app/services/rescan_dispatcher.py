@@ -0,0 +1,437 @@
+"""
+Rescan Dispatcher
+Durable, cross-user rescans (point B of the UTS growth measurement).
+
+Deep searches insert rows into video_rescans (schedule_rescans) instead of
+holding an APScheduler job in memory, so rescans survive restarts. Every
+RESCAN_DISPATCH_INTERVAL_SECONDS the dispatcher:
+
+1. claims pending rows due now plus everything due within
+   RESCAN_COALESCE_MINUTES (fills runs instead of starting many tiny ones)
+   with FOR UPDATE SKIP LOCKED — several workers never claim the same row;
+2. deduplicates by URL: a video saved by 20 users is scraped once;
+3. scrapes in "urls"-mode collector runs of RESCAN_BATCH_SIZE URLs;
+4. fans the fresh stats out to every Trend with that URL (all owners, one
+   IN-prefetch + batched UPDATE ... FROM (VALUES ...)) and marks the rows done;
+5. queues each tracked video's next rescan at an adaptive cadence
+   (rescan_cadence: breakouts within hours, stagnant videos back off, flat
+   ones stop), within per-tier daily scan budgets applied at claim time.
+
+All of that is blocking (collector HTTP polling, sync SQLAlchemy), so it
+runs on a dedicated executor of RESCAN_WORKERS threads (run_in_rescan_executor)
+— never on the event loop, and without taking slots from the default
+threadpool that serves sync API handlers.
+
+Rows whose URL came back empty are retried RESCAN_MAX_ATTEMPTS times; rows
+stuck in "running" (worker died) are re-queued after RESCAN_LEASE_MINUTES.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..core.database import SessionLocal
+from ..db.models import Trend, VideoRescan
+from .collector import TikTokCollector
+from .instagram_adapter import adapt_instagram_to_standard
+from .instagram_collector import InstagramCollector
+from .rescan_cadence import RESCAN_DAILY_BUDGET, next_scan
+from .scorer import TrendScorer
+from .url_refresher import page_key
+
+logger = logging.getLogger(__name__)
+
+RESCAN_DISPATCH_INTERVAL_SECONDS = int(os.getenv("RESCAN_DISPATCH_INTERVAL_SECONDS", "60"))
+RESCAN_COALESCE_MINUTES = int(os.getenv("RESCAN_COALESCE_MINUTES", "15"))
+RESCAN_BATCH_SIZE = int(os.getenv("RESCAN_BATCH_SIZE", "200"))
+RESCAN_MAX_PER_DISPATCH = int(os.getenv("RESCAN_MAX_PER_DISPATCH", "2000"))
+RESCAN_LEASE_MINUTES = int(os.getenv("RESCAN_LEASE_MINUTES", "30"))
+RESCAN_MAX_ATTEMPTS = int(os.getenv("RESCAN_MAX_ATTEMPTS", "3"))
+RESCAN_RETRY_MINUTES = int(os.getenv("RESCAN_RETRY_MINUTES", "30"))
+RESCAN_WORKERS = int(os.getenv("RESCAN_WORKERS", "2"))
+RESCAN_UPDATE_CHUNK = 500  # rows per UPDATE ... FROM (VALUES ...) statement
+
+_executor: Optional[ThreadPoolExecutor] = None
+_active = 0
+_active_lock = threading.Lock()
+
+
+class RescanStats:
+    """Scheduler lag (claimed_at - due_at) and throughput of this process"""
+
+    def __init__(self, window: int = 1000):
+        self.lags = deque(maxlen=window)  # seconds
+        self.events = deque(maxlen=window)  # (finished_at, urls, trends_updated)
+        self.counters = {
+            "dispatches": 0, "claimed": 0, "urls": 0, "collector_runs": 0,
+            "trends_updated": 0, "retried": 0, "failed": 0, "reclaimed": 0, "follow_ups": 0, "stopped": 0,
+        }
+
+    def to_dict(self) -> dict:
+        lags = sorted(self.lags)
+        hour_ago = time.time() - 3600
+        recent = [event for event in self.events if event[0] >= hour_ago]
+
+        def pct(p):
+            return round(lags[min(int(len(lags) * p), len(lags) - 1)], 1) if lags else None
+
+        return {
+            **self.counters,
+            "lag_s": {"p50": pct(0.5), "p95": pct(0.95), "max": round(lags[-1], 1) if lags else None},
+            "last_hour": {
+                "urls": sum(event[1] for event in recent),
+                "trends_updated": sum(event[2] for event in recent),
+            },
+        }
+
+
+rescan_stats = RescanStats()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=RESCAN_WORKERS, thread_name_prefix="rescan")
+    return _executor
+
+
+async def run_in_rescan_executor(fn, *args):
+    """Run a blocking rescan function off the event loop, on the rescan executor"""
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), _tracked, fn, *args)
+
+
+def _tracked(fn, *args):
+    global _active
+    with _active_lock:
+        _active += 1
+    try:
+        return fn(*args)
+    finally:
+        with _active_lock:
+            _active -= 1
+
+
+def rescans_active() -> bool:
+    return _active > 0
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def schedule_rescans(db: Session, trends: Iterable[Trend], due_at: datetime) -> int:
+    """
+    Queue (or move) one pending rescan per trend and (re)start its adaptive
+    tracking — the user is interested in it again. Caller commits.
+    """
+    rows = []
+    for t in trends:
+        if t.id and t.url:
+            t.tracking_stopped_at = None
+            t.stagnant_scans = 0
+            rows.append({"trend_id": t.id, "user_id": t.user_id, "url": t.url, "due_at": due_at})
+    return _queue(db, rows)
+
+
+def _queue(db: Session, rows: List[dict]) -> int:
+    """Insert pending rescans ({trend_id, user_id, url, due_at}); an existing pending one is moved"""
+    if not rows:
+        return 0
+    created_at = datetime.utcnow()
+    stmt = pg_insert(VideoRescan).values([
+        {**row, "status": "pending", "attempts": 0, "created_at": created_at} for row in rows
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[VideoRescan.trend_id],
+        index_where=text("status = 'pending'"),
+        set_={"due_at": stmt.excluded.due_at, "url": stmt.excluded.url}
+    )
+    db.execute(stmt)
+    return len(rows)
+
+
+def _reclaim_expired(db: Session, now: datetime) -> int:
+    """Rows a dead worker left in "running": back to pending (or failed if re-scheduled meanwhile)"""
+    cutoff = now - timedelta(minutes=RESCAN_LEASE_MINUTES)
+    reclaimed = db.execute(text("""
+        UPDATE video_rescans r SET status = 'pending', started_at = NULL
+        WHERE r.status = 'running' AND r.started_at < :cutoff AND r.attempts < :max_attempts
+          AND NOT EXISTS (
+              SELECT 1 FROM video_rescans p WHERE p.trend_id = r.trend_id AND p.status = 'pending'
+          )
+    """), {"cutoff": cutoff, "max_attempts": RESCAN_MAX_ATTEMPTS}).rowcount or 0
+    db.execute(text("""
+        UPDATE video_rescans SET status = 'failed', finished_at = :now, error = 'lease expired'
+        WHERE status = 'running' AND started_at < :cutoff
+    """), {"cutoff": cutoff, "now": now})
+    return reclaimed
+
+
+def _claim(db: Session, now: datetime, batch_id: str) -> list:
+    due = db.execute(text(
+        "SELECT 1 FROM video_rescans WHERE status = 'pending' AND due_at <= :now LIMIT 1"
+    ), {"now": now}).first()
+    if not due:
+        return []
+    # Per-tier daily budget: a user's rows beyond (budget - claimed in the last 24h) wait
+    budget = "CASE u.subscription_tier::text " + " ".join(
+        f"WHEN '{tier.name}' THEN {limit}" for tier, limit in RESCAN_DAILY_BUDGET.items()
+    ) + " ELSE 0 END"
+    return db.execute(text(f"""
+        WITH used AS (
+            SELECT user_id, COUNT(*) AS n FROM video_rescans
+            WHERE started_at >= :day_ago
+            GROUP BY user_id
+        ), candidates AS (
+            SELECT r.id, r.due_at,
+                   ROW_NUMBER() OVER (PARTITION BY r.user_id ORDER BY r.due_at) AS rn,
+                   {budget} - COALESCE(used.n, 0) AS remaining
+            FROM video_rescans r
+            JOIN users u ON u.id = r.user_id
+            LEFT JOIN used ON used.user_id = r.user_id
+            WHERE r.status = 'pending' AND r.due_at <= :horizon
+        )
+        UPDATE video_rescans SET status = 'running', started_at = :now, attempts = attempts + 1,
+                                 batch_id = :batch_id
+        WHERE id IN (
+            SELECT id FROM video_rescans
+            WHERE id IN (SELECT id FROM candidates WHERE rn <= remaining ORDER BY due_at LIMIT :limit)
+              -- candidates is a snapshot: a row another dispatcher claimed after it was taken
+              -- is no longer pending once its lock is released
+              AND status = 'pending' AND due_at <= :horizon
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, trend_id, url, due_at
+    """), {
+        "now": now,
+        "day_ago": now - timedelta(days=1),
+        "horizon": now + timedelta(minutes=RESCAN_COALESCE_MINUTES),
+        "limit": RESCAN_MAX_PER_DISPATCH,
+        "batch_id": batch_id,
+    }).fetchall()
+
+
+def scrape_urls(urls: List[str]) -> Dict[str, dict]:
+    """{page_key: collector item} for the given post URLs, RESCAN_BATCH_SIZE URLs per actor run"""
+    fresh: Dict[str, dict] = {}
+    for instagram in (False, True):
+        targets = [url for url in urls if ("instagram.com" in url) == instagram]
+        collector = InstagramCollector() if instagram else TikTokCollector()
+        for start in range(0, len(targets), RESCAN_BATCH_SIZE):
+            chunk = targets[start:start + RESCAN_BATCH_SIZE]
+            rescan_stats.counters["collector_runs"] += 1
+            for item in collector.collect(chunk, limit=len(chunk), mode="urls") or []:
+                if instagram:
+                    item = adapt_instagram_to_standard(item)
+                    if not item:
+                        continue
+                url = item.get("postPage") or item.get("webVideoUrl") or item.get("url")
+                if url:
+                    fresh[page_key(url)] = item
+    return fresh
+
+
+def _fresh_stats(item: dict) -> dict:
+    stats = item.get("stats") or {}
+    return {
+        "playCount": int(item.get("views") or stats.get("playCount") or 0),
+        "diggCount": int(item.get("likes") or stats.get("diggCount") or 0),
+        "commentCount": int(item.get("comments") or stats.get("commentCount") or 0),
+        "shareCount": int(item.get("shares") or stats.get("shareCount") or 0),
+        "collectCount": int(item.get("bookmarks") or stats.get("collectCount") or 0),
+    }
+
+
+def apply_fresh_stats(
+    db: Session,
+    urls: List[str],
+    fresh: Dict[str, dict],
+    tracked_ids: Optional[Set[int]] = None
+) -> int:
+    """
+    Fresh stats + re-scored UTS for every Trend (any user) whose URL was
+    scraped: one IN-prefetch, then UPDATE ... FROM (VALUES ...) in chunks of
+    RESCAN_UPDATE_CHUNK rows (one round trip each). Caller commits.
+
+    Trends in tracked_ids (the rescans being executed) get their next rescan
+    queued at the adaptive cadence (rescan_cadence.next_scan), or stop being
+    tracked.
+    """
+    if not urls or not fresh:
+        return 0
+    scorer = TrendScorer()
+    now = datetime.utcnow()
+    rows = db.query(
+        Trend.id, Trend.user_id, Trend.url, Trend.author_followers, Trend.stats, Trend.initial_stats,
+        Trend.created_at, Trend.last_scanned_at, Trend.stagnant_scans
+    ).filter(Trend.url.in_(urls)).all()
+
+    updates, follow_ups = [], []
+    for row in rows:
+        item = fresh.get(page_key(row.url))
+        if item is None:
+            continue
+        new_stats = _fresh_stats(item)
+        # Point A (initial_stats at search time) vs point B (now)
+        history_data = {
+            "play_count": (row.initial_stats or {}).get("playCount", new_stats["playCount"])
+        }
+        uts_score = scorer.calculate_uts(
+            video_data={
+                "views": new_stats["playCount"],
+                "author_followers": row.author_followers,
+                "collect_count": new_stats["collectCount"],
+                "share_count": new_stats["shareCount"]
+            },
+            history_data=history_data,
+            cascade_count=1
+        )
+        cadence = next_scan(
+            prev_views=int((row.stats or {}).get("playCount") or 0),
+            views=new_stats["playCount"],
+            prev_scanned_at=row.last_scanned_at or row.created_at,
+            uts_score=uts_score,
+            stagnant_scans=row.stagnant_scans or 0,
+            found_at=row.created_at,
+            now=now
+        )
+        tracked = tracked_ids is not None and row.id in tracked_ids
+        stopped = tracked and cadence.next_due is None
+        if tracked and not stopped:
+            follow_ups.append({"trend_id": row.id, "user_id": row.user_id, "url": row.url, "due_at": cadence.next_due})
+        updates.append((row.id, new_stats, uts_score, cadence.growth, cadence.stagnant_scans, stopped))
+
+    for start in range(0, len(updates), RESCAN_UPDATE_CHUNK):
+        chunk = updates[start:start + RESCAN_UPDATE_CHUNK]
+        params = {"now": now}
+        values = []
+        for i, (trend_id, new_stats, uts_score, growth, stagnant, stopped) in enumerate(chunk):
+            values.append(
+                f"(CAST(:id{i} AS integer), CAST(:stats{i} AS jsonb), CAST(:uts{i} AS double precision), "
+                f"CAST(:growth{i} AS double precision), CAST(:stagnant{i} AS integer), CAST(:stopped{i} AS boolean))"
+            )
+            params.update({
+                f"id{i}": trend_id, f"stats{i}": json.dumps(new_stats), f"uts{i}": uts_score,
+                f"growth{i}": growth, f"stagnant{i}": stagnant, f"stopped{i}": stopped,
+            })
+        db.execute(text(f"""
+            UPDATE trends AS t
+            SET stats = v.stats, uts_score = v.uts_score, last_scanned_at = :now,
+                scan_count = t.scan_count + 1, views_per_hour = v.growth, stagnant_scans = v.stagnant,
+                tracking_stopped_at = CASE WHEN v.stopped THEN :now ELSE t.tracking_stopped_at END
+            FROM (VALUES {", ".join(values)}) AS v(id, stats, uts_score, growth, stagnant, stopped)
+            WHERE t.id = v.id
+        """), params)
+
+    if follow_ups:
+        _queue(db, follow_ups)
+        rescan_stats.counters["follow_ups"] += len(follow_ups)
+    rescan_stats.counters["stopped"] += sum(1 for update in updates if update[5])
+    return len(updates)
+
+
+def _finish(db: Session, claimed: list, fresh: Dict[str, dict], now: datetime) -> None:
+    done = [row.id for row in claimed if page_key(row.url) in fresh]
+    missing = [row.id for row in claimed if page_key(row.url) not in fresh]
+    if done:
+        db.execute(text(
+            "UPDATE video_rescans SET status = 'done', finished_at = :now, error = NULL WHERE id = ANY(:ids)"
+        ), {"now": now, "ids": done})
+    if missing:
+        # Retry later unless out of attempts (or the trend was re-scheduled meanwhile)
+        result = db.execute(text("""
+            UPDATE video_rescans r SET status = 'pending', started_at = NULL, due_at = :retry_at,
+                                       error = 'not returned by collector'
+            WHERE r.id = ANY(:ids) AND r.attempts < :max_attempts
+              AND NOT EXISTS (
+                  SELECT 1 FROM video_rescans p WHERE p.trend_id = r.trend_id AND p.status = 'pending'
+              )
+        """), {"ids": missing, "retry_at": now + timedelta(minutes=RESCAN_RETRY_MINUTES),
+               "max_attempts": RESCAN_MAX_ATTEMPTS})
+        rescan_stats.counters["retried"] += result.rowcount or 0
+        result = db.execute(text("""
+            UPDATE video_rescans SET status = 'failed', finished_at = :now,
+                                     error = 'not returned by collector'
+            WHERE id = ANY(:ids) AND status = 'running'
+        """), {"ids": missing, "now": now})
+        rescan_stats.counters["failed"] += result.rowcount or 0
+
+
+def dispatch_due(db: Optional[Session] = None) -> dict:
+    """One dispatcher tick: claim -> dedupe -> scrape -> fan out. Blocking (run_in_rescan_executor)."""
+    own_session = db is None
+    db = db or SessionLocal()
+    batch_id = uuid.uuid4().hex[:16]
+    try:
+        now = datetime.utcnow()
+        reclaimed = _reclaim_expired(db, now)
+        claimed = _claim(db, now, batch_id)
+        db.commit()
+        rescan_stats.counters["dispatches"] += 1
+        rescan_stats.counters["reclaimed"] += reclaimed
+        if not claimed:
+            return {"claimed": 0}
+
+        for row in claimed:
+            if row.due_at <= now:
+                rescan_stats.lags.append((now - row.due_at).total_seconds())
+        urls = list(dict.fromkeys(row.url for row in claimed))
+        rescan_stats.counters["claimed"] += len(claimed)
+        rescan_stats.counters["urls"] += len(urls)
+        logger.info(f"⏰ Rescan batch {batch_id}: {len(claimed)} rescans -> {len(urls)} distinct URLs")
+
+        try:
+            fresh = scrape_urls(urls)
+        except Exception as e:
+            logger.error(f"Rescan scrape failed (batch {batch_id}): {e}")
+            fresh = {}
+
+        updated = apply_fresh_stats(db, urls, fresh, tracked_ids={row.trend_id for row in claimed})
+        _finish(db, claimed, fresh, datetime.utcnow())
+        db.commit()
+
+        rescan_stats.counters["trends_updated"] += updated
+        rescan_stats.events.append((time.time(), len(urls), updated))
+        logger.info(f"✅ Rescan batch {batch_id}: {len(fresh)}/{len(urls)} URLs scraped, {updated} trends updated")
+        return {"claimed": len(claimed), "urls": len(urls), "scraped": len(fresh), "trends_updated": updated}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if own_session:
+            db.close()
+
+
+def queue_stats(db: Session) -> dict:
+    row = db.execute(text("""
+        SELECT
+            COUNT(*) FILTER (WHERE status = 'pending') AS pending,
+            COUNT(*) FILTER (WHERE status = 'pending' AND due_at <= NOW() AT TIME ZONE 'utc') AS overdue,
+            COUNT(*) FILTER (WHERE status = 'running') AS running,
+            MIN(due_at) FILTER (WHERE status = 'pending') AS next_due
+        FROM video_rescans
+    """)).first()
+    oldest_overdue_s = None
+    if row.next_due and row.next_due <= datetime.utcnow():
+        oldest_overdue_s = int((datetime.utcnow() - row.next_due).total_seconds())
+    return {
+        "pending": row.pending,
+        "overdue": row.overdue,
+        "running": row.running,
+        "oldest_overdue_s": oldest_overdue_s,
+        **rescan_stats.to_dict(),
+    }
@@ -1,77 +1,191 @@
 # backend/app/services/scheduler.py
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from sqlalchemy.orm import Session
-from datetime import datetime
 import asyncio
 
 from ..core.database import SessionLocal
-from ..db.models import Trend
-from ..services.collector import TikTokCollector
-from ..services.scorer import TrendScorer 
+from ..services.cluster_engine import RECLUSTER_INTERVAL_HOURS, recluster_all
+from ..services.image_index import sweep_orphans
+from ..services.url_refresher import URL_REFRESH_INTERVAL_MINUTES, url_refresher
+from ..services.rescan_dispatcher import (
+    RESCAN_DISPATCH_INTERVAL_SECONDS, dispatch_due, run_in_rescan_executor
+)
+from ..services.leader import LEADER_ELECTION, LeaderElector
+from ..services.job_queue import queue_mode
+from ..services.competitor_refresher import COMPETITOR_REFRESH_INTERVAL_MINUTES, competitor_refresher
+from ..services.proxy_cache import PROXY_CACHE_SWEEP_SECONDS, proxy_cache
+from ..services.video_chunk_cache import VIDEO_CACHE_SWEEP_SECONDS, video_chunk_cache
 
 scheduler = AsyncIOScheduler()
 
-async def rescan_videos_task(video_urls: list, batch_id: str):
-    print(f"⏰ [AUTO-RESCAN] Начало задачи сверки (Batch: {batch_id})")
-    
+# Cluster-wide jobs: only the elected leader runs them (other workers/nodes keep them paused).
+# refresh_expiring_urls stays on every worker — each one tracks the items its own users viewed;
+# url_refresh_claims makes sure a post due on several workers is scraped by only one.
+# The proxy cache sweeps run on every worker too: the cache dirs are local to each node.
+LEADER_JOBS = ("recluster_visual_clusters", "sweep_orphan_images", "dispatch_rescans", "refresh_competitors")
+
+def _resume_leader_jobs():
+    for job_id in LEADER_JOBS:
+        if scheduler.get_job(job_id):
+            scheduler.resume_job(job_id)
+    print("👑 [LEADER] Этот процесс — лидер, плановые задачи запущены.")
+
+def _pause_leader_jobs():
+    for job_id in LEADER_JOBS:
+        if scheduler.get_job(job_id):
+            scheduler.pause_job(job_id)
+    print("💤 [LEADER] Лидерство потеряно, плановые задачи на паузе (standby).")
+
+leader = LeaderElector(on_elected=_resume_leader_jobs, on_demoted=_pause_leader_jobs)
+
+def still_leader() -> bool:
+    """Checked by long leader jobs between batches: pausing a job doesn't stop a run in progress"""
+    return not LEADER_ELECTION or leader.is_leader
+
+def _recluster_visual_clusters():
     db = SessionLocal()
-    scorer = TrendScorer() 
-    
     try:
-        collector = TikTokCollector()
-        # Собираем самые свежие данные (Точка Б)
-        raw_items = collector.collect(video_urls, limit=len(video_urls), mode="urls")
-        
-        if not raw_items:
-            print("⚠️ Rescan: Нет новых данных для сверки.")
-            return
-
-        for item in raw_items:
-            url = item.get("postPage") or item.get("webVideoUrl") or item.get("url")
-            video = db.query(Trend).filter(Trend.url == url).first()
-            
-            if video:
-                stats = item.get("stats") or {}
-                fresh_views = int(item.get("views") or stats.get("playCount") or 0)
-                
-                new_stats = {
-                    "playCount": fresh_views,
-                    "diggCount": int(item.get("likes") or stats.get("diggCount") or 0),
-                    "commentCount": int(item.get("comments") or stats.get("commentCount") or 0),
-                    "shareCount": int(item.get("shares") or stats.get("shareCount") or 0),
-                    "collectCount": int(item.get("bookmarks") or stats.get("collectCount") or 0)
-                }
-
-                # --- ✅ СВЕРКА: Новые данные vs Временные старые данные (Point A) ---
-                history_data = {
-                    "play_count": video.initial_stats.get("playCount", 0) if video.initial_stats else fresh_views
-                }
-
-                # Пересчитываем балл UTS на базе динамики роста между Точкой А и Точкой Б
-                video.uts_score = scorer.calculate_uts(
-                    video_data={
-                        "views": fresh_views,
-                        "author_followers": video.author_followers,
-                        "collect_count": new_stats["collectCount"],
-                        "share_count": new_stats["shareCount"]
-                    },
-                    history_data=history_data,
-                    cascade_count=1
-                )
-                
-                video.stats = new_stats
-                video.last_scanned_at = datetime.utcnow()
-                
-        db.commit()
-        print(f"✅ [AUTO-RESCAN] Сверка завершена. Статистика и UTS-баллы обновлены.")
-        
+        return recluster_all(db, keep_going=still_leader)
+    finally:
+        db.close()
+
+async def recluster_visual_clusters_task():
+    """Offline full re-clustering: fixes order-dependent online assignments, keeps cluster ids"""
+    print("🧩 [RECLUSTER] Полная перекластеризация визуальных групп...")
+    try:
+        # DBSCAN + SQL — в потоке, не блокируем event loop
+        totals = await asyncio.to_thread(_recluster_visual_clusters)
+        print(f"✅ [RECLUSTER] Пользователей: {totals['users']}, видео: {totals['rows']}, "
+              f"перемещено: {totals['moved']}, ошибок: {totals['failed']}")
     except Exception as e:
-        print(f"❌ Ошибка рескана: {e}")
-        db.rollback()
+        print(f"❌ Ошибка перекластеризации: {e}")
+
+def _sweep_orphan_images():
+    db = SessionLocal()
+    try:
+        return sweep_orphans(db, keep_going=still_leader)
     finally:
         db.close()
 
+async def sweep_orphan_images_task():
+    """Delete stored thumbnails/avatars nothing references any more"""
+    try:
+        result = await asyncio.to_thread(_sweep_orphan_images)
+        print(f"🧹 [SWEEP] Удалено неиспользуемых изображений: {result.get('deleted', 0)}")
+    except Exception as e:
+        print(f"❌ Ошибка очистки изображений: {e}")
+
+async def refresh_expiring_urls_task():
+    """Re-scrape viewed videos whose signed CDN URLs expire soon"""
+    try:
+        result = await url_refresher.refresh_due()
+        if result.get("due"):
+            print(f"🔗 [URL-REFRESH] Обновлено ссылок: {result['refreshed']} из {result['due']}")
+    except Exception as e:
+        print(f"❌ Ошибка обновления ссылок: {e}")
+
+async def dispatch_rescans_task():
+    """Due rescans from video_rescans: deduplicated across users, batched collector runs"""
+    try:
+        result = await run_in_rescan_executor(dispatch_due)
+        if result.get("claimed"):
+            print(f"⏰ [AUTO-RESCAN] Рескан: {result['claimed']} задач, {result['urls']} уникальных URL, "
+                  f"обновлено трендов: {result['trends_updated']}")
+    except Exception as e:
+        print(f"❌ Ошибка рескана: {e}")
+
+async def refresh_competitors_task():
+    """Fleet refresh of tracked competitors: one scrape per profile for all tenants"""
+    try:
+        result = await asyncio.to_thread(competitor_refresher.refresh_due, still_leader)
+        if result.get("due"):
+            print(f"👥 [COMPETITORS] Обновлено профилей: {result['refreshed']} из {result['due']}, "
+                  f"строк конкурентов: {result['rows_updated']}")
+    except Exception as e:
+        print(f"❌ Ошибка обновления конкурентов: {e}")
+
+async def sweep_proxy_cache_task():
+    """Shared disk budget of the image proxy cache (all workers of this node write to it)"""
+    try:
+        result = await proxy_cache.sweep()
+        if result.get("evicted"):
+            print(f"🧹 [PROXY-CACHE] Удалено файлов: {result['evicted']}, на диске: {result['disk_mb']} MB")
+    except Exception as e:
+        print(f"❌ Ошибка очистки кэша прокси: {e}")
+
+async def sweep_video_cache_task():
+    """Shared disk budget of the video chunk cache"""
+    try:
+        result = await video_chunk_cache.sweep()
+        if result.get("evicted"):
+            print(f"🧹 [VIDEO-CACHE] Удалено чанков: {result['evicted']}, на диске: {result['cached_mb']} MB")
+    except Exception as e:
+        print(f"❌ Ошибка очистки видео-кэша: {e}")
+
 def start_scheduler():
     if not scheduler.running:
+        scheduler.add_job(
+            recluster_visual_clusters_task, 'interval',
+            hours=RECLUSTER_INTERVAL_HOURS,
+            id="recluster_visual_clusters",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        scheduler.add_job(
+            sweep_orphan_images_task, 'interval',
+            hours=24,
+            id="sweep_orphan_images",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        scheduler.add_job(
+            refresh_expiring_urls_task, 'interval',
+            minutes=URL_REFRESH_INTERVAL_MINUTES,
+            id="refresh_expiring_urls",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        scheduler.add_job(
+            refresh_competitors_task, 'interval',
+            minutes=COMPETITOR_REFRESH_INTERVAL_MINUTES,
+            id="refresh_competitors",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        scheduler.add_job(
+            sweep_proxy_cache_task, 'interval',
+            seconds=PROXY_CACHE_SWEEP_SECONDS,
+            id="sweep_proxy_cache",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        scheduler.add_job(
+            sweep_video_cache_task, 'interval',
+            seconds=VIDEO_CACHE_SWEEP_SECONDS,
+            id="sweep_video_cache",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        if not queue_mode():
+            # PIPELINE_MODE=queue: pipeline workers (python -m app.worker) dispatch rescans
+            scheduler.add_job(
+                dispatch_rescans_task, 'interval',
+                seconds=RESCAN_DISPATCH_INTERVAL_SECONDS,
+                id="dispatch_rescans",
+                replace_existing=True,
+                coalesce=True,
+                max_instances=1
+            )
         scheduler.start()
+        if LEADER_ELECTION:
+            # Standby until elected (paused before the loop gets to run any job)
+            for job_id in LEADER_JOBS:
+                if scheduler.get_job(job_id):
+                    scheduler.pause_job(job_id)
+            leader.start()
         print("⏳ Background Scheduler успешно запущен.")
\ No newline at end of file
@@ -7,25 +7,21 @@ Videos use direct URLs from TikTok/Instagram CDN (no storage needed).
 import os
 import logging
 import requests
-from typing import Optional, Tuple
-from io import BytesIO
+from typing import Dict, Optional, Tuple
 from supabase import create_client, Client
-from datetime import datetime
-import hashlib
 from dotenv import load_dotenv
-from PIL import Image
+
+from .image_decode import HEIF_SUPPORTED, make_renditions, to_jpeg
+from .image_index import StoredRef, content_hash, content_path, image_index, rendition_path
 
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# Register HEIC/HEIF support for Pillow (TikTok CDN sometimes returns HEIC)
-try:
-    from pillow_heif import register_heif_opener
-    register_heif_opener()
+if HEIF_SUPPORTED:
     logger.info("✅ HEIC/HEIF support registered via pillow-heif")
-except ImportError:
+else:
     logger.warning("⚠️ pillow-heif not installed — HEIC images won't be converted")
 
 # Initialize Supabase client lazily (don't crash at import if env vars missing)
@@ -49,6 +45,13 @@ def _get_supabase() -> Optional[Client]:
 # Storage bucket name
 IMAGES_BUCKET = "rizko-images"
 
+# Browser-like headers for CDN downloads (avoid 403)
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Referer': 'https://www.tiktok.com/',
+    'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
+}
+
 
 class SupabaseStorage:
     """Helper for uploading images to Supabase Storage"""
@@ -58,19 +61,11 @@ class SupabaseStorage:
     # Formats browsers support natively — keep as-is
     SUPPORTED_FORMATS = {'image/jpeg', 'image/png', 'image/webp', 'image/gif', 'image/avif', 'image/svg+xml'}
 
-    @staticmethod
-    def _generate_filename(url: str, prefix: str = "image") -> str:
-        """Generate unique filename from URL hash"""
-        url_hash = hashlib.md5(url.encode()).hexdigest()[:12]
-        timestamp = datetime.now().strftime("%Y%m%d")
-        extension = "jpg"  # Default to jpg, we'll convert images
-
-        return f"{prefix}/{timestamp}_{url_hash}.{extension}"
-
     @staticmethod
     def _convert_to_jpeg(image_data: bytes, content_type: str) -> Tuple[bytes, str]:
         """
         Convert unsupported image formats (HEIC, HEIF, TIFF, etc.) to JPEG.
+        Heavy codecs are decoded in the image_decode process pool.
         Returns (image_bytes, content_type).
         """
         ct = content_type.lower().strip()
@@ -81,16 +76,7 @@ class SupabaseStorage:
 
         # Convert unsupported formats to JPEG via Pillow
         try:
-            img = Image.open(BytesIO(image_data))
-            # Convert RGBA/P modes to RGB (JPEG doesn't support alpha)
-            if img.mode in ('RGBA', 'P', 'LA'):
-                img = img.convert('RGB')
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-
-            output = BytesIO()
-            img.save(output, format='JPEG', quality=85, optimize=True)
-            converted = output.getvalue()
+            converted, _ = to_jpeg(image_data, ct)
             logger.info(f"🔄 Converted {ct} → image/jpeg ({len(image_data)} → {len(converted)} bytes)")
             return converted, 'image/jpeg'
         except Exception as e:
@@ -98,31 +84,67 @@ class SupabaseStorage:
             return image_data, ct
 
     @staticmethod
-    def upload_from_url(
+    def _upload_object(client: Client, path: str, data: bytes, content_type: str) -> str:
+        """Upload one content-addressed object, return its public URL"""
+        client.storage.from_(IMAGES_BUCKET).upload(
+            path=path,
+            file=data,
+            file_options={
+                "content-type": content_type,
+                "cache-control": "31536000",  # content-addressed: never changes
+                "upsert": "true"  # Overwrite if exists
+            }
+        )
+        return client.storage.from_(IMAGES_BUCKET).get_public_url(path)
+
+    @staticmethod
+    def _upload_renditions(client: Client, image_data: bytes, digest: str, folder: str) -> Optional[dict]:
+        """
+        Encode + upload the fixed-width renditions (see image_decode).
+        Returns {"webp": {"240": url, ...}, "avif": {...}, "jpeg": {"720": url}},
+        or None if rendering/uploading failed (the main image is still usable).
+        """
+        result: dict = {}
+        try:
+            for name, width, content_type, data in make_renditions(image_data):
+                path = rendition_path(digest, folder, width, content_type)
+                url = SupabaseStorage._upload_object(client, path, data, content_type)
+                result.setdefault(name, {})[str(width)] = url
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to store thumbnail renditions: {e}")
+            return None
+        return result
+
+    @staticmethod
+    def ingest_from_url(
         image_url: str,
         folder: str = "avatars",
-        max_size_mb: int = 5
-    ) -> Optional[str]:
+        max_size_mb: int = 5,
+        with_renditions: bool = False
+    ) -> Optional[StoredRef]:
         """
         Download image from URL and upload to Supabase Storage.
         Automatically converts HEIC/HEIF/TIFF to JPEG for browser compatibility.
+        Already stored images (same source URL or same bytes, see image_index)
+        are not downloaded/uploaded again.
 
         Args:
             image_url: URL of the image to download
             folder: Folder in bucket (avatars, thumbnails, etc)
             max_size_mb: Maximum file size in MB
+            with_renditions: Also store WebP/AVIF/JPEG renditions (thumbnails)
 
         Returns:
-            Public URL of uploaded image, or None if failed
+            StoredRef (public URL + renditions map), or None if failed
         """
         try:
+            # Same source already stored -> no network at all
+            stored_ref = image_index.lookup_source(image_url)
+            if stored_ref and (stored_ref.renditions or not with_renditions):
+                return stored_ref
+
             # Download image with proper headers to avoid 403
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Referer': 'https://www.tiktok.com/',
-                'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
-            }
-            response = requests.get(image_url, timeout=10, stream=True, headers=headers)
+            response = requests.get(image_url, timeout=10, stream=True, headers=DOWNLOAD_HEADERS)
             response.raise_for_status()
 
             # Check content length
@@ -131,36 +153,40 @@ class SupabaseStorage:
                 logger.warning(f"Image too large: {content_length / 1024 / 1024:.2f}MB")
                 return None
 
-            # Convert unsupported formats (HEIC, HEIF, etc.) to JPEG
-            raw_content_type = response.headers.get("content-type", "image/jpeg")
-            image_bytes, final_content_type = SupabaseStorage._convert_to_jpeg(
-                response.content, raw_content_type
-            )
-
-            # Generate filename
-            filename = SupabaseStorage._generate_filename(image_url, folder)
-
             client = _get_supabase()
             if not client:
                 logger.warning("Supabase not configured — skipping upload")
                 return None
 
-            # Upload to Supabase Storage
-            result = client.storage.from_(IMAGES_BUCKET).upload(
-                path=filename,
-                file=image_bytes,
-                file_options={
-                    "content-type": final_content_type,
-                    "cache-control": "3600",
-                    "upsert": "true"  # Overwrite if exists
-                }
+            # Same bytes already stored under another URL -> reuse the object
+            digest = content_hash(response.content)
+            stored = image_index.lookup_content(digest)
+            if stored is not None:
+                renditions = stored.renditions
+                if with_renditions and not renditions:
+                    renditions = SupabaseStorage._upload_renditions(client, response.content, digest, folder)
+                return image_index.record(
+                    image_url, digest, stored.path, stored.public_url, stored.content_type, stored.size_bytes,
+                    renditions
+                )
+
+            # Convert unsupported formats (HEIC, HEIF, etc.) to JPEG
+            raw_content_type = response.headers.get("content-type", "image/jpeg")
+            image_bytes, final_content_type = SupabaseStorage._convert_to_jpeg(
+                response.content, raw_content_type
             )
 
-            # Get public URL
-            public_url = client.storage.from_(IMAGES_BUCKET).get_public_url(filename)
+            # Content-addressed filename: the same image is one object
+            filename = content_path(digest, folder, final_content_type)
+            public_url = SupabaseStorage._upload_object(client, filename, image_bytes, final_content_type)
+            renditions = None
+            if with_renditions:
+                renditions = SupabaseStorage._upload_renditions(client, response.content, digest, folder)
 
             logger.info(f"✅ Uploaded image to Supabase: {filename} ({final_content_type})")
-            return public_url
+            return image_index.record(
+                image_url, digest, filename, public_url, final_content_type, len(image_bytes), renditions
+            )
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Failed to download image from {image_url}: {e}")
@@ -169,6 +195,16 @@ class SupabaseStorage:
             logger.error(f"Failed to upload image to Supabase: {e}")
             return None
 
+    @staticmethod
+    def upload_from_url(
+        image_url: str,
+        folder: str = "avatars",
+        max_size_mb: int = 5
+    ) -> Optional[str]:
+        """ingest_from_url() without renditions: public URL of the stored image, or None"""
+        stored_ref = SupabaseStorage.ingest_from_url(image_url, folder, max_size_mb)
+        return stored_ref.public_url if stored_ref else None
+
     @staticmethod
     def upload_avatar(avatar_url: str) -> Optional[str]:
         """Upload user/competitor avatar to Supabase"""
@@ -179,6 +215,24 @@ class SupabaseStorage:
         """Upload video thumbnail to Supabase"""
         return SupabaseStorage.upload_from_url(thumbnail_url, folder="thumbnails")
 
+    @staticmethod
+    def ingest_thumbnail(thumbnail_url: str) -> Optional[StoredRef]:
+        """Upload video thumbnail + its renditions to Supabase"""
+        return SupabaseStorage.ingest_from_url(thumbnail_url, folder="thumbnails", with_renditions=True)
+
+    @staticmethod
+    def srcset(renditions: Optional[dict]) -> Optional[Dict[str, str]]:
+        """
+        Renditions map -> {"avif": "url 240w, url 480w", "webp": ..., "jpeg": ...}
+        (one srcset per <source type>; None if there are no renditions)
+        """
+        if not renditions:
+            return None
+        return {
+            name: ", ".join(f"{url} {width}w" for width, url in sorted(by_width.items(), key=lambda item: int(item[0])))
+            for name, by_width in renditions.items()
+        }
+
     @staticmethod
     def delete_image(file_path: str) -> bool:
         """Delete image from Supabase Storage"""
@@ -193,6 +247,11 @@ class SupabaseStorage:
             logger.error(f"Failed to delete image: {e}")
             return False
 
+    @staticmethod
+    def is_stored_url(url: Optional[str]) -> bool:
+        """True if the URL already points at our bucket (no mirroring needed)"""
+        return SupabaseStorage.extract_path_from_url(url) is not None
+
     @staticmethod
     def extract_path_from_url(public_url: str) -> Optional[str]:
         """
@@ -213,6 +272,8 @@ class SupabaseStorage:
     def cleanup_competitor(avatar_url: str, recent_videos: list) -> int:
         """
         Delete all Supabase images for a competitor (avatar + video thumbnails).
+        Content-addressed images may be shared with other trends/competitors:
+        those are left to the orphan sweeper (image_index.sweep_orphans).
         Returns count of deleted files.
         """
         deleted = 0
@@ -231,6 +292,13 @@ class SupabaseStorage:
                 if path and path not in paths_to_delete:
                     paths_to_delete.append(path)
 
+        try:
+            shared = image_index.indexed_paths(paths_to_delete)
+            paths_to_delete = [path for path in paths_to_delete if path not in shared]
+        except Exception as e:
+            logger.warning(f"Image index unavailable, keeping images for the sweeper: {e}")
+            paths_to_delete = []
+
         if not paths_to_delete:
             return 0
 
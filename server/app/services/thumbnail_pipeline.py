@@ -0,0 +1,327 @@
+"""
+Thumbnail Pipeline
+Mirrors TikTok/Instagram covers into Supabase Storage in the background.
+
+Search responses return the CDN cover URLs immediately plus a job handle;
+covers are downloaded, converted (if the browser can't display them) and
+uploaded with bounded concurrency over one shared connection pool, together
+with their WebP/AVIF/JPEG renditions (image_decode.render_renditions), and
+the stored URLs are patched into trends.cover_url / cover_renditions when
+the job finishes.
+Search latency no longer grows with the number of results.
+
+Covers that fail to mirror are patched to ApifyStorage.fix_tiktok_url
+(unsigned CDN URL, works ~1-3 days) — the same fallback as before.
+
+Jobs are kept in memory for THUMBNAIL_JOB_TTL seconds for the status
+endpoint; the database is the source of truth once a job is done.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import text
+
+from ..core.database import SessionLocal
+from .apify_storage import ApifyStorage
+from .image_decode import make_renditions, to_jpeg
+from .image_index import StoredRef, content_hash, content_path, image_index, rendition_path
+from .storage import DOWNLOAD_HEADERS, IMAGES_BUCKET, SupabaseStorage
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_CONCURRENCY = int(os.getenv("THUMBNAIL_CONCURRENCY", "8"))
+THUMBNAIL_TIMEOUT = float(os.getenv("THUMBNAIL_TIMEOUT", "10"))
+THUMBNAIL_JOB_TTL = int(os.getenv("THUMBNAIL_JOB_TTL", "3600"))
+MAX_THUMBNAIL_BYTES = 5 * 1024 * 1024
+MAX_JOBS = 1000
+
+
+class ThumbnailJob:
+    """One batch of covers (one search / save) and its results"""
+
+    def __init__(self, user_id: int, items: List[Tuple[int, str]]):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.items = items
+        self.results: Dict[int, str] = {}  # trend_id -> stored (or fallback) cover URL
+        self.renditions: Dict[int, dict] = {}  # trend_id -> renditions map (stored covers only)
+        self.uploaded = 0
+        self.reused = 0
+        self.failed = 0
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def status(self) -> str:
+        return "done" if self.finished_at else "running"
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": len(self.items),
+            "uploaded": self.uploaded,
+            "reused": self.reused,
+            "failed": self.failed,
+            "cover_urls": {str(trend_id): url for trend_id, url in self.results.items()},
+            "cover_srcsets": {
+                str(trend_id): SupabaseStorage.srcset(renditions) for trend_id, renditions in self.renditions.items()
+            },
+        }
+
+
+def _patch_cover_urls(cover_urls: Dict[int, str], renditions: Dict[int, dict]) -> int:
+    """One UPDATE ... FROM (VALUES ...) for the whole job"""
+    if not cover_urls:
+        return 0
+    params = {}
+    values = []
+    for n, (trend_id, url) in enumerate(cover_urls.items()):
+        params[f"id{n}"] = trend_id
+        params[f"url{n}"] = url
+        params[f"r{n}"] = json.dumps(renditions[trend_id]) if renditions.get(trend_id) else None
+        values.append(f"(CAST(:id{n} AS INTEGER), CAST(:url{n} AS TEXT), CAST(:r{n} AS TEXT))")
+
+    db = SessionLocal()
+    try:
+        result = db.execute(text(
+            f"UPDATE trends SET cover_url = v.url, cover_renditions = CAST(v.renditions AS JSONB) "
+            f"FROM (VALUES {', '.join(values)}) AS v(id, url, renditions) "
+            f"WHERE trends.id = v.id"
+        ), params)
+        db.commit()
+        return result.rowcount or 0
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class ThumbnailPipeline:
+    """Runs on the event loop; submit() from sync handlers via anyio.from_thread.run_sync"""
+
+    def __init__(self, concurrency: int = THUMBNAIL_CONCURRENCY):
+        self.concurrency = concurrency
+        self.jobs: "OrderedDict[str, ThumbnailJob]" = OrderedDict()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._tasks: set = set()
+        self.counters = {"uploaded": 0, "reused": 0, "failed": 0, "deduplicated": 0}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(THUMBNAIL_TIMEOUT),
+                limits=httpx.Limits(max_connections=self.concurrency * 2, max_keepalive_connections=self.concurrency),
+                follow_redirects=True
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def submit(self, user_id: int, items: List[Tuple[int, str]]) -> Optional[ThumbnailJob]:
+        """
+        Start mirroring [(trend_id, cdn_cover_url)]. Must run on the event loop.
+        Returns the job (None if there is nothing to mirror).
+        """
+        items = [(trend_id, url) for trend_id, url in items if url and not SupabaseStorage.is_stored_url(url)]
+        if not items:
+            return None
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        self._evict()
+        job = ThumbnailJob(user_id, items)
+        self.jobs[job.id] = job
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def process(self, user_id: int, items: List[Tuple[int, str]]) -> Optional[ThumbnailJob]:
+        """Like submit(), but runs the job to completion (pipeline workers)"""
+        items = [(trend_id, url) for trend_id, url in items if url and not SupabaseStorage.is_stored_url(url)]
+        if not items:
+            return None
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        job = ThumbnailJob(user_id, items)
+        await self._run(job)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[ThumbnailJob]:
+        return self.jobs.get(job_id)
+
+    def _evict(self) -> None:
+        now = time.time()
+        for job_id in list(self.jobs):
+            job = self.jobs[job_id]
+            if len(self.jobs) <= MAX_JOBS and (not job.finished_at or now - job.finished_at < THUMBNAIL_JOB_TTL):
+                break
+            del self.jobs[job_id]
+
+    async def _run(self, job: ThumbnailJob) -> None:
+        started = time.perf_counter()
+        # Covers stored before (same canonical URL): no download, no upload.
+        # Stored before renditions existed -> mirrored again (content hit, renditions only)
+        known = await asyncio.to_thread(image_index.lookup_sources, [url for _, url in job.items])
+        known = {url: ref for url, ref in known.items() if ref.renditions}
+        for trend_id, url in job.items:
+            if url in known:
+                job.reused += 1
+                job.results[trend_id] = known[url].public_url
+                job.renditions[trend_id] = known[url].renditions
+        pending = [(trend_id, url) for trend_id, url in job.items if url not in known]
+        stored = await asyncio.gather(*(self.mirror(url) for _, url in pending))
+
+        for (trend_id, url), stored_ref in zip(pending, stored):
+            if stored_ref:
+                job.uploaded += 1
+                job.results[trend_id] = stored_ref.public_url
+                if stored_ref.renditions:
+                    job.renditions[trend_id] = stored_ref.renditions
+            else:
+                job.failed += 1
+                fallback = ApifyStorage.fix_tiktok_url(url)
+                if fallback != url:
+                    job.results[trend_id] = fallback
+
+        try:
+            await asyncio.to_thread(_patch_cover_urls, job.results, job.renditions)
+        except Exception as e:
+            logger.error(f"Patching thumbnail URLs failed (job {job.id}): {e}")
+        job.finished_at = time.time()
+        logger.info(
+            f"🖼️ Thumbnails job {job.id[:8]}: {job.uploaded} uploaded, {job.reused} reused, {job.failed} failed "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+
+    async def mirror(self, url: str) -> Optional[StoredRef]:
+        """CDN URL -> stored cover + renditions (None on failure). Concurrent calls for one URL share the work."""
+        inflight = self._inflight.get(url)
+        if inflight is not None:
+            self.counters["deduplicated"] += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        try:
+            async with self._semaphore:
+                result = await self._mirror(url)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_result(None)
+            self.counters["failed"] += 1
+            logger.warning(f"⚠️ Thumbnail mirror failed for {url[:80]}: {e}")
+            return None
+        finally:
+            del self._inflight[url]
+
+    async def _mirror(self, url: str) -> Optional[StoredRef]:
+        if not os.getenv("SUPABASE_URL") or not os.getenv("SUPABASE_KEY"):
+            return None
+
+        async with self.client.stream("GET", url, headers=DOWNLOAD_HEADERS) as response:
+            response.raise_for_status()
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > MAX_THUMBNAIL_BYTES:
+                    logger.warning(f"Thumbnail too large, skipped: {url[:80]}")
+                    self.counters["failed"] += 1
+                    return None
+                chunks.append(chunk)
+            content_type = response.headers.get("content-type", "image/jpeg").split(";")[0].strip().lower()
+        data = b"".join(chunks)
+
+        # Same bytes already stored under another URL -> reuse the object
+        digest = content_hash(data)
+        stored = await asyncio.to_thread(image_index.lookup_content, digest)
+        if stored is not None:
+            renditions = stored.renditions or await self._upload_renditions(data, digest)
+            self.counters["reused"] += 1
+            return await asyncio.to_thread(
+                image_index.record, url, digest, stored.path, stored.public_url, stored.content_type,
+                stored.size_bytes, renditions
+            )
+
+        source = data
+        if content_type not in SupabaseStorage.SUPPORTED_FORMATS:
+            data, content_type = await asyncio.to_thread(to_jpeg, data, content_type)
+
+        path = content_path(digest, "thumbnails", content_type)
+        public_url = await self._upload(path, data, content_type)
+        if public_url is None:
+            self.counters["failed"] += 1
+            return None
+        renditions = await self._upload_renditions(source, digest)
+
+        self.counters["uploaded"] += 1
+        return await asyncio.to_thread(
+            image_index.record, url, digest, path, public_url, content_type, len(data), renditions
+        )
+
+    async def _upload_renditions(self, data: bytes, digest: str) -> Optional[dict]:
+        """Encode (process pool) + upload the renditions; None if any of them failed"""
+        try:
+            renditions = await asyncio.to_thread(make_renditions, data)
+        except Exception as e:
+            logger.warning(f"⚠️ Thumbnail renditions failed: {e}")
+            return None
+        urls = await asyncio.gather(*(
+            self._upload(rendition_path(digest, "thumbnails", width, content_type), rendition, content_type)
+            for _, width, content_type, rendition in renditions
+        ))
+        if not all(urls):
+            return None
+        result: dict = {}
+        for (name, width, _, _), public_url in zip(renditions, urls):
+            result.setdefault(name, {})[str(width)] = public_url
+        return result
+
+    async def _upload(self, path: str, data: bytes, content_type: str) -> Optional[str]:
+        """REST upload of one object -> public URL (None on failure)"""
+        base_url = os.getenv("SUPABASE_URL")
+        key = os.getenv("SUPABASE_KEY")
+        upload = await self.client.post(
+            f"{base_url}/storage/v1/object/{IMAGES_BUCKET}/{path}",
+            content=data,
+            headers={
+                "Authorization": f"Bearer {key}",
+                "apikey": key,
+                "Content-Type": content_type,
+                "Cache-Control": "max-age=31536000",  # content-addressed: never changes
+                "x-upsert": "true",
+            }
+        )
+        if upload.status_code >= 400:
+            logger.warning(f"⚠️ Thumbnail upload failed ({upload.status_code}): {path}")
+            return None
+        return f"{base_url}/storage/v1/object/public/{IMAGES_BUCKET}/{path}"
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "running_jobs": sum(1 for job in self.jobs.values() if not job.finished_at),
+            "inflight": len(self._inflight),
+            **self.counters,
+        }
+
+
+thumbnail_pipeline = ThumbnailPipeline()
@@ -0,0 +1,345 @@
+"""
+Expiring CDN URL Refresher
+Keeps signed TikTok/Instagram CDN URLs (Trend.play_addr / cover_url,
+Competitor.recent_videos video_url / cover_url) fresh for the items users
+actually look at.
+
+- Expiry is read from the signature itself: TikTok `x-expires=<unix>`,
+  Instagram/Facebook `oe=<hex unix>`.
+- Every list a user opens (my trends, favorites, competitor feed) calls
+  track_trends() / track_competitor(); viewed items go into a heap ordered
+  by their earliest expiry.
+- refresh_due() (scheduler, every URL_REFRESH_INTERVAL_MINUTES) pops items
+  expiring within URL_REFRESH_LEAD_HOURS and re-scrapes their post pages in
+  batched "urls"-mode collector runs (one Apify run per URL_REFRESH_BATCH
+  posts), then writes the fresh URLs back and re-queues them.
+  Items nobody viewed for URL_REFRESH_VIEW_TTL_HOURS are dropped.
+- The heap is per process, so the same post can be due on several workers:
+  each batch first claims its page keys in url_refresh_claims (INSERT ...
+  ON CONFLICT, an expired claim is taken over) for URL_REFRESH_CLAIM_MINUTES,
+  and only the pages this worker won are scraped.
+
+Covers already mirrored to Supabase never expire and are left alone; a
+refreshed CDN cover goes through the thumbnail pipeline again. TikTok
+competitor videos are stored with their signatures stripped (fix_tt_url),
+so only Instagram competitors are tracked.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..core.database import SessionLocal
+from ..db.models import Competitor, Trend, UrlRefreshClaim
+from .collector import TikTokCollector
+from .instagram_adapter import adapt_instagram_to_standard
+from .instagram_collector import InstagramCollector
+from .storage import SupabaseStorage
+from .thumbnail_pipeline import thumbnail_pipeline
+
+logger = logging.getLogger(__name__)
+
+URL_REFRESH_INTERVAL_MINUTES = int(os.getenv("URL_REFRESH_INTERVAL_MINUTES", "15"))
+URL_REFRESH_LEAD_HOURS = float(os.getenv("URL_REFRESH_LEAD_HOURS", "6"))
+URL_REFRESH_BATCH = int(os.getenv("URL_REFRESH_BATCH", "50"))
+URL_REFRESH_MAX_PER_RUN = int(os.getenv("URL_REFRESH_MAX_PER_RUN", "500"))
+URL_REFRESH_VIEW_TTL_HOURS = float(os.getenv("URL_REFRESH_VIEW_TTL_HOURS", "72"))
+URL_REFRESH_MAX_ITEMS = int(os.getenv("URL_REFRESH_MAX_ITEMS", "100000"))
+# How long a worker's claim on a post page keeps other workers from scraping it again
+URL_REFRESH_CLAIM_MINUTES = int(os.getenv("URL_REFRESH_CLAIM_MINUTES", "60"))
+
+# ("trend", trend_id) or ("competitor", competitor_id, video_id)
+ItemKey = Tuple
+
+
+def parse_expiry(url: Optional[str]) -> Optional[int]:
+    """Unix time a signed CDN URL stops working, None if it isn't signed"""
+    if not url or "?" not in url:
+        return None
+    params = parse_qs(urlsplit(url).query)
+    for name in ("x-expires", "expires", "expire"):
+        value = (params.get(name) or [""])[0]
+        if value.isdigit():
+            return int(value)
+    oe = (params.get("oe") or [""])[0]
+    if oe:
+        try:
+            return int(oe, 16)
+        except ValueError:
+            return None
+    return None
+
+
+def earliest_expiry(*urls: Optional[str]) -> Optional[int]:
+    expiries = [
+        expiry for expiry in (parse_expiry(url) for url in urls if not SupabaseStorage.is_stored_url(url))
+        if expiry
+    ]
+    return min(expiries) if expiries else None
+
+
+def page_key(url: Optional[str]) -> str:
+    """Post page URL without query / trailing slash (matches scraper output to our rows)"""
+    return (url or "").split("?")[0].rstrip("/").lower()
+
+
+def _is_instagram(url: Optional[str]) -> bool:
+    return "instagram.com" in (url or "")
+
+
+def _fresh_urls(item: dict) -> Tuple[str, str, str]:
+    """(page url, play address, cover) from a collector item, same fields as trends.parse_video_data"""
+    v_meta = item.get("video") or item.get("videoMeta") or {}
+    page = item.get("webVideoUrl") or item.get("postPage") or item.get("url") or ""
+    play = (
+        v_meta.get("url") or v_meta.get("playAddr") or v_meta.get("downloadAddr") or
+        item.get("videoUrl") or item.get("playAddr") or ""
+    )
+    cover = v_meta.get("cover") or v_meta.get("coverUrl") or item.get("coverUrl") or item.get("cover") or ""
+    return page, play, cover
+
+
+class _Tracked:
+    __slots__ = ("key", "page_url", "expires_at", "viewed_at")
+
+    def __init__(self, key: ItemKey, page_url: str, expires_at: int, viewed_at: float):
+        self.key = key
+        self.page_url = page_url
+        self.expires_at = expires_at
+        self.viewed_at = viewed_at
+
+
+class UrlRefresher:
+    """track_*() from request threads; refresh_due() on the event loop"""
+
+    def __init__(self):
+        self._items: Dict[ItemKey, _Tracked] = {}
+        self._heap: List[Tuple[int, int, ItemKey]] = []  # (expires_at, seq, key); stale entries skipped on pop
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._running = False
+        self.counters = {
+            "runs": 0, "collector_runs": 0, "refreshed": 0, "not_found": 0, "dropped_unviewed": 0,
+            "claimed_elsewhere": 0,
+        }
+
+    # --- tracking ---
+
+    def track(
+        self,
+        key: ItemKey,
+        page_url: Optional[str],
+        expires_at: Optional[int],
+        viewed_at: Optional[float] = None
+    ) -> None:
+        if not expires_at or not page_url:
+            return
+        now = viewed_at or time.time()
+        with self._lock:
+            tracked = self._items.get(key)
+            if tracked is not None:
+                tracked.viewed_at = now
+                tracked.page_url = page_url
+                if tracked.expires_at == expires_at:
+                    return
+                tracked.expires_at = expires_at
+            elif len(self._items) >= URL_REFRESH_MAX_ITEMS:
+                return
+            else:
+                self._items[key] = _Tracked(key, page_url, expires_at, now)
+            heapq.heappush(self._heap, (expires_at, next(self._seq), key))
+
+    def track_trends(self, trends: Iterable[Trend]) -> None:
+        for trend in trends:
+            if trend is not None and trend.id:
+                self.track(("trend", trend.id), trend.url, earliest_expiry(trend.play_addr, trend.cover_url))
+
+    def track_competitor(self, competitor: Competitor, videos: Optional[list] = None) -> None:
+        if competitor.platform != "instagram":
+            return  # TikTok URLs are stored unsigned: nothing expires, nothing to refresh
+        for video in videos if videos is not None else (competitor.recent_videos or []):
+            if isinstance(video, dict) and video.get("id"):
+                self.track(
+                    ("competitor", competitor.id, str(video["id"])),
+                    video.get("url"),
+                    earliest_expiry(video.get("video_url"), video.get("cover_url"))
+                )
+
+    def _pop_due(self, horizon: float, limit: int) -> List[_Tracked]:
+        due = []
+        view_cutoff = time.time() - URL_REFRESH_VIEW_TTL_HOURS * 3600
+        with self._lock:
+            while self._heap and self._heap[0][0] <= horizon and len(due) < limit:
+                expires_at, _, key = heapq.heappop(self._heap)
+                tracked = self._items.get(key)
+                if tracked is None or tracked.expires_at != expires_at:
+                    continue  # superseded by a newer push
+                del self._items[key]
+                if tracked.viewed_at < view_cutoff:
+                    self.counters["dropped_unviewed"] += 1
+                    continue
+                due.append(tracked)
+        return due
+
+    # --- refreshing ---
+
+    async def refresh_due(self) -> dict:
+        """Refresh everything expiring within URL_REFRESH_LEAD_HOURS (one call at a time)"""
+        if self._running:
+            return {"skipped": "already running"}
+        self._running = True
+        try:
+            self.counters["runs"] += 1
+            due = self._pop_due(time.time() + URL_REFRESH_LEAD_HOURS * 3600, URL_REFRESH_MAX_PER_RUN)
+            refreshed = 0
+            for platform in ("tiktok", "instagram"):
+                items = [t for t in due if _is_instagram(t.page_url) == (platform == "instagram")]
+                for start in range(0, len(items), URL_REFRESH_BATCH):
+                    try:
+                        refreshed += await self._refresh_batch(platform, items[start:start + URL_REFRESH_BATCH])
+                    except Exception as e:
+                        # Dropped from the queue; the next view tracks them again
+                        logger.error(f"URL refresh batch failed ({platform}): {e}")
+            return {"due": len(due), "refreshed": refreshed}
+        finally:
+            self._running = False
+
+    async def _refresh_batch(self, platform: str, batch: List[_Tracked]) -> int:
+        # Another worker refreshing the same post holds its claim: leave it to that worker
+        # (its viewers re-track the fresh URLs on their next view)
+        claimed = await asyncio.to_thread(_claim_pages, {page_key(t.page_url) for t in batch})
+        due = len(batch)
+        batch = [t for t in batch if page_key(t.page_url) in claimed]
+        self.counters["claimed_elsewhere"] += due - len(batch)
+        if not batch:
+            return 0
+        urls = list(dict.fromkeys(t.page_url for t in batch))
+        collector = InstagramCollector() if platform == "instagram" else TikTokCollector()
+        self.counters["collector_runs"] += 1
+        raw_items = await asyncio.to_thread(collector.collect, urls, len(urls), "urls")
+
+        fresh: Dict[str, Tuple[str, str]] = {}
+        for item in raw_items or []:
+            if platform == "instagram":
+                item = adapt_instagram_to_standard(item)
+                if not item:
+                    continue
+            page, play, cover = _fresh_urls(item)
+            if page:
+                fresh[page_key(page)] = (play, cover)
+
+        updates = {t.key: fresh[page_key(t.page_url)] for t in batch if page_key(t.page_url) in fresh}
+        self.counters["not_found"] += len(batch) - len(updates)
+        if not updates:
+            return 0
+
+        mirror = await asyncio.to_thread(_apply_updates, updates)
+        # Unstored covers changed -> mirror them (the pipeline runs on this loop)
+        for user_id, items in mirror.items():
+            thumbnail_pipeline.submit(user_id, items)
+
+        by_key = {t.key: t for t in batch}
+        for key, (play, cover) in updates.items():
+            tracked = by_key[key]
+            # A refresh is not a view: keep the original viewed_at
+            self.track(key, tracked.page_url, earliest_expiry(play, cover), tracked.viewed_at)
+        self.counters["refreshed"] += len(updates)
+        logger.info(f"🔗 URL refresher: {len(updates)}/{len(batch)} {platform} items refreshed")
+        return len(updates)
+
+    def stats(self) -> dict:
+        with self._lock:
+            next_expiry = self._heap[0][0] if self._heap else None
+            return {
+                "tracked": len(self._items),
+                "heap": len(self._heap),
+                "next_expiry_in_s": int(next_expiry - time.time()) if next_expiry else None,
+                "running": self._running,
+                **self.counters,
+            }
+
+
+def _claim_pages(keys: Set[str]) -> Set[str]:
+    """Claim page keys for URL_REFRESH_CLAIM_MINUTES; returns those no other worker holds"""
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        db.query(UrlRefreshClaim).filter(
+            UrlRefreshClaim.claimed_until < now - timedelta(minutes=URL_REFRESH_CLAIM_MINUTES)
+        ).delete(synchronize_session=False)
+        until = now + timedelta(minutes=URL_REFRESH_CLAIM_MINUTES)
+        stmt = pg_insert(UrlRefreshClaim).values([{"page_key": key, "claimed_until": until} for key in keys])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UrlRefreshClaim.page_key],
+            set_={"claimed_until": stmt.excluded.claimed_until},
+            where=UrlRefreshClaim.claimed_until < now
+        ).returning(UrlRefreshClaim.page_key)
+        claimed = {row[0] for row in db.execute(stmt)}
+        db.commit()
+        return claimed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _apply_updates(updates: Dict[ItemKey, Tuple[str, str]]) -> Dict[int, List[Tuple[int, str]]]:
+    """
+    Write fresh play/cover URLs. Returns {user_id: [(trend_id, cover_url)]}
+    of trend covers that still need mirroring.
+    """
+    mirror: Dict[int, List[Tuple[int, str]]] = {}
+    db = SessionLocal()
+    try:
+        trend_ids = [key[1] for key in updates if key[0] == "trend"]
+        for trend in db.query(Trend).filter(Trend.id.in_(trend_ids)).all() if trend_ids else []:
+            play, cover = updates[("trend", trend.id)]
+            if play:
+                trend.play_addr = play
+            if cover and not SupabaseStorage.is_stored_url(trend.cover_url):
+                trend.cover_url = cover
+                mirror.setdefault(trend.user_id, []).append((trend.id, cover))
+
+        by_competitor: Dict[int, Dict[str, Tuple[str, str]]] = {}
+        for key, value in updates.items():
+            if key[0] == "competitor":
+                by_competitor.setdefault(key[1], {})[key[2]] = value
+        competitors = db.query(Competitor).filter(
+            Competitor.id.in_(list(by_competitor)),
+            # Never write signed URLs into rows that hold stripped TikTok URLs
+            Competitor.platform == "instagram"
+        ).all() if by_competitor else []
+        for competitor in competitors:
+            fresh = by_competitor[competitor.id]
+            videos = []
+            for video in competitor.recent_videos or []:
+                if isinstance(video, dict) and str(video.get("id")) in fresh:
+                    play, cover = fresh[str(video["id"])]
+                    video = dict(video)
+                    if play:
+                        video["video_url"] = play
+                    if cover and not SupabaseStorage.is_stored_url(video.get("cover_url")):
+                        video["cover_url"] = cover
+                        video["thumbnail_url"] = cover
+                videos.append(video)
+            competitor.recent_videos = videos  # new list: JSONB change is detected
+
+        db.commit()
+        return mirror
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+url_refresher = UrlRefresher()
@@ -0,0 +1,433 @@
+"""
+Vector Index Service
+Stores CLIP cover embeddings (trend_embeddings, float16 bytes) and serves
+cosine top-k queries over a user's library from an in-process index.
+
+Each user's embeddings are loaded once into a normalized float32 matrix;
+a query is one matrix-vector product + argpartition (~5-10 ms for 100k
+trends), no ML service call and no per-row SQL. New embeddings are
+upserted into loaded indexes in place, so the index never needs a reload
+after a search.
+
+Libraries above IVF_MIN_ROWS also get an IVF-Flat ANN layer (spherical
+k-means coarse quantizer): a query scans only the closest lists (a fixed
+fraction of them, so recall holds as nlist grows) instead of every row.
+The layer is trained in a background thread; searches stay exact until
+it is ready.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..db.models import TrendEmbedding
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.getenv("CLIP_MODEL_NAME", "openai/clip-vit-base-patch32")
+# Upper bound on rows kept in memory across all users (float32: 2 KB per 512-dim row)
+VECTOR_INDEX_MAX_ROWS = int(os.getenv("VECTOR_INDEX_MAX_ROWS", "500000"))
+# IVF-Flat: built once a library has IVF_MIN_ROWS rows, rebuilt after 50% growth.
+# Below that an exact scan is only a few ms, so it isn't worth the recall loss.
+IVF_MIN_ROWS = int(os.getenv("IVF_MIN_ROWS", "100000"))
+# Lists probed per query: IVF_NPROBE_FRACTION of nlist, at least IVF_NPROBE
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_NPROBE_FRACTION = float(os.getenv("IVF_NPROBE_FRACTION", "0.1"))
+IVF_TRAIN_ITERATIONS = 8
+IVF_TRAIN_SAMPLE = 50000
+# Other workers write embeddings too: pull rows newer than the last sync this often
+VECTOR_INDEX_SYNC_SECONDS = float(os.getenv("VECTOR_INDEX_SYNC_SECONDS", "30"))
+
+_WIRE_DTYPE = np.dtype("<f2")
+
+
+def to_blob(vector: Sequence[float]) -> bytes:
+    """Embedding -> little-endian float16 bytes (trend_embeddings.vector)"""
+    return np.asarray(vector, dtype=_WIRE_DTYPE).tobytes()
+
+
+def from_blobs(blobs: Sequence[bytes], dim: int) -> np.ndarray:
+    """float16 blobs -> (N, dim) float16 matrix (one copy for the join, none for decode)"""
+    if not blobs:
+        return np.empty((0, dim), dtype=_WIRE_DTYPE)
+    return np.frombuffer(b"".join(blobs), dtype=_WIRE_DTYPE).reshape(len(blobs), dim)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class IVFFlat:
+    """
+    Inverted-file index over a normalized matrix: rows are bucketed by their
+    nearest centroid; a query scores only the rows in the nprobe best buckets.
+    """
+
+    def __init__(self, matrix: np.ndarray, nlist: Optional[int] = None, seed: int = 0):
+        n = matrix.shape[0]
+        self.nlist = nlist or max(16, int(4 * np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+
+        sample = matrix[rng.choice(n, size=min(n, IVF_TRAIN_SAMPLE), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=min(self.nlist, len(sample)), replace=False)].copy()
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+
+        self.centroids = centroids
+        self.nlist = len(centroids)
+        self.trained_size = n
+        self.lists: List[np.ndarray] = [np.empty(0, dtype=np.int64)] * self.nlist
+        self.add(np.arange(n, dtype=np.int64), matrix)
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        labels = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), 8192):
+            labels[start:start + 8192] = np.argmax(vectors[start:start + 8192] @ self.centroids.T, axis=1)
+        return labels
+
+    def add(self, positions: np.ndarray, vectors: np.ndarray) -> None:
+        labels = self.assign(vectors)
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(self.nlist + 1))
+        for c in range(self.nlist):
+            chunk = positions[order[bounds[c]:bounds[c + 1]]]
+            if len(chunk):
+                self.lists[c] = np.concatenate([self.lists[c], chunk])
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = min(nprobe, self.nlist)
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[c] for c in probe])
+
+
+class UserVectorIndex:
+    """Normalized embeddings of one user's trends (exact, or IVF-Flat for large libraries)"""
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self.size = 0
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._positions: Dict[int, int] = {}
+        self.ivf: Optional[IVFFlat] = None
+        self._ivf_lock = threading.Lock()  # row appends vs. swapping in a freshly trained IVF
+        self._ivf_training = False
+        self.synced_at = datetime.utcnow()  # DB time watermark of the last load/sync
+        self.checked_at = time.monotonic()
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self.size]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix[:self.size]
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        ids = np.zeros(capacity, dtype=np.int64)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        ids[:self.size] = self.ids
+        matrix[:self.size] = self.matrix
+        self._ids, self._matrix = ids, matrix
+
+    def upsert(self, trend_ids: Sequence[int], vectors: np.ndarray) -> None:
+        """Insert or replace rows (vectors need not be normalized)"""
+        vectors = _normalize(vectors)
+        with self._ivf_lock:
+            self._grow(self.size + len(trend_ids))
+            new_positions = []
+            for trend_id, vector in zip(trend_ids, vectors):
+                pos = self._positions.get(int(trend_id))
+                if pos is None:
+                    pos = self.size
+                    self.size += 1
+                    self._ids[pos] = trend_id
+                    self._positions[int(trend_id)] = pos
+                    new_positions.append(pos)
+                # Replaced vectors keep their IVF list (re-embedding the same cover barely moves it)
+                self._matrix[pos] = vector
+
+            if self.ivf is not None and new_positions:
+                positions = np.asarray(new_positions, dtype=np.int64)
+                self.ivf.add(positions, self._matrix[positions])
+
+    def _ensure_ivf(self) -> Optional[IVFFlat]:
+        """
+        The IVF layer if one is ready. Starts (re)training in the background
+        once the library reaches IVF_MIN_ROWS or grew 50% since the last
+        build; until the first build finishes callers search exactly.
+        """
+        if self.size < IVF_MIN_ROWS:
+            return None
+        if (self.ivf is None or self.size > self.ivf.trained_size * 1.5) and not self._ivf_training:
+            with self._ivf_lock:
+                if self._ivf_training:
+                    return self.ivf
+                self._ivf_training = True
+                matrix = self.matrix.copy()
+            threading.Thread(target=self._train_ivf, args=(matrix,), name="ivf-train", daemon=True).start()
+        return self.ivf
+
+    def _train_ivf(self, matrix: np.ndarray) -> None:
+        try:
+            ivf = IVFFlat(matrix)
+            with self._ivf_lock:
+                # Rows upserted while training went to the old lists only
+                if self.size > ivf.trained_size:
+                    late = np.arange(ivf.trained_size, self.size, dtype=np.int64)
+                    ivf.add(late, self._matrix[late])
+                self.ivf = ivf
+            logger.info(f"🧭 IVF index built: {ivf.trained_size} rows, {ivf.nlist} lists")
+        except Exception as e:
+            logger.error(f"IVF training failed: {e}")
+        finally:
+            self._ivf_training = False
+
+    @staticmethod
+    def _nprobe(ivf: IVFFlat) -> int:
+        return max(IVF_NPROBE, int(np.ceil(ivf.nlist * IVF_NPROBE_FRACTION)))
+
+    def vector(self, trend_id: int) -> Optional[np.ndarray]:
+        pos = self._positions.get(int(trend_id))
+        return None if pos is None else self._matrix[pos]
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        exclude: Optional[int] = None,
+        exact: bool = False
+    ) -> List[Tuple[int, float]]:
+        """Top-k (trend_id, cosine similarity), best first"""
+        if self.size == 0:
+            return []
+        query = _normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+
+        ivf = None if exact else self._ensure_ivf()
+        if ivf is not None:
+            positions = ivf.candidates(query, self._nprobe(ivf))
+            positions = positions[positions < self.size]
+        else:
+            positions = np.arange(self.size)
+        if len(positions) == 0:
+            return []
+
+        scores = self._matrix[positions] @ query
+        if exclude is not None and int(exclude) in self._positions:
+            scores[positions == self._positions[int(exclude)]] = -np.inf
+
+        k = min(k, len(positions))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self._ids[positions[i]]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+class VectorIndex:
+    """Per-user indexes, loaded lazily from trend_embeddings, LRU-evicted by total rows"""
+
+    def __init__(self, model: str = EMBEDDING_MODEL, max_rows: int = VECTOR_INDEX_MAX_ROWS):
+        self.model = model
+        self.max_rows = max_rows
+        self._indexes: "OrderedDict[int, UserVectorIndex]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _load(self, db: Session, user_id: int) -> Optional[UserVectorIndex]:
+        synced_at = datetime.utcnow()
+        rows = db.query(TrendEmbedding.trend_id, TrendEmbedding.dim, TrendEmbedding.vector).filter(
+            TrendEmbedding.user_id == user_id,
+            TrendEmbedding.model == self.model
+        ).all()
+        if not rows:
+            return None
+
+        dim = rows[0].dim
+        rows = [r for r in rows if r.dim == dim]
+        index = UserVectorIndex(dim, capacity=max(1024, len(rows)))
+        index.upsert([r.trend_id for r in rows], from_blobs([bytes(r.vector) for r in rows], dim))
+        index.synced_at = synced_at
+        logger.info(f"🧭 Vector index loaded for user {user_id}: {index.size} embeddings")
+        return index
+
+    def _sync(self, db: Session, user_id: int, index: UserVectorIndex) -> None:
+        """Pull rows written since the last sync (e.g. by another worker process)"""
+        index.checked_at = time.monotonic()
+        synced_at = datetime.utcnow()
+        rows = db.query(TrendEmbedding.trend_id, TrendEmbedding.vector).filter(
+            TrendEmbedding.user_id == user_id,
+            TrendEmbedding.model == self.model,
+            TrendEmbedding.dim == index.dim,
+            # small overlap: rows committed right around the previous watermark
+            TrendEmbedding.created_at >= index.synced_at - timedelta(seconds=5)
+        ).all()
+        if rows:
+            with self._lock:
+                index.upsert([r.trend_id for r in rows], from_blobs([bytes(r.vector) for r in rows], index.dim))
+        index.synced_at = synced_at
+
+    def _evict(self) -> None:
+        total = sum(index.size for index in self._indexes.values())
+        while total > self.max_rows and len(self._indexes) > 1:
+            _, evicted = self._indexes.popitem(last=False)
+            total -= evicted.size
+
+    def get(self, db: Session, user_id: int) -> Optional[UserVectorIndex]:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+
+        if index is not None:
+            if time.monotonic() - index.checked_at > VECTOR_INDEX_SYNC_SECONDS:
+                self._sync(db, user_id, index)
+            return index
+
+        index = self._load(db, user_id)  # outside the lock: other users aren't blocked
+        if index is None:
+            return None
+
+        with self._lock:
+            # Another request may have loaded it meanwhile; keep the first one
+            index = self._indexes.setdefault(user_id, index)
+            self._indexes.move_to_end(user_id)
+            self._evict()
+        return index
+
+    def upsert(self, user_id: int, trend_ids: Sequence[int], vectors: np.ndarray) -> None:
+        """Apply new embeddings to the user's index if it is loaded"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and vectors.shape[1] == index.dim:
+                index.upsert(trend_ids, vectors)
+                self._evict()
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def search(
+        self,
+        db: Session,
+        user_id: int,
+        query: np.ndarray,
+        k: int = 20,
+        exclude: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        index = self.get(db, user_id)
+        if index is None:
+            return []
+        return index.search(query, k, exclude=exclude)
+
+    def similar(self, db: Session, user_id: int, trend_id: int, k: int = 12) -> Optional[List[Tuple[int, float]]]:
+        """Trends closest to a stored trend's cover. None if the trend has no embedding."""
+        index = self.get(db, user_id)
+        vector = index.vector(trend_id) if index is not None else None
+        if vector is None:
+            return None
+        return index.search(vector, k, exclude=trend_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "model": self.model,
+                "users_loaded": len(self._indexes),
+                "rows_loaded": sum(index.size for index in self._indexes.values()),
+                "ivf_users": sum(1 for index in self._indexes.values() if index.ivf is not None),
+                "max_rows": self.max_rows,
+            }
+
+
+vector_index = VectorIndex()
+
+
+def load_trend_embeddings(db: Session, trends: list) -> int:
+    """
+    Attach already stored embeddings to Trend objects (trend.embedding) so
+    clustering doesn't send their covers to the ML service again.
+    Returns the number of trends that got one.
+    """
+    by_id = {t.id: t for t in trends if t.id}
+    if not by_id:
+        return 0
+
+    rows = db.query(TrendEmbedding.trend_id, TrendEmbedding.dim, TrendEmbedding.vector).filter(
+        TrendEmbedding.trend_id.in_(list(by_id)),
+        TrendEmbedding.model == EMBEDDING_MODEL
+    ).all()
+    for row in rows:
+        trend = by_id[row.trend_id]
+        trend.embedding = from_blobs([bytes(row.vector)], row.dim)[0].astype(np.float32)
+        trend.embedding_stored = True
+    return len(rows)
+
+
+def store_trend_embeddings(db: Session, trends: list) -> list:
+    """
+    Upsert the embeddings set on Trend objects (trend.embedding) into
+    trend_embeddings. Caller commits, then passes the returned trends to
+    index_trend_embeddings — the in-memory indexes never hold vectors
+    that were rolled back.
+    Embeddings that came from load_trend_embeddings are skipped.
+    Returns the trends whose rows were written.
+    """
+    items = [
+        t for t in trends
+        if t.id and getattr(t, "embedding", None) is not None and not getattr(t, "embedding_stored", False)
+    ]
+    if not items:
+        return []
+
+    now = datetime.utcnow()
+    rows = [{
+        "trend_id": t.id,
+        "user_id": t.user_id,
+        "model": EMBEDDING_MODEL,
+        "dim": len(t.embedding),
+        "vector": to_blob(t.embedding),
+        "created_at": now,
+    } for t in items]
+
+    stmt = pg_insert(TrendEmbedding).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TrendEmbedding.trend_id],
+        set_={
+            "model": stmt.excluded.model,
+            "dim": stmt.excluded.dim,
+            "vector": stmt.excluded.vector,
+            "created_at": stmt.excluded.created_at,
+        }
+    )
+    db.execute(stmt)
+    return items
+
+
+def index_trend_embeddings(trends: list) -> None:
+    """Apply committed embeddings (store_trend_embeddings) to the loaded vector indexes"""
+    by_user: Dict[int, List] = {}
+    for t in trends:
+        by_user.setdefault(t.user_id, []).append(t)
+    for user_id, user_trends in by_user.items():
+        vector_index.upsert(
+            user_id,
+            [t.id for t in user_trends],
+            np.asarray([t.embedding for t in user_trends], dtype=np.float32)
+        )
@@ -0,0 +1,226 @@
+"""
+Video Chunk Cache
+Fixed-size chunks of proxied videos on local disk (see /api/proxy/video).
+
+A video is split into VIDEO_CHUNK_KB chunks at fixed offsets, so any byte
+range maps to the same chunk files no matter how a player slices its
+Range requests. Chunks are keyed by the canonical URL (CDN signatures
+stripped, image_index.canonical_source) — a fresh signed play_addr of a
+hot trend is still served locally.
+
+The cache is bounded by VIDEO_CACHE_MB and evicts least recently used
+chunks; the LRU order is rebuilt from file access times on startup.
+Disk I/O runs in a thread (asyncio.to_thread); the index itself is only
+touched from the event loop.
+
+Every worker process on the host writes to the same directory, so the
+budget is enforced over the directory itself: sweep() (scheduler, every
+VIDEO_CACHE_SWEEP_SECONDS, on every worker) rescans it, evicts LRU
+chunks until it fits VIDEO_CACHE_MB and resyncs the worker's index.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+from .image_index import canonical_source
+
+logger = logging.getLogger(__name__)
+
+VIDEO_CACHE_DIR = os.getenv("VIDEO_CACHE_DIR", "/tmp/trendscout-video-cache")
+VIDEO_CACHE_MB = int(os.getenv("VIDEO_CACHE_MB", "4096"))
+VIDEO_CHUNK_SIZE = int(os.getenv("VIDEO_CHUNK_KB", "1024")) * 1024
+VIDEO_CACHE_SWEEP_SECONDS = int(os.getenv("VIDEO_CACHE_SWEEP_SECONDS", "300"))
+
+_META = "meta"
+
+
+def video_key(url: str) -> str:
+    return hashlib.sha256(canonical_source(url).encode()).hexdigest()
+
+
+class VideoMeta(NamedTuple):
+    size: int  # total bytes of the video
+    content_type: str
+
+
+class VideoChunkCache:
+    def __init__(
+        self,
+        directory: str = VIDEO_CACHE_DIR,
+        max_bytes: int = VIDEO_CACHE_MB * 1024 * 1024,
+        chunk_size: int = VIDEO_CHUNK_SIZE
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._index: Optional["OrderedDict[Tuple[str, str], int]"] = None  # (key, chunk) -> bytes, LRU order
+        self._used = 0
+        self.counters = {"chunk_hits": 0, "chunk_misses": 0, "bytes_served": 0, "evicted_chunks": 0, "sweeps": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def chunk_range(self, index: int, total: int) -> Tuple[int, int]:
+        """Inclusive byte range of chunk `index` in a video of `total` bytes"""
+        start = index * self.chunk_size
+        return start, min(start + self.chunk_size, total) - 1
+
+    async def get_meta(self, key: str) -> Optional[VideoMeta]:
+        if not self.enabled:
+            return None
+        data = await self._get(key, _META)
+        if data is None:
+            return None
+        try:
+            return VideoMeta(**json.loads(data))
+        except (ValueError, TypeError):
+            return None
+
+    async def put_meta(self, key: str, meta: VideoMeta) -> None:
+        if self.enabled:
+            await self._put(key, _META, json.dumps(meta._asdict()).encode())
+
+    async def get_chunk(self, key: str, index: int) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        data = await self._get(key, str(index))
+        if data is None:
+            self.counters["chunk_misses"] += 1
+        else:
+            self.counters["chunk_hits"] += 1
+        return data
+
+    def has_chunk(self, key: str, index: int) -> bool:
+        return self._index is not None and (key, str(index)) in self._index
+
+    async def put_chunk(self, key: str, index: int, data: bytes) -> None:
+        if self.enabled:
+            await self._put(key, str(index), data)
+
+    # --- disk ---
+
+    def _path(self, key: str, name: str) -> str:
+        return os.path.join(self.directory, key[:2], key, name)
+
+    async def _get(self, key: str, name: str) -> Optional[bytes]:
+        await self._load_index()
+        if (key, name) not in self._index:
+            return None
+        data = await asyncio.to_thread(self._read, self._path(key, name))
+        if data is None:
+            self._used -= self._index.pop((key, name), 0)
+            return None
+        if (key, name) in self._index:
+            self._index.move_to_end((key, name))
+        return data
+
+    async def _put(self, key: str, name: str, data: bytes) -> None:
+        await self._load_index()
+        try:
+            await asyncio.to_thread(self._write, self._path(key, name), data)
+        except OSError as e:
+            logger.warning(f"Video cache write failed: {e}")
+            return
+        self._used += len(data) - self._index.pop((key, name), 0)
+        self._index[(key, name)] = len(data)
+        await self._evict()
+
+    async def _evict(self) -> int:
+        evicted = []
+        while self._used > self.max_bytes and self._index:
+            old, size = self._index.popitem(last=False)
+            self._used -= size
+            evicted.append(old)
+            if old[1] == _META:
+                # Without the meta the remaining chunks of that video can't be served
+                for item in [item for item in self._index if item[0] == old[0]]:
+                    self._used -= self._index.pop(item)
+                    evicted.append(item)
+        if evicted:
+            self.counters["evicted_chunks"] += len(evicted)
+            await asyncio.to_thread(self._delete, evicted)
+        return len(evicted)
+
+    async def sweep(self) -> dict:
+        """Enforce max_bytes over the whole (shared) directory and resync the index with it"""
+        if not self.enabled:
+            return {}
+        # Chunks this worker stores during the scan are re-indexed by the next sweep
+        self._index = OrderedDict(await asyncio.to_thread(self._scan))
+        self._used = sum(self._index.values())
+        evicted = await self._evict()
+        self.counters["sweeps"] += 1
+        return {"files": len(self._index), "evicted": evicted, "cached_mb": round(self._used / 1024 / 1024, 1)}
+
+    async def _load_index(self) -> None:
+        if self._index is None:
+            self._index = OrderedDict()  # set first: concurrent callers don't rescan
+            for item, size in await asyncio.to_thread(self._scan):
+                if item not in self._index:  # written while scanning
+                    self._index[item] = size
+                    self._used += size
+
+    def _scan(self):
+        """[((key, name), size)] of cached files, least recently used first"""
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for root, _, names in os.walk(self.directory):
+            key = os.path.basename(root)
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                found.append((stat.st_atime, (key, name), stat.st_size))
+        found.sort()
+        return [(item, size) for _, item, size in found]
+
+    @staticmethod
+    def _read(path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # LRU order survives restarts
+            return data
+        except OSError:
+            return None
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # readers never see a partial chunk
+
+    def _delete(self, items) -> None:
+        for key, name in items:
+            try:
+                os.remove(self._path(key, name))
+            except OSError:
+                pass
+            if name == _META:
+                shutil.rmtree(os.path.dirname(self._path(key, name)), ignore_errors=True)
+
+    def stats(self) -> dict:
+        c = self.counters
+        lookups = c["chunk_hits"] + c["chunk_misses"]
+        return {
+            **c,
+            "hit_rate": round(c["chunk_hits"] / lookups, 4) if lookups else 0,
+            "chunk_kb": self.chunk_size // 1024,
+            "cached_files": len(self._index or {}),
+            "cached_mb": round(self._used / 1024 / 1024, 1),
+        }
+
+
+video_chunk_cache = VideoChunkCache()
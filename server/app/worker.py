@@ -0,0 +1,213 @@
+"""
+Pipeline worker: runs the post-search pipeline stages outside the API.
+
+    python -m app.worker
+    python -m app.worker --queues thumbnails,clustering --concurrency thumbnails=16,clustering=2
+
+Stages:
+- thumbnails: cover mirroring jobs (pipeline_jobs, enqueued by deep search)
+- clustering: CLIP embeddings + visual cluster assignment (pipeline_jobs)
+- rescans: the video_rescans dispatcher (rescan_dispatcher.dispatch_due)
+
+Each stage gets N concurrent slots (WORKER_CONCURRENCY / --concurrency).
+A slot claims one job at a time with FOR UPDATE SKIP LOCKED, keeps its lease
+alive while running it and marks it done / failed. Run as many worker
+processes on as many nodes as needed — they share nothing but Postgres.
+The API enqueues work for them when PIPELINE_MODE=queue.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+from typing import Dict
+
+from .core.database import SessionLocal
+from .db.models import Trend
+from .services import job_queue
+from .services.cluster_engine import assign_trends
+from .services.clustering import embed_trend_covers
+from .services.ml_client import get_ml_client
+from .services.rescan_dispatcher import RESCAN_DISPATCH_INTERVAL_SECONDS, dispatch_due, run_in_rescan_executor
+from .services.thumbnail_pipeline import thumbnail_pipeline
+from .services.vector_index import index_trend_embeddings, load_trend_embeddings, store_trend_embeddings
+
+logger = logging.getLogger("app.worker")
+
+WORKER_CONCURRENCY = os.getenv("WORKER_CONCURRENCY", "thumbnails=4,clustering=1,rescans=1")
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "1"))
+RESCAN_STAGE = "rescans"
+STAGES = job_queue.QUEUES + (RESCAN_STAGE,)
+
+
+def parse_concurrency(spec: str) -> Dict[str, int]:
+    """"thumbnails=4,clustering=1" -> {"thumbnails": 4, "clustering": 1}"""
+    concurrency = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage: {name} (expected one of {', '.join(STAGES)})")
+        concurrency[name] = int(value or 1)
+    return concurrency
+
+
+# --- stage handlers ---
+
+async def handle_thumbnails(job) -> dict:
+    items = [(int(trend_id), url) for trend_id, url in job.payload.get("items", [])]
+    result = await thumbnail_pipeline.process(job.user_id, items)
+    return result.to_dict() if result else {"total": 0}
+
+
+def _load_for_clustering(db, trend_ids):
+    trends = db.query(Trend).filter(Trend.id.in_(trend_ids)).all()
+    load_trend_embeddings(db, trends)
+    return trends
+
+
+def _store_clusters(db, user_id, trends) -> dict:
+    stored = store_trend_embeddings(db, trends)
+    db.commit()
+    index_trend_embeddings(stored)
+    assigned = assign_trends(db, user_id, trends)
+    db.commit()
+    return {"embedded": len(stored), "assigned": len(assigned or {})}
+
+
+async def handle_clustering(job) -> dict:
+    trend_ids = [int(trend_id) for trend_id in job.payload.get("trend_ids", [])]
+    db = SessionLocal()
+    try:
+        trends = await asyncio.to_thread(_load_for_clustering, db, trend_ids)
+        trends = await embed_trend_covers(trends)
+        return await asyncio.to_thread(_store_clusters, db, job.user_id, trends)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+HANDLERS = {
+    job_queue.THUMBNAILS_QUEUE: handle_thumbnails,
+    job_queue.CLUSTERING_QUEUE: handle_clustering,
+}
+
+
+# --- queue plumbing (blocking calls, run in threads) ---
+
+def _in_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class Worker:
+    def __init__(self, concurrency: Dict[str, int]):
+        self.concurrency = concurrency
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = asyncio.Event()
+        self.counters = {stage: {"done": 0, "failed": 0} for stage in concurrency}
+
+    async def run(self) -> None:
+        slots = [
+            asyncio.create_task(self._rescan_slot() if stage == RESCAN_STAGE else self._queue_slot(stage))
+            for stage, count in self.concurrency.items()
+            for _ in range(count)
+        ]
+        logger.info(f"👷 Worker {self.worker_id} started: {self.concurrency}")
+        await self.stopping.wait()
+        logger.info("🛑 Worker stopping: finishing running jobs...")
+        await asyncio.gather(*slots, return_exceptions=True)
+        await thumbnail_pipeline.aclose()
+        await get_ml_client().aclose()
+        logger.info(f"Worker {self.worker_id} stopped: {self.counters}")
+
+    async def _idle(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self.stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _queue_slot(self, queue: str) -> None:
+        handler = HANDLERS[queue]
+        while not self.stopping.is_set():
+            try:
+                jobs = await asyncio.to_thread(_in_session, job_queue.claim, queue, self.worker_id, 1)
+            except Exception as e:
+                logger.error(f"Claiming from {queue} failed: {e}")
+                jobs = []
+            if not jobs:
+                await self._idle(WORKER_POLL_SECONDS)
+                continue
+
+            job = jobs[0]
+            heartbeat = asyncio.create_task(self._keep_leased(job.id))
+            try:
+                result = await handler(job)
+                await asyncio.to_thread(_in_session, job_queue.complete, job.id, self.worker_id, result)
+                self.counters[queue]["done"] += 1
+            except Exception as e:
+                logger.error(f"{queue} job {job.id} failed (attempt {job.attempts}/{job.max_attempts}): {e}")
+                self.counters[queue]["failed"] += 1
+                try:
+                    await asyncio.to_thread(_in_session, job_queue.fail, job.id, self.worker_id, str(e))
+                except Exception as fail_error:
+                    # Lease runs out -> the job is claimed again
+                    logger.error(f"Marking job {job.id} failed: {fail_error}")
+            finally:
+                heartbeat.cancel()
+
+    async def _keep_leased(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(job_queue.PIPELINE_LEASE_SECONDS / 3)
+            try:
+                if not await asyncio.to_thread(_in_session, job_queue.extend_lease, job_id, self.worker_id):
+                    logger.warning(f"Lost the lease on job {job_id}")
+                    return
+            except Exception as e:
+                logger.warning(f"Extending lease of job {job_id} failed: {e}")
+
+    async def _rescan_slot(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                result = await run_in_rescan_executor(dispatch_due)
+            except Exception as e:
+                logger.error(f"Rescan dispatch failed: {e}")
+                result = {}
+            self.counters[RESCAN_STAGE]["done"] += result.get("claimed", 0)
+            if not result.get("claimed"):
+                await self._idle(RESCAN_DISPATCH_INTERVAL_SECONDS)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="TrendScout pipeline worker")
+    parser.add_argument("--queues", default=None, help=f"comma-separated stages ({', '.join(STAGES)})")
+    parser.add_argument("--concurrency", default=WORKER_CONCURRENCY, help="stage=N,... slots per stage")
+    args = parser.parse_args()
+
+    concurrency = parse_concurrency(args.concurrency)
+    if args.queues:
+        stages = [stage.strip() for stage in args.queues.split(",") if stage.strip()]
+        concurrency = {stage: concurrency.get(stage, 1) for stage in parse_concurrency(",".join(stages))}
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    async def run():
+        worker = Worker(concurrency)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, worker.stopping.set)
+        await worker.run()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()